@@ -0,0 +1,352 @@
+"""Run metrics aggregated as lobbies leave matchmaking, without keeping the lobbies.
+
+`RunAnalytics` is a results writer folding every started lobby and canceled party
+into per bracket statistics: wait times, fill ratio, gear score spread within the
+lobby and cancel rate. Distributions are kept in fixed-width histograms and
+quantile sketches, so memory does not grow with the run and a summary file is a
+few kilobytes.
+
+Summaries of many runs merge into one, e.g. every seed of a policy, to compare
+policies without storing or reparsing lobby dumps:
+
+    python analytics.py run_*.summary.json --output merged.json
+"""
+
+import argparse
+import json
+import math
+from dataclasses import dataclass, field
+
+import core
+from schema import LobbyStatus, Map
+from writers import ResultsWriter
+
+SUMMARY_VERSION = 1
+
+
+class QuantileSketch:
+    """Quantiles of a stream of non-negative values, within `relative_accuracy`.
+
+    Values go to logarithmic buckets, so any quantile is off by at most
+    `relative_accuracy` of its value whatever the distribution. Sketches with the
+    same accuracy merge by adding up their buckets.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        # {bucket index: count}, bucket i holds values in (gamma^(i-1), gamma^i]
+        self.buckets: dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "QuantileSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches with different accuracies")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        "Value q of the way through the sorted values, 0 without any"
+        if not self.count:
+            return 0.0
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * self.gamma**index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": {str(index): count for index, count in self.buckets.items()},
+            "zeros": self.zeros,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuantileSketch":
+        sketch = cls(data["relative_accuracy"])
+        sketch.buckets = {int(index): count for index, count in data["buckets"].items()}
+        sketch.zeros = data["zeros"]
+        sketch.count = data["count"]
+        sketch.total = data["total"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+class Histogram:
+    "Counts of values in bins of `width` from 0, growing as larger values come in"
+
+    def __init__(self, width: float):
+        self.width = width
+        self.counts: list[int] = []
+
+    def add(self, value: float):
+        # nudged so values on a bin edge, like 0.7 of a lobby, don't round down
+        index = max(int(value / self.width + 1e-9), 0)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+
+    def merge(self, other: "Histogram"):
+        if other.width != self.width:
+            raise ValueError("Can't merge histograms with different bin widths")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+
+    def to_dict(self) -> dict:
+        return {"width": self.width, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        histogram = cls(data["width"])
+        histogram.counts = list(data["counts"])
+        return histogram
+
+
+@dataclass
+class BracketStats:
+    "Running statistics of one (map, party_size) bracket"
+
+    lobbies_started: int = 0
+    lobbies_filling: int = 0
+    players_started: int = 0
+    parties_canceled: int = 0
+    players_canceled: int = 0
+    fill_total: float = 0.0
+    wait: QuantileSketch = field(default_factory=QuantileSketch)
+    wait_histogram: Histogram = field(default_factory=lambda: Histogram(10))
+    fill_histogram: Histogram = field(default_factory=lambda: Histogram(0.05))
+    gs_spread: QuantileSketch = field(default_factory=QuantileSketch)
+
+    def add_started(self, lobby: core.Lobby):
+        players = lobby.current_player_count()
+        fill = players / lobby.max_players
+        gear_scores = [p.gear_score for party in lobby.parties for p in party.players]
+
+        self.lobbies_started += 1
+        self.players_started += players
+        self.fill_total += fill
+        self.fill_histogram.add(fill)
+        self.wait.add(lobby.queue_time)
+        self.wait_histogram.add(lobby.queue_time)
+        self.gs_spread.add(max(gear_scores, default=0) - min(gear_scores, default=0))
+
+    def add_canceled(self, party: core.Party):
+        self.parties_canceled += 1
+        self.players_canceled += len(party)
+
+    def merge(self, other: "BracketStats"):
+        self.lobbies_started += other.lobbies_started
+        self.lobbies_filling += other.lobbies_filling
+        self.players_started += other.players_started
+        self.parties_canceled += other.parties_canceled
+        self.players_canceled += other.players_canceled
+        self.fill_total += other.fill_total
+        self.wait.merge(other.wait)
+        self.wait_histogram.merge(other.wait_histogram)
+        self.fill_histogram.merge(other.fill_histogram)
+        self.gs_spread.merge(other.gs_spread)
+
+    def report(self) -> dict:
+        "Headline metrics, cancel rate being the share of players sent back to menu"
+        players = self.players_started + self.players_canceled
+        return {
+            "started_lobbies": self.lobbies_started,
+            "filling_lobbies": self.lobbies_filling,
+            "fill_rate": (
+                self.fill_total / self.lobbies_started if self.lobbies_started else 0.0
+            ),
+            "mean_wait_secs": self.wait.mean,
+            "p50_wait_secs": self.wait.quantile(0.5),
+            "p95_wait_secs": self.wait.quantile(0.95),
+            "p99_wait_secs": self.wait.quantile(0.99),
+            "mean_gs_spread": self.gs_spread.mean,
+            "p95_gs_spread": self.gs_spread.quantile(0.95),
+            "canceled_parties": self.parties_canceled,
+            "cancel_rate": self.players_canceled / players if players else 0.0,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "lobbies_started": self.lobbies_started,
+            "lobbies_filling": self.lobbies_filling,
+            "players_started": self.players_started,
+            "parties_canceled": self.parties_canceled,
+            "players_canceled": self.players_canceled,
+            "fill_total": self.fill_total,
+            "wait": self.wait.to_dict(),
+            "wait_histogram": self.wait_histogram.to_dict(),
+            "fill_histogram": self.fill_histogram.to_dict(),
+            "gs_spread": self.gs_spread.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BracketStats":
+        return cls(
+            lobbies_started=data["lobbies_started"],
+            lobbies_filling=data["lobbies_filling"],
+            players_started=data["players_started"],
+            parties_canceled=data["parties_canceled"],
+            players_canceled=data["players_canceled"],
+            fill_total=data["fill_total"],
+            wait=QuantileSketch.from_dict(data["wait"]),
+            wait_histogram=Histogram.from_dict(data["wait_histogram"]),
+            fill_histogram=Histogram.from_dict(data["fill_histogram"]),
+            gs_spread=QuantileSketch.from_dict(data["gs_spread"]),
+        )
+
+
+class Summary:
+    "Bracket statistics of one or more runs, keyed `map/party_size`"
+
+    def __init__(self, brackets: dict[str, BracketStats] | None = None, runs=1):
+        self.brackets = brackets if brackets is not None else {}
+        self.runs = runs
+
+    def bracket(self, map_: Map | str, party_size: int) -> BracketStats:
+        key = f"{Map(map_).value}/{party_size}"
+        stats = self.brackets.get(key)
+        if stats is None:
+            stats = self.brackets[key] = BracketStats()
+        return stats
+
+    def merge(self, other: "Summary"):
+        "Adds another summary's runs to this one"
+        for key, stats in other.brackets.items():
+            if key in self.brackets:
+                self.brackets[key].merge(stats)
+            else:
+                self.brackets[key] = BracketStats.from_dict(stats.to_dict())
+        self.runs += other.runs
+
+    def report(self) -> dict:
+        "Headline metrics of every bracket and of all brackets together, as 'all'"
+        total = BracketStats()
+        report = {}
+        for key in sorted(self.brackets):
+            total.merge(self.brackets[key])
+            report[key] = self.brackets[key].report()
+        report["all"] = total.report()
+        return report
+
+    def to_dict(self) -> dict:
+        return {
+            "version": SUMMARY_VERSION,
+            "runs": self.runs,
+            "brackets": {key: stats.to_dict() for key, stats in self.brackets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Summary":
+        if data.get("version") != SUMMARY_VERSION:
+            raise ValueError(f"Not a version {SUMMARY_VERSION} summary")
+        brackets = {
+            key: BracketStats.from_dict(stats)
+            for key, stats in data["brackets"].items()
+        }
+        return cls(brackets, runs=data["runs"])
+
+
+def write_summary(path: str, summary: Summary):
+    with open(path, "w") as f:
+        json.dump(summary.to_dict(), f, sort_keys=True)
+
+
+def read_summary(path: str) -> Summary:
+    with open(path) as f:
+        return Summary.from_dict(json.load(f))
+
+
+def merge_summaries(paths: list[str]) -> Summary:
+    "One summary of every run in the summary files"
+    merged = Summary(runs=0)
+    for path in paths:
+        merged.merge(read_summary(path))
+    return merged
+
+
+class RunAnalytics(ResultsWriter):
+    """Folds lobbies and canceled parties into a `Summary` as a run hands them over.
+
+    Lobbies still filling at the end only count towards `filling_lobbies`. With a
+    path the summary is written there on close."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.summary = Summary()
+
+    def write_lobby(self, lobby: core.Lobby):
+        stats = self.summary.bracket(lobby.map, lobby.party_size)
+        if lobby.status == LobbyStatus.started:
+            stats.add_started(lobby)
+        elif lobby.status == LobbyStatus.filling:
+            stats.lobbies_filling += 1
+
+    def write_canceled_party(self, party: core.Party):
+        self.summary.bracket(party.map, party.max_size).add_canceled(party)
+
+    def close(self):
+        if self.path is not None:
+            write_summary(self.path, self.summary)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Merges run summaries and prints their metrics per bracket"
+    )
+    parser.add_argument("summaries", type=str, nargs="+", help="Summary files.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="File to write the merged summary to, for merging further.",
+    )
+
+    args = parser.parse_args()
+
+    merged = merge_summaries(args.summaries)
+    if args.output:
+        write_summary(args.output, merged)
+    print(json.dumps({"runs": merged.runs, **merged.report()}, indent=2))
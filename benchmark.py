@@ -0,0 +1,424 @@
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from collections import deque
+from typing import Callable
+
+import matchmaking as matchmaking
+import mmr
+import simulation as simulation
+import sweep as sweep
+import workload as workload
+from schema import LobbyStatus, Map
+
+BASELINE_PATH = "benchmark_baseline.json"
+
+# parties queue at the simulator's average rate of 1.5 per second
+ARRIVALS_PER_SEC = 1.5
+
+# every benchmark runs at least REPEATS times and for at least MIN_SECS, keeping
+# its best figures, so a single slow run doesn't count as a regression
+REPEATS = 5
+MIN_SECS = 0.5
+# smaller queues finish in about a millisecond, too noisy to fail a run on
+GATE_SIZE = 10_000
+
+
+def synthetic_queue(num_parties: int, party_size: int, seed=0) -> list:
+    "Reproducible queue of parties for one party size on one map"
+    config = workload.WorkloadConfig(
+        party_size_weights={party_size: 1.0}, map_weights={Map.goblin_caves: 1.0}
+    )
+    return workload.generate_batch(random.Random(seed), config, num_parties)
+
+
+def percentile_ns(latencies: list[int], pct: float) -> float:
+    "Nearest-rank percentile of sorted latencies, in microseconds"
+    rank = max(round(pct / 100 * len(latencies)), 1)
+    return latencies[rank - 1] / 1000
+
+
+def bench_placement(parties: list, max_queue_time_secs=300, mmr_threshold=50) -> dict:
+    """Places a queue one party at a time like the simulator does.
+
+    Full lobbies start right away and lobbies older than `max_queue_time_secs` start
+    or cancel, so the number of filling lobbies stays at its steady state.
+    """
+
+    lobby_index = matchmaking.LobbyIndex()
+    # lobbies are created in time order so their deadlines are too
+    deadlines: deque = deque()
+    latencies = []
+
+    start = time.perf_counter()
+    for i, party in enumerate(parties):
+        now = int(i / ARRIVALS_PER_SEC)
+        while deadlines and deadlines[0].created_at + max_queue_time_secs <= now:
+            lobby = deadlines.popleft()
+            if lobby.status == LobbyStatus.filling:
+                lobby.queue_time = now - lobby.created_at
+                matchmaking.maybe_start_lobby(lobby, max_queue_time_secs)
+                lobby_index.remove(lobby)
+
+        placed_at = time.perf_counter_ns()
+        new_lobbies: list = []
+        lobby = matchmaking.place_party(
+            new_lobbies,
+            party,
+            lobby_index=lobby_index,
+            created_at=now,
+            mmr_threshold=mmr_threshold,
+        )
+        latencies.append(time.perf_counter_ns() - placed_at)
+
+        if new_lobbies:
+            deadlines.append(lobby)
+        elif matchmaking.is_lobby_full(lobby):
+            matchmaking.maybe_start_lobby(lobby, max_queue_time_secs)
+            lobby_index.remove(lobby)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "parties_per_sec": len(parties) / elapsed,
+        "p50_us": percentile_ns(latencies, 50),
+        "p99_us": percentile_ns(latencies, 99),
+    }
+
+
+def bench_can_add_party_to_lobby(parties: list, mmr_threshold=50) -> dict:
+    "Checks every party against a lobby holding the parties before it"
+    lobbies = []
+    for i in range(0, len(parties), 5):
+        lobby = matchmaking.create_lobby(parties[i])
+        lobby.parties.extend(parties[i + 1 : i + 5])  # noqa: E203
+        lobbies.append(lobby)
+
+    latencies = []
+    start = time.perf_counter()
+    for party, lobby in zip(parties, lobbies * 5):
+        checked_at = time.perf_counter_ns()
+        matchmaking.can_add_party_to_lobby(lobby, party, mmr_threshold=mmr_threshold)
+        latencies.append(time.perf_counter_ns() - checked_at)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "checks_per_sec": len(latencies) / elapsed,
+        "p50_us": percentile_ns(latencies, 50),
+        "p99_us": percentile_ns(latencies, 99),
+    }
+
+
+def bench_maybe_start_lobby(parties: list) -> dict:
+    "Starts lobbies packed with the queued parties, past their max queue time"
+    lobbies = []
+    party_size = parties[0].max_size
+    for i in range(0, len(parties), 5):
+        lobby = matchmaking.create_lobby(parties[i], created_at=0)
+        lobby.parties.extend(parties[i + 1 : i + 5])  # noqa: E203
+        lobby.party_size = party_size
+        lobby.queue_time = 300
+        lobbies.append(lobby)
+
+    latencies = []
+    start = time.perf_counter()
+    for lobby in lobbies:
+        started_at = time.perf_counter_ns()
+        matchmaking.maybe_start_lobby(lobby, max_queue_time_secs=300)
+        latencies.append(time.perf_counter_ns() - started_at)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "lobbies_per_sec": len(lobbies) / elapsed,
+        "p50_us": percentile_ns(latencies, 50),
+        "p99_us": percentile_ns(latencies, 99),
+    }
+
+
+def bench_mmr_strategy(parties: list, mmr_method: str) -> dict:
+    """Rates a queue one party at a time and as one batch from player arrays.
+
+    The batch figure excludes building the arrays, which `party_mmrs` adds."""
+
+    strategy = mmr.resolve(mmr_method)
+    party_mmr = strategy.party_mmr
+
+    start = time.perf_counter()
+    for party in parties:
+        party_mmr(party)
+    scalar_elapsed = time.perf_counter() - start
+
+    players = mmr.PlayerArrays.from_parties(parties)
+    start = time.perf_counter()
+    strategy.batch_mmr(players)
+    batch_elapsed = time.perf_counter() - start
+
+    return {
+        "parties_per_sec": len(parties) / scalar_elapsed,
+        "batch_parties_per_sec": len(parties) / batch_elapsed,
+    }
+
+
+def bench_simulator(num_parties: int, engine="event", seed=0) -> dict:
+    """Full simulator run long enough to queue about `num_parties` parties.
+
+    The workload is generated up front so only matchmaking is timed."""
+
+    simulated_secs = int(num_parties / ARRIVALS_PER_SEC)
+    config = workload.WorkloadConfig(arrival_rate=ARRIVALS_PER_SEC)
+    arrivals = list(workload.generate_workload(config, simulated_secs, seed=seed))
+
+    start = time.perf_counter()
+    simulation.ENGINES[engine](
+        simulated_secs=simulated_secs, retain=False, arrivals=arrivals
+    )
+    elapsed = time.perf_counter() - start
+    return {"parties_per_sec": num_parties / elapsed}
+
+
+def compare_batch(
+    simulated_secs=3600,
+    batch_secs: list[int] | None = None,
+    max_queue_time_secs=300,
+    mmr_threshold=50,
+    seed=0,
+) -> dict:
+    """Greedy placement against batch assignment every `batch_secs` on one workload.
+
+    Each run replays the same generated parties and reports the `sweep` metrics of
+    its started lobbies next to how long matchmaking took."""
+
+    config = workload.WorkloadConfig(arrival_rate=ARRIVALS_PER_SEC)
+    runs: list[tuple[str, str, dict]] = [("greedy", "tick", {})]
+    runs.extend(
+        (f"batch_{secs}s", "batch", {"batch_secs": secs}) for secs in batch_secs or [10]
+    )
+
+    report = {}
+    for name, engine, kwargs in runs:
+        # runs merge parties, so each one gets its own copy of the workload
+        arrivals = list(workload.generate_workload(config, simulated_secs, seed=seed))
+        start = time.perf_counter()
+        results = simulation.ENGINES[engine](
+            simulated_secs=simulated_secs,
+            max_queue_time_secs=max_queue_time_secs,
+            mmr_threshold=mmr_threshold,
+            arrivals=arrivals,
+            **kwargs,
+        )
+        compute_secs = time.perf_counter() - start
+        report[name] = {
+            **sweep.summarize_results(results),
+            "compute_secs": compute_secs,
+        }
+    return report
+
+
+def best_of(results: list[dict]) -> dict:
+    "Best figure of every metric across runs, highest throughput and lowest latency"
+    best = dict(results[0])
+    for result in results[1:]:
+        for metric, value in result.items():
+            if metric.endswith("_per_sec"):
+                best[metric] = max(best[metric], value)
+            else:
+                best[metric] = min(best[metric], value)
+    return best
+
+
+def measure(
+    fn: Callable[[], dict], memory: bool, repeats=REPEATS, min_secs=MIN_SECS
+) -> dict:
+    """Best of running a benchmark `repeats` times and for at least `min_secs`.
+
+    With `memory` it runs once more under tracemalloc for its peak memory."""
+
+    results: list[dict] = []
+    start = time.perf_counter()
+    while len(results) < repeats or time.perf_counter() - start < min_secs:
+        results.append(fn())
+    result = best_of(results)
+    if memory:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_mib"] = peak / 2**20
+    return result
+
+
+def run_benchmarks(
+    sizes: list[int], seed=0, memory=True, repeats=REPEATS, min_secs=MIN_SECS
+) -> dict:
+    "Every benchmark for every queue size and party size, keyed by name"
+    report = {}
+
+    def measure_best(fn: Callable[[], dict]) -> dict:
+        return measure(fn, memory, repeats=repeats, min_secs=min_secs)
+
+    for num_parties in sizes:
+        for party_size, bracket in [(1, "solo"), (2, "duo"), (3, "trio")]:
+
+            def queue():
+                return synthetic_queue(num_parties, party_size, seed=seed)
+
+            name = f"{bracket}_{num_parties}"
+            report[f"place_party/{name}"] = measure_best(
+                lambda: bench_placement(queue())
+            )
+            report[f"can_add_party_to_lobby/{name}"] = measure_best(
+                lambda: bench_can_add_party_to_lobby(queue())
+            )
+            report[f"maybe_start_lobby/{name}"] = measure_best(
+                lambda: bench_maybe_start_lobby(queue())
+            )
+
+        mixed_queue = workload.generate_batch(
+            random.Random(seed), workload.WorkloadConfig(), num_parties
+        )
+        for mmr_method in mmr.STRATEGIES:
+            report[f"mmr_{mmr_method}/{num_parties}"] = measure_best(
+                lambda: bench_mmr_strategy(mixed_queue, mmr_method)
+            )
+
+        for engine in simulation.ENGINES:
+            report[f"simulator_{engine}/{num_parties}"] = measure_best(
+                lambda: bench_simulator(num_parties, engine=engine, seed=seed)
+            )
+
+    return report
+
+
+def queue_size(name: str) -> int:
+    "Queue size a benchmark ran with, the number its name ends in"
+    return int(name.replace("/", "_").rsplit("_", 1)[-1])
+
+
+def compare_to_baseline(
+    report: dict, baseline: dict, tolerance=0.3, gate_size=GATE_SIZE
+) -> list[str]:
+    """Benchmarks whose throughput fell more than `tolerance` below the baseline.
+
+    Only benchmarks present in both with queues of at least `gate_size` parties are
+    compared, throughput being any `*_per_sec` value."""
+
+    regressions = []
+    for name, result in report.items():
+        if queue_size(name) < gate_size:
+            continue
+        for metric, value in result.items():
+            if not metric.endswith("_per_sec"):
+                continue
+            baseline_value = baseline.get(name, {}).get(metric)
+            if baseline_value and value < baseline_value * (1 - tolerance):
+                regressions.append(
+                    f"{name} {metric}: {value:.0f} vs baseline {baseline_value:.0f}"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Matchmaking benchmarks")
+
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="Queue depths to benchmark, e.g. add 1000000 for a full run.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for queues.")
+    parser.add_argument(
+        "--no_memory", action="store_true", help="Skip the peak memory pass."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=BASELINE_PATH,
+        help="Stored results to compare throughput against.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="Allowed throughput drop against the baseline before failing.",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=REPEATS,
+        help="Runs of every benchmark at least, keeping the best figures.",
+    )
+    parser.add_argument(
+        "--min_secs",
+        type=float,
+        default=MIN_SECS,
+        help="Seconds every benchmark runs for at least, repeating it.",
+    )
+    parser.add_argument(
+        "--gate_size",
+        type=int,
+        default=GATE_SIZE,
+        help="Smallest queue size whose throughput is compared to the baseline.",
+    )
+    parser.add_argument(
+        "--compare_batch",
+        type=int,
+        nargs="+",
+        default=None,
+        metavar="BATCH_SECS",
+        help="Only compare greedy placement with batch assignment every BATCH_SECS.",
+    )
+    parser.add_argument(
+        "--save_baseline",
+        action="store_true",
+        help="Store this run as the new baseline instead of comparing.",
+    )
+
+    args = parser.parse_args()
+
+    if args.compare_batch:
+        comparison = compare_batch(batch_secs=args.compare_batch, seed=args.seed)
+        for name, result in comparison.items():
+            values = " ".join(
+                f"{metric}={value:.2f}" for metric, value in result.items()
+            )
+            print(f"{name:12} {values}")
+        sys.exit(0)
+
+    report = run_benchmarks(
+        args.sizes,
+        seed=args.seed,
+        memory=not args.no_memory,
+        repeats=args.repeats,
+        min_secs=args.min_secs,
+    )
+    for name, result in report.items():
+        values = " ".join(f"{metric}={value:.2f}" for metric, value in result.items())
+        print(f"{name:40} {values}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, sort_keys=True, indent=2)
+        sys.exit(0)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, run with --save_baseline")
+        sys.exit(0)
+
+    regressions = compare_to_baseline(
+        report, baseline, tolerance=args.tolerance, gate_size=args.gate_size
+    )
+    if regressions:
+        print("Performance regressions:")
+        print("\n".join(regressions))
+        sys.exit(1)
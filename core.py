@@ -0,0 +1,146 @@
+"""Lightweight models for the matchmaking hot path.
+
+`schema` models validate every field on creation and carry a per-instance dict,
+which adds up when millions of players are generated and matched. These slotted
+dataclasses have the same attributes and methods `matchmaking` uses, without any
+validation. Validate at the boundary with the `schema` models and convert with
+`from_model`/`to_model`.
+"""
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import schema
+from schema import Job, LobbyStatus, Map, max_lobby_players
+
+if TYPE_CHECKING:
+    from mmr import MMRStrategy
+
+
+@dataclass(slots=True)
+class Player:
+    job: Job
+    level: int
+    gear_score: int
+
+    @classmethod
+    def from_model(cls, player: schema.Player) -> "Player":
+        return cls(job=player.job, level=player.level, gear_score=player.gear_score)
+
+    def to_model(self) -> schema.Player:
+        return schema.Player(job=self.job, level=self.level, gear_score=self.gear_score)
+
+
+@dataclass(slots=True)
+class Party:
+    players: list[Player]
+    map: Map
+    max_size: int
+
+    # gear score aggregates the mmr functions read, kept in sync with players
+    max_gear_score: int = field(init=False, repr=False, compare=False)
+    total_gear_score: int = field(init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name == "players":
+            self._refresh_gear_score()
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    @classmethod
+    def from_model(cls, party: schema.Party) -> "Party":
+        return cls(
+            players=[Player.from_model(p) for p in party.players],
+            map=party.map,
+            max_size=party.max_size,
+        )
+
+    def to_model(self) -> schema.Party:
+        return schema.Party(
+            players=[p.to_model() for p in self.players],
+            map=self.map,
+            max_size=self.max_size,
+        )
+
+    @classmethod
+    def with_gear_score(
+        cls,
+        players: list[Player],
+        map: Map,
+        max_size: int,
+        max_gear_score: int,
+        total_gear_score: int,
+    ) -> "Party":
+        "Party whose gear score aggregates are already known, skipping the recount"
+        party = cls.__new__(cls)
+        object.__setattr__(party, "players", players)
+        object.__setattr__(party, "map", map)
+        object.__setattr__(party, "max_size", max_size)
+        object.__setattr__(party, "max_gear_score", max_gear_score)
+        object.__setattr__(party, "total_gear_score", total_gear_score)
+        return party
+
+    def add_players(self, players: list[Player]):
+        "Adds players to the party, updating gear score aggregates in place"
+        object.__setattr__(self, "players", self.players + players)
+        self.max_gear_score = max(
+            self.max_gear_score, max(p.gear_score for p in players)
+        )
+        self.total_gear_score += sum(p.gear_score for p in players)
+
+    def _refresh_gear_score(self):
+        self.max_gear_score = max((p.gear_score for p in self.players), default=0)
+        self.total_gear_score = sum(p.gear_score for p in self.players)
+
+
+@dataclass(slots=True)
+class Lobby:
+    parties: list[Party]
+    map: Map
+
+    # solo/duo/trio
+    party_size: int
+
+    queue_time: int = 0
+    # simulated second the lobby was created in
+    created_at: int = 0
+    status: LobbyStatus = LobbyStatus.filling
+
+    # {mmr strategy: (min, max)} of party mmrs, maintained by matchmaking
+    _mmr_ranges: dict["MMRStrategy", tuple[float, float]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # {free slots: [partial parties]}, built by matchmaking on the first merge
+    _open_parties: dict[int, list[Party]] | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    @property
+    def max_players(self) -> int:
+        return max_lobby_players(self.party_size)
+
+    def current_player_count(self) -> int:
+        return sum(map(len, self.parties))
+
+    @classmethod
+    def from_model(cls, lobby: schema.Lobby) -> "Lobby":
+        return cls(
+            parties=[Party.from_model(p) for p in lobby.parties],
+            map=lobby.map,
+            party_size=lobby.party_size,
+            queue_time=lobby.queue_time,
+            created_at=lobby.created_at,
+            status=lobby.status,
+        )
+
+    def to_model(self) -> schema.Lobby:
+        return schema.Lobby(
+            parties=[p.to_model() for p in self.parties],
+            map=self.map,
+            party_size=self.party_size,
+            queue_time=self.queue_time,
+            created_at=self.created_at,
+            status=self.status,
+        )
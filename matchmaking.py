@@ -1,21 +1,17 @@
-from typing import Tuple
+import heapq
+import math
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from typing import Callable, Iterator, Tuple, overload
 
-from schema import Lobby, LobbyStatus, Party
+import metrics
+import mmr
+import schema
+from core import Lobby, Party
 
-
-# MMR Heirutrics
-def max_gearscore_mmr(party: Party) -> float:
-    mmr = max(player.gear_score for player in party.players)
-    return mmr
-
-
-def average_gearscore_mmr(party: Party) -> float:
-    total_mmr = sum(player.gear_score for player in party.players)
-    average_mmr = total_mmr / len(party.players)
-    return average_mmr
-
-
-MMR_FUNCTIONS = {"max_gs": max_gearscore_mmr, "avg_gs": average_gearscore_mmr}
+# MMR heuristics live in mmr, importable from here as before
+from mmr import MMR_FUNCTIONS, average_gearscore_mmr, max_gearscore_mmr  # noqa: F401
+from schema import LobbyStatus, Map
 
 
 def are_parties_matchable(
@@ -30,43 +26,202 @@ def are_parties_matchable(
     return can_match
 
 
+def lobby_mmr_range(
+    lobby: Lobby, mmr_method: str | mmr.MMRStrategy = "max_gs"
+) -> tuple[float, float] | None:
+    """Lowest and highest party mmr in lobby, None for an empty lobby.
+
+    Computed once per mmr method, then kept up to date as parties are added."""
+
+    strategy = mmr.resolve(mmr_method)
+    mmr_range = lobby._mmr_ranges.get(strategy)
+    if mmr_range is None:
+        mmr_range = _compute_mmr_range(lobby, strategy)
+    return mmr_range
+
+
+def _compute_mmr_range(
+    lobby: Lobby, strategy: mmr.MMRStrategy
+) -> tuple[float, float] | None:
+    if not lobby.parties:
+        return None
+    mmrs = [strategy.party_mmr(p) for p in lobby.parties]
+    mmr_range = (min(mmrs), max(mmrs))
+    lobby._mmr_ranges[strategy] = mmr_range
+    return mmr_range
+
+
+def _filled_mmr_range(lobby: Lobby, strategy: mmr.MMRStrategy) -> tuple[float, float]:
+    "Like `lobby_mmr_range` for a lobby holding parties, as indexed lobbies do"
+    mmr_range = lobby._mmr_ranges.get(strategy)
+    if mmr_range is None:
+        mmrs = list(map(strategy.party_mmr, lobby.parties))
+        mmr_range = lobby._mmr_ranges[strategy] = (min(mmrs), max(mmrs))
+    return mmr_range
+
+
+def _extend_mmr_ranges(lobby: Lobby, party: Party):
+    "Widens cached mmr ranges of lobby after party was appended to it"
+    for strategy, (low, high) in lobby._mmr_ranges.items():
+        party_mmr = strategy.party_mmr(party)
+        lobby._mmr_ranges[strategy] = (min(low, party_mmr), max(high, party_mmr))
+
+
 def can_add_party_to_lobby(
-    lobby: Lobby, party: Party, mmr_method="max_gs", mmr_threshold=50
+    lobby: Lobby,
+    party: Party,
+    mmr_method: str | mmr.MMRStrategy = "max_gs",
+    mmr_threshold=50,
 ) -> bool:
     """Determines if party can be added to lobby.
 
-    Every party in the lobby must be matchable with new potential party"""
+    Every party in the lobby must be matchable with new potential party, which holds
+    when the party is matchable with the lowest and highest mmr in the lobby.
+    Resolve `mmr_method` once with `mmr.resolve` to skip the name lookup."""
 
-    try:
-        mmr_fn = MMR_FUNCTIONS[mmr_method]
-    except KeyError:
-        raise NotImplementedError(f"No implementation for mmr method: {mmr_method}")
+    strategy = mmr.resolve(mmr_method)
 
-    for lobby_party in lobby.parties:
-        if not are_parties_matchable(
-            lobby_party, party, mmr_fn=mmr_fn, mmr_threshold=mmr_threshold
-        ):
-            return False
+    metrics.incr("mmr_checks")
+    mmr_range = lobby._mmr_ranges.get(strategy)
+    if mmr_range is None:
+        mmr_range = _compute_mmr_range(lobby, strategy)
+        if mmr_range is None:
+            return True
 
-    return True
+    low, high = mmr_range
+    party_mmr = strategy.party_mmr(party)
+    return party_mmr - low <= mmr_threshold and high - party_mmr <= mmr_threshold
+
+
+@dataclass(frozen=True)
+class ThresholdSchedule:
+    """MMR threshold that widens the longer a lobby has been filling.
+
+    `steps` are (queue_time_secs, mmr_threshold) in increasing queue time. A lobby
+    filling for at least queue_time_secs takes parties within that threshold,
+    younger lobbies use `mmr_threshold`.
+    """
+
+    mmr_threshold: float = 50
+    steps: tuple[tuple[int, float], ...] = ()
+
+    def threshold(self, queue_time: int) -> float:
+        "Threshold of a lobby that has been filling for queue_time seconds"
+        mmr_threshold = self.mmr_threshold
+        for step_secs, step_threshold in self.steps:
+            if queue_time < step_secs:
+                break
+            mmr_threshold = step_threshold
+        return mmr_threshold
 
+    @property
+    def max_threshold(self) -> float:
+        return max([self.mmr_threshold, *(t for _, t in self.steps)])
 
-def is_possible_lobby(lobby: Lobby, party: Party) -> bool:
+    @classmethod
+    def parse(cls, mmr_threshold: float, steps: list[str]) -> "ThresholdSchedule":
+        "Schedule from steps like '60:75', threshold 75 after 60 seconds"
+        parsed = []
+        for step in steps:
+            step_secs, step_threshold = step.split(":")
+            parsed.append((int(step_secs), float(step_threshold)))
+        return cls(mmr_threshold, tuple(sorted(parsed)))
+
+
+def is_possible_lobby(
+    lobby: Lobby,
+    party: Party,
+    mmr_method: str | mmr.MMRStrategy = "max_gs",
+    mmr_threshold=50,
+) -> bool:
     correct_map = lobby.map == party.map
     correct_size = party.max_size <= lobby.party_size
-    correct_mmr = can_add_party_to_lobby(lobby, party)
+    correct_mmr = can_add_party_to_lobby(
+        lobby, party, mmr_method=mmr_method, mmr_threshold=mmr_threshold
+    )
 
     return correct_map and correct_size and correct_mmr
 
 
-def attempt_merge_party(lobby: Lobby, new_party: Party) -> Tuple[bool, Party]:
+def open_parties(lobby: Lobby) -> dict[int, list[Party]]:
+    "Partial parties of lobby bucketed by free slots, in lobby order per bucket"
+    buckets = lobby._open_parties
+    if buckets is None:
+        buckets = {}
+        for party in lobby.parties:
+            free_slots = lobby.party_size - len(party)
+            if free_slots > 0:
+                buckets.setdefault(free_slots, []).append(party)
+        lobby._open_parties = buckets
+
+    return buckets
+
+
+def _merge_keeps_range(
+    lobby: Lobby,
+    existing_party: Party,
+    new_party: Party,
+    strategy: mmr.MMRStrategy,
+    mmr_threshold: float,
+) -> bool:
+    "Whether merging new_party into existing_party keeps lobby within mmr_threshold"
+    merged = type(existing_party)(
+        players=existing_party.players + new_party.players,
+        map=existing_party.map,
+        max_size=existing_party.max_size,
+    )
+    merged_mmr = strategy.party_mmr(merged)
+    new_mmr = strategy.party_mmr(new_party)
+    low, high = _filled_mmr_range(lobby, strategy)
+    low, high = min(low, new_mmr, merged_mmr), max(high, new_mmr, merged_mmr)
+    return high - low <= mmr_threshold
+
+
+def attempt_merge_party(
+    lobby: Lobby,
+    new_party: Party,
+    mmr_method: str | mmr.MMRStrategy | None = None,
+    mmr_threshold=50,
+) -> Tuple[bool, Party]:
+    """Merges new_party into the partial party it fills up the most.
+
+    A solo in trios joins a duo before another solo, so merges finish parties
+    instead of leaving several partial ones that get dropped when the lobby starts.
+    With `mmr_method` a merge must keep the lobby within `mmr_threshold`, checked
+    on the merged party's mmr for strategies that can rate it outside both parties.
+    """
+
     if len(new_party) == lobby.party_size:
         raise Exception("You messed up")
 
-    for existing_party in lobby.parties:
-        if len(existing_party) + len(new_party) <= lobby.party_size:
-            existing_party.players = existing_party.players + new_party.players
-            return True, new_party
+    strategy = None
+    if mmr_method is not None:
+        strategy = mmr.resolve(mmr_method)
+        if strategy.merges_within:
+            strategy = None
+
+    buckets = open_parties(lobby)
+    for free_slots in range(len(new_party), lobby.party_size):
+        bucket = buckets.get(free_slots)
+        if not bucket:
+            continue
+
+        for i, existing_party in enumerate(bucket):
+            if strategy is None or _merge_keeps_range(
+                lobby, existing_party, new_party, strategy, mmr_threshold
+            ):
+                break
+        else:
+            continue
+
+        del bucket[i]
+        existing_party.add_players(new_party.players)
+        if free_slots > len(new_party):
+            buckets.setdefault(free_slots - len(new_party), []).append(existing_party)
+        metrics.incr("merges")
+        # merged party has a new mmr, ranges are recomputed on next check
+        lobby._mmr_ranges.clear()
+        return True, new_party
 
     return False, new_party
 
@@ -87,41 +242,882 @@ def attempt_add_party_to_lobby(
         # if player_count_check:
         if len(party) == lobby.party_size:
             lobby.parties.append(party)
+            _extend_mmr_ranges(lobby, party)
 
             return True, party
 
         else:
             # attempt to combine parties
-            was_merged, party = attempt_merge_party(lobby, party)
+            was_merged, party = attempt_merge_party(
+                lobby, party, mmr_method=mmr_method, mmr_threshold=mmr_threshold
+            )
             return was_merged, party
 
     else:
         return False, party
 
 
+@overload
+def create_lobby(party: Party, created_at=0) -> Lobby: ...
+
+
+@overload
+def create_lobby(party: schema.Party, created_at=0) -> schema.Lobby: ...
+
+
+def create_lobby(party, created_at=0):
+    "New filling lobby for party, using the same model family as the party"
+    metrics.incr("lobbies_created")
+    lobby_cls = Lobby if isinstance(party, Party) else schema.Lobby
+    return lobby_cls(
+        parties=[party],
+        map=party.map,
+        party_size=party.max_size,
+        created_at=created_at,
+    )
+
+
+class SeqBuckets:
+    """Seqs bucketed by mmr, handing out the seqs in an mmr window smallest first.
+
+    Every bucket covers `WIDTH` mmr points and keeps its seqs sorted, so the seqs of
+    a window are the buckets it overlaps merged on a small heap of their heads. A
+    search costs the number of buckets in the window, however many seqs they hold,
+    plus a heap step per seq it passes over.
+    """
+
+    WIDTH = 10
+
+    def __init__(self):
+        # {bucket: sorted seqs}
+        self._buckets: dict[int, list[int]] = {}
+        # {seq: bucket}
+        self._seq_buckets: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._seq_buckets)
+
+    def add(self, seq: int, mmr_value: float):
+        bucket = math.floor(mmr_value / self.WIDTH)
+        self._seq_buckets[seq] = bucket
+        seqs = self._buckets.get(bucket)
+        if seqs is None:
+            self._buckets[bucket] = [seq]
+        elif seqs[-1] < seq:
+            seqs.append(seq)
+        else:
+            insort(seqs, seq)
+
+    def remove(self, seq: int):
+        bucket = self._seq_buckets.pop(seq)
+        seqs = self._buckets[bucket]
+        del seqs[bisect_left(seqs, seq)]
+        if not seqs:
+            del self._buckets[bucket]
+
+    def move(self, seq: int, mmr_value: float):
+        "Moves a seq to a new mmr"
+        if self._seq_buckets[seq] != math.floor(mmr_value / self.WIDTH):
+            self.remove(seq)
+            self.add(seq, mmr_value)
+
+    def oldest(
+        self, low: float, high: float, accept: Callable[[int], bool]
+    ) -> int | None:
+        """Smallest seq with mmr between low and high that accept takes.
+
+        Seqs are passed to accept smallest first until it takes one, and accept may
+        remove the seq it was passed. Seqs in the edge buckets can be just outside
+        the window."""
+
+        width = self.WIDTH
+        buckets: Iterator[list[int] | None]
+        if (
+            math.isfinite(low)
+            and math.isfinite(high)
+            and high - low < width * (len(self._buckets) - 1)
+        ):
+            first, last = math.floor(low / width), math.floor(high / width)
+            buckets = (self._buckets.get(bucket) for bucket in range(first, last + 1))
+        else:
+            # the window spans more buckets than there are, or has no end
+            buckets = (
+                seqs
+                for bucket, seqs in self._buckets.items()
+                if bucket * width <= high and (bucket + 1) * width > low
+            )
+        # [(seq, its index, bucket seqs)], seqs are unique so lists aren't compared
+        heads = [(seqs[0], 0, seqs) for seqs in buckets if seqs]
+        heapq.heapify(heads)
+
+        while heads:
+            seq, i, seqs = heads[0]
+            if accept(seq):
+                return seq
+            if i < len(seqs) and seqs[i] == seq:
+                i += 1
+            if i < len(seqs):
+                heapq.heapreplace(heads, (seqs[i], i, seqs))
+            else:
+                heapq.heappop(heads)
+        return None
+
+
+def _room_for(lobby: Lobby, players: int) -> tuple[int, ...]:
+    "Lengths of parties lobby has room for with players in it, (0,) for none"
+    free = lobby.max_players - players
+    if lobby.party_size == 1:
+        return (1,) if free >= 1 else (0,)
+
+    buckets = lobby._open_parties
+    if buckets is None:
+        # the smallest party has the most free slots, no need to bucket them yet
+        most_open = lobby.party_size - min(map(len, lobby.parties), default=0)
+    else:
+        most_open = max(
+            (slots for slots, parties in buckets.items() if parties), default=0
+        )
+    lengths = list(range(1, min(most_open, free) + 1))
+    if free >= lobby.party_size:
+        lengths.append(lobby.party_size)
+    return tuple(lengths) or (0,)
+
+
+class LobbyIndex:
+    """Filling lobbies by their lowest party mmr, per (map, party_size).
+
+    A lobby can only take a party with mmr `m` if every lobby party is within
+    `mmr_threshold` of `m`, so its lowest mmr has to be in
+    `[m - mmr_threshold, m + mmr_threshold]`. Lobbies are bucketed by lowest mmr in
+    `SeqBuckets` for every length of party they have room for, so a search only
+    walks the lobbies in that window that can take the party, in the order they were
+    added, and stops at the first one that does.
+
+    Full lobbies can't take any party and leave the index when they fill up. Lobbies
+    that stop filling are dropped lazily the next time a search reaches them.
+    """
+
+    def __init__(
+        self,
+        mmr_method: str | mmr.MMRStrategy = "max_gs",
+        lobbies: list[Lobby] | None = None,
+    ):
+        self.mmr_method = mmr.resolve(mmr_method)
+        self.mmr_fn = self.mmr_method.party_mmr
+
+        # {(map, party_size, party length with room): lobby seqs by lowest mmr}
+        self._lobby_seqs: dict[tuple[Map, int, int], SeqBuckets] = {}
+        # {seq: (lobby, min_mmr, max_mmr, party lengths with room)}
+        self._entries: dict[int, tuple[Lobby, float, float, tuple[int, ...]]] = {}
+        # {id(lobby): seq}, seq keeps lobbies in the order they were added
+        self._seqs: dict[int, int] = {}
+        self._next_seq = 0
+
+        self.add_many(lobbies or [])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, lobby: Lobby) -> bool:
+        return id(lobby) in self._seqs
+
+    def add(self, lobby: Lobby):
+        "Adds a filling lobby to the index"
+        seq = self._next_seq
+        self._next_seq += 1
+        self._seqs[id(lobby)] = seq
+        min_mmr, max_mmr = _filled_mmr_range(lobby, self.mmr_method)
+        lengths = _room_for(lobby, lobby.current_player_count())
+        self._entries[seq] = (lobby, min_mmr, max_mmr, lengths)
+        for length in lengths:
+            self._by_mmr(lobby, length).add(seq, min_mmr)
+
+    def add_many(self, lobbies: list[Lobby]):
+        "Adds filling lobbies in order, like `add` without its per lobby lookups"
+        strategy = self.mmr_method
+        entries = self._entries
+        seqs = self._seqs
+        by_mmr: dict[tuple[Map, int, int], SeqBuckets] = {}
+        for seq, lobby in enumerate(lobbies, start=self._next_seq):
+            seqs[id(lobby)] = seq
+            min_mmr, max_mmr = _filled_mmr_range(lobby, strategy)
+            lengths = _room_for(lobby, lobby.current_player_count())
+            entries[seq] = (lobby, min_mmr, max_mmr, lengths)
+            for length in lengths:
+                key = (lobby.map, lobby.party_size, length)
+                lobby_seqs = by_mmr.get(key)
+                if lobby_seqs is None:
+                    lobby_seqs = by_mmr[key] = self._by_mmr(lobby, length)
+                lobby_seqs.add(seq, min_mmr)
+        self._next_seq += len(lobbies)
+
+    def remove(self, lobby: Lobby):
+        "Removes a lobby from the index, ignoring lobbies that are not indexed"
+        seq = self._seqs.pop(id(lobby), None)
+        if seq is not None:
+            lobby, _, _, lengths = self._entries.pop(seq)
+            for length in lengths:
+                self._by_mmr(lobby, length).remove(seq)
+
+    def update(self, lobby: Lobby):
+        "Re-sorts a lobby after its parties changed, dropping it once it is full"
+        players = lobby.current_player_count()
+        if players >= lobby.max_players:
+            self.remove(lobby)
+            return
+
+        seq = self._seqs[id(lobby)]
+        old_lengths = self._entries[seq][3]
+        min_mmr, max_mmr = _filled_mmr_range(lobby, self.mmr_method)
+        lengths = _room_for(lobby, players)
+        self._entries[seq] = (lobby, min_mmr, max_mmr, lengths)
+        if lengths == old_lengths:
+            for length in lengths:
+                self._by_mmr(lobby, length).move(seq, min_mmr)
+            return
+
+        for length in old_lengths:
+            if length not in lengths:
+                self._by_mmr(lobby, length).remove(seq)
+        for length in lengths:
+            if length in old_lengths:
+                self._by_mmr(lobby, length).move(seq, min_mmr)
+            else:
+                self._by_mmr(lobby, length).add(seq, min_mmr)
+
+    def oldest(
+        self,
+        party: Party,
+        mmr_threshold=50,
+        accept: Callable[[Lobby], bool] | None = None,
+    ) -> Lobby | None:
+        """Oldest indexed lobby with room for party that passes the mmr check for it,
+        None if none.
+
+        With `accept` those lobbies are handed to it oldest first, and the first one
+        it takes is returned."""
+
+        seqs = self._lobby_seqs.get((party.map, party.max_size, len(party)))
+        if not seqs:
+            return None
+
+        party_mmr = self.mmr_fn(party)
+        entries = self._entries
+
+        def accept_seq(seq: int) -> bool:
+            lobby, min_mmr, max_mmr, _ = entries[seq]
+            if lobby.status != LobbyStatus.filling:
+                self.remove(lobby)
+                return False
+            if (
+                party_mmr - min_mmr > mmr_threshold
+                or max_mmr - party_mmr > mmr_threshold
+            ):
+                return False
+            return accept is None or accept(lobby)
+
+        seq = seqs.oldest(
+            party_mmr - mmr_threshold, party_mmr + mmr_threshold, accept_seq
+        )
+        return None if seq is None else entries[seq][0]
+
+    def overlapping(self, lobby: Lobby, mmr_threshold=50) -> list[Lobby]:
+        """Other indexed lobbies whose parties are all within mmr_threshold of every
+        party in lobby, oldest first"""
+
+        mmr_range = lobby_mmr_range(lobby, self.mmr_method)
+        if mmr_range is None:
+            return []
+
+        low, high = mmr_range
+        matches = {}
+
+        def collect(seq: int) -> bool:
+            other, min_mmr, max_mmr, _ = self._entries[seq]
+            if other is lobby or other.status != LobbyStatus.filling:
+                return False
+            if max(high, max_mmr) - min(low, min_mmr) <= mmr_threshold:
+                matches[seq] = other
+            return False
+
+        # lobbies are under every party length they have room for, or 0
+        for length in range(lobby.party_size + 1):
+            seqs = self._lobby_seqs.get((lobby.map, lobby.party_size, length))
+            if seqs:
+                seqs.oldest(high - mmr_threshold, low + mmr_threshold, collect)
+        return [matches[seq] for seq in sorted(matches)]
+
+    def _by_mmr(self, lobby: Lobby, length: int) -> SeqBuckets:
+        key = (lobby.map, lobby.party_size, length)
+        seqs = self._lobby_seqs.get(key)
+        if seqs is None:
+            seqs = self._lobby_seqs[key] = SeqBuckets()
+        return seqs
+
+
+class LobbyDeadlines:
+    """Filling lobbies on a min-heap of when they next need a start or cancel check.
+
+    A lobby is due at its deadline, `max_queue_time_secs` after it was created, or
+    as soon as it fills up, which `place_party` reports through `mark_full`. Each
+    tick only pops the due lobbies instead of checking every filling lobby.
+
+    With an `mmr_schedule` lobbies are also due whenever their threshold widens, to
+    be merged with lobbies that came within reach.
+    """
+
+    def __init__(
+        self, max_queue_time_secs=300, mmr_schedule: ThresholdSchedule | None = None
+    ):
+        self.max_queue_time_secs = max_queue_time_secs
+        self.mmr_schedule = mmr_schedule
+
+        # {seq: lobby}, seq keeps lobbies in the order they were added
+        self.lobbies: dict[int, Lobby] = {}
+        # {id(lobby): seq}
+        self._seqs: dict[int, int] = {}
+        # [(due time, seq)], seqs of removed lobbies are skipped when popped
+        self._heap: list[tuple[int, int]] = []
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.lobbies)
+
+    def __contains__(self, lobby: Lobby) -> bool:
+        return id(lobby) in self._seqs
+
+    def add(self, lobby: Lobby):
+        "Tracks a new filling lobby until its deadline"
+        seq = self._next_seq
+        self._next_seq += 1
+        self.lobbies[seq] = lobby
+        self._seqs[id(lobby)] = seq
+        for due in self._due_times(lobby):
+            heapq.heappush(self._heap, (due, seq))
+
+    def add_many(self, lobbies: list[Lobby]):
+        "Tracks filling lobbies in order, building the heap once"
+        for lobby in lobbies:
+            seq = self._next_seq
+            self._next_seq += 1
+            self.lobbies[seq] = lobby
+            self._seqs[id(lobby)] = seq
+            self._heap.extend((due, seq) for due in self._due_times(lobby))
+        heapq.heapify(self._heap)
+
+    def _due_times(self, lobby: Lobby) -> list[int]:
+        "Deadline of a lobby, and when its threshold widens with an mmr schedule"
+        due_times = [lobby.created_at + self.max_queue_time_secs]
+        if self.mmr_schedule is not None:
+            for step_secs, _ in self.mmr_schedule.steps:
+                if 0 < step_secs < self.max_queue_time_secs:
+                    due_times.append(lobby.created_at + step_secs)
+        return due_times
+
+    def mark_full(self, lobby: Lobby, now: int):
+        "Makes a lobby that filled up due at `now`"
+        seq = self._seqs.get(id(lobby))
+        if seq is not None:
+            heapq.heappush(self._heap, (now, seq))
+
+    def remove(self, lobby: Lobby):
+        "Stops tracking a lobby that left matchmaking"
+        seq = self._seqs.pop(id(lobby), None)
+        if seq is not None:
+            del self.lobbies[seq]
+
+    def next_due(self) -> int | None:
+        "Earliest time a tracked lobby is due, None without any"
+        while self._heap and self._heap[0][1] not in self.lobbies:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: int) -> list[Lobby]:
+        """Tracked lobbies due by `now`, oldest first.
+
+        They stay tracked until removed, so lobbies still filling after their check
+        are due again at their deadline."""
+
+        due = set()
+        while self._heap and self._heap[0][0] <= now:
+            _, seq = heapq.heappop(self._heap)
+            if seq in self.lobbies:
+                due.add(seq)
+
+        return [self.lobbies[seq] for seq in sorted(due)]
+
+    def check(
+        self, lobbies: list[Lobby], now: int
+    ) -> Tuple[list[Lobby], list[Lobby], list[Party]]:
+        """Starts or cancels due lobbies, no longer tracking the ones that left.
+
+        Returns started and canceled lobbies, and the parties sent back to menu."""
+
+        for lobby in lobbies:
+            lobby.queue_time = now - lobby.created_at
+        _, started, canceled, dropped_parties = partition_lobbies(
+            lobbies, self.max_queue_time_secs
+        )
+        for lobby in started + canceled:
+            self.remove(lobby)
+
+        return started, canceled, dropped_parties
+
+    def filling_lobbies(self) -> dict[int, list[Lobby]]:
+        "Tracked lobbies grouped by party size, oldest first"
+        all_filling_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
+        for lobby in self.lobbies.values():
+            all_filling_lobbies[lobby.party_size].append(lobby)
+        return all_filling_lobbies
+
+
+class PartyPool:
+    """Partial parties waiting for teammates, per (map, party_size, free slots).
+
+    Each bucket keeps its parties' seqs in `SeqBuckets`, so an arriving partial party
+    finds the longest pooled one within its mmr threshold without going through
+    every pooled party, instead of opening a lobby of its own. It joins
+    the one pooled longest, and a party it fills up before one it only grows, like
+    `attempt_merge_party`. Parties that fill up leave the pool ready for a lobby,
+    so lobbies only ever hold full parties.
+
+    Pooled parties are canceled `max_queue_time_secs` after they were pooled, when
+    a lobby of their own would have been.
+    """
+
+    def __init__(
+        self, mmr_method: str | mmr.MMRStrategy = "max_gs", max_queue_time_secs=300
+    ):
+        self.mmr_method = mmr.resolve(mmr_method)
+        self.mmr_fn = self.mmr_method.party_mmr
+        self.max_queue_time_secs = max_queue_time_secs
+
+        # {seq: party}, seq keeps parties in the order they were pooled
+        self.parties: dict[int, Party] = {}
+        # {(map, party_size, free slots): seqs by mmr}
+        self._keys: dict[tuple[Map, int, int], SeqBuckets] = {}
+        # {seq: (bucket, mmr)} of pooled parties
+        self._entries: dict[int, tuple[tuple[Map, int, int], float]] = {}
+        # [(deadline, seq)], seqs of parties that left are skipped when popped
+        self._heap: list[tuple[int, int]] = []
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.parties)
+
+    def add(self, party: Party, queued_at=0, mmr_threshold=50) -> Party | None:
+        """Pools a partial party, returning the full party it made up, if any.
+
+        The party's players join the longest pooled party within mmr_threshold that
+        has room for them. Otherwise the party waits in the pool itself."""
+
+        party_mmr = self.mmr_fn(party)
+        for free_slots in range(len(party), party.max_size):
+            bucket = (party.map, party.max_size, free_slots)
+            seq = self._oldest(bucket, party_mmr, mmr_threshold)
+            if seq is None:
+                continue
+
+            self._delete(seq)
+            pooled = self.parties[seq]
+            pooled.add_players(party.players)
+            metrics.incr("merges")
+            if len(pooled) == pooled.max_size:
+                del self.parties[seq]
+                return pooled
+            self._insert(seq, pooled)
+            return None
+
+        seq = self._next_seq
+        self._next_seq += 1
+        self.parties[seq] = party
+        self._insert(seq, party)
+        heapq.heappush(self._heap, (queued_at + self.max_queue_time_secs, seq))
+        metrics.incr("parties_pooled")
+        return None
+
+    def assemble(
+        self, parties: list[Party], queued_at=0, mmr_threshold=50
+    ) -> list[Party]:
+        "Full parties ready for lobbies, queued full or made up of pooled parties"
+        full_parties = []
+        for party in parties:
+            if len(party) == party.max_size:
+                full_parties.append(party)
+                continue
+            full_party = self.add(party, queued_at, mmr_threshold)
+            if full_party is not None:
+                full_parties.append(full_party)
+        return full_parties
+
+    def pop_expired(self, now: int) -> list[Party]:
+        "Removes and returns parties pooled for `max_queue_time_secs` by now"
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq = heapq.heappop(self._heap)
+            party = self.parties.pop(seq, None)
+            if party is not None:
+                self._delete(seq)
+                expired.append(party)
+        return expired
+
+    def _oldest(
+        self, bucket: tuple[Map, int, int], party_mmr: float, mmr_threshold: float
+    ) -> int | None:
+        "Seq of the longest pooled party in bucket within mmr_threshold of party_mmr"
+        seqs = self._keys.get(bucket)
+        if not seqs:
+            return None
+
+        entries = self._entries
+        return seqs.oldest(
+            party_mmr - mmr_threshold,
+            party_mmr + mmr_threshold,
+            lambda seq: abs(entries[seq][1] - party_mmr) <= mmr_threshold,
+        )
+
+    def _insert(self, seq: int, party: Party):
+        bucket = (party.map, party.max_size, party.max_size - len(party))
+        party_mmr = self.mmr_fn(party)
+        self._entries[seq] = (bucket, party_mmr)
+        seqs = self._keys.get(bucket)
+        if seqs is None:
+            seqs = self._keys[bucket] = SeqBuckets()
+        seqs.add(seq, party_mmr)
+
+    def _delete(self, seq: int):
+        bucket, _ = self._entries.pop(seq)
+        self._keys[bucket].remove(seq)
+
+
+def place_party(
+    filling_lobbies: list[Lobby],
+    party: Party,
+    lobby_index: LobbyIndex | None = None,
+    created_at=0,
+    lobby_deadlines: LobbyDeadlines | None = None,
+    mmr_schedule: ThresholdSchedule | None = None,
+    **kwargs,
+) -> Lobby:
+    """Places a party from the matchmaking queue in a lobby being filled.
+
+    Returns the lobby the party joined, which is a new lobby created at `created_at`
+    and appended to `filling_lobbies` when no existing lobby can take it.
+
+    Only lobbies in the party's map are tried, in order. `put_parties_in_lobbies`
+    passes one list per map and party size, so none are skipped there. With a
+    `lobby_index` only lobbies in the party's map and party size whose mmr window
+    overlaps the party are tried, still in the order they were added, without
+    looking at other brackets or lobbies past the first one that takes the party.
+    The index has to hold the same lobbies as `filling_lobbies`, and rates parties
+    with its own `mmr_method`, which a different `mmr_method` can't override.
+
+    New lobbies are added to `lobby_deadlines`, and lobbies the party fills up are
+    marked full there at `created_at`.
+
+    With an `mmr_schedule` every lobby takes parties within its own threshold for
+    how long it has been filling at `created_at`, instead of `mmr_threshold`.
+    """
+
+    if lobby_index is not None:
+        strategy = mmr.resolve(kwargs.setdefault("mmr_method", lobby_index.mmr_method))
+        if strategy is not lobby_index.mmr_method:
+            raise ValueError(
+                f"Placing with mmr method {strategy.name} in a lobby index of "
+                f"{lobby_index.mmr_method.name}"
+            )
+
+    metrics.incr("parties_placed")
+    attempts = 0
+
+    def accept(lobby: Lobby) -> bool:
+        nonlocal attempts
+        attempts += 1
+        if mmr_schedule is not None:
+            queue_time = created_at - lobby.created_at
+            kwargs["mmr_threshold"] = mmr_schedule.threshold(queue_time)
+        # attempt to add to existing lobbies
+        was_merged, _ = attempt_add_party_to_lobby(lobby, party, **kwargs)
+        return was_merged
+
+    if lobby_index is not None:
+        mmr_threshold = kwargs.get("mmr_threshold", 50)
+        if mmr_schedule is not None:
+            mmr_threshold = mmr_schedule.max_threshold
+        lobby = lobby_index.oldest(party, mmr_threshold, accept=accept)
+    else:
+        lobby = next(
+            (
+                lobby
+                for lobby in filling_lobbies
+                if lobby.map == party.map and accept(lobby)
+            ),
+            None,
+        )
+
+    metrics.incr("placement_attempts", attempts)
+    if lobby is not None:
+        if lobby_index is not None:
+            lobby_index.update(lobby)
+        if lobby_deadlines is not None and is_lobby_full(lobby):
+            lobby_deadlines.mark_full(lobby, created_at)
+        return lobby
+
+    # No matchable lobbies: create new lobby
+    new_lobby = create_lobby(party, created_at=created_at)
+    filling_lobbies.append(new_lobby)
+    if lobby_index is not None:
+        lobby_index.add(new_lobby)
+    if lobby_deadlines is not None:
+        lobby_deadlines.add(new_lobby)
+    return new_lobby
+
+
 def put_party_in_lobby(
-    filling_lobbies: list[Lobby], party: Party, **kwargs
+    filling_lobbies: list[Lobby],
+    party: Party,
+    lobby_index: LobbyIndex | None = None,
+    **kwargs,
 ) -> list[Lobby]:
     """Adds a party from the matchmaking queue to lobbies being filled."""
 
-    # No existing lobbies: create one
-    if not filling_lobbies:
-        new_lobby = Lobby(parties=[party], map=party.map, party_size=party.max_size)
-        filling_lobbies.append(new_lobby)
-    else:
-        successfully_added_party = False
-        for lobby in filling_lobbies:
-            # attempt to add to existing lobbies
-            was_merged, _ = attempt_add_party_to_lobby(lobby, party, **kwargs)
+    place_party(filling_lobbies, party, lobby_index=lobby_index, **kwargs)
+    return filling_lobbies
+
+
+def put_parties_in_lobbies(
+    all_filling_lobbies: dict[int, list[Lobby]],
+    parties: list[Party],
+    lobby_index: LobbyIndex | None = None,
+    mmr_method="max_gs",
+    mmr_threshold=50,
+    created_at=0,
+    lobby_deadlines: LobbyDeadlines | None = None,
+    mmr_schedule: ThresholdSchedule | None = None,
+    party_pool: PartyPool | None = None,
+    **kwargs,
+) -> dict[int, list[Lobby]]:
+    """Places a whole batch of queued parties in lobbies grouped by party size.
+
+    Gives exactly the lobbies `put_party_in_lobby` would give one party at a time
+    in queue order, with one list of lobbies per map and party size. New lobbies
+    are appended to their party size's list.
+
+    With a `party_pool` partial parties first wait there to make up full parties,
+    and only full parties are placed in lobbies.
+    """
+
+    # resolved once for the whole batch
+    mmr_method = mmr.resolve(mmr_method)
+    if party_pool is not None:
+        parties = party_pool.assemble(parties, created_at, mmr_threshold)
+
+    # {(map, party_size): [lobbies]}, only scanned without an index
+    brackets: dict[tuple[Map, int], list[Lobby]] = {}
+    if lobby_index is None:
+        for lobbies in all_filling_lobbies.values():
+            for lobby in lobbies:
+                brackets.setdefault((lobby.map, lobby.party_size), []).append(lobby)
+
+    for party in parties:
+        if lobby_index is None:
+            bracket = brackets.setdefault((party.map, party.max_size), [])
+        else:
+            bracket = []
+        num_lobbies = len(bracket)
+        lobby = place_party(
+            bracket,
+            party,
+            lobby_index=lobby_index,
+            created_at=created_at,
+            lobby_deadlines=lobby_deadlines,
+            mmr_schedule=mmr_schedule,
+            mmr_method=mmr_method,
+            mmr_threshold=mmr_threshold,
+        )
+        if len(bracket) > num_lobbies:
+            all_filling_lobbies[party.max_size].append(lobby)
+    return all_filling_lobbies
+
+
+def _pack_party(
+    lobby: Lobby, party: Party, strategy: mmr.MMRStrategy, mmr_threshold: float
+) -> bool:
+    "Adds party to a lobby being packed if there is room, merging partial parties"
+    if lobby.current_player_count() + len(party) > lobby.max_players:
+        return False
+
+    if len(party) < lobby.party_size:
+        was_merged, _ = attempt_merge_party(
+            lobby, party, mmr_method=strategy, mmr_threshold=mmr_threshold
+        )
+        if was_merged:
+            return True
+        lobby._open_parties = None
+    lobby.parties.append(party)
+    _extend_mmr_ranges(lobby, party)
+    return True
+
+
+def pack_lobbies(
+    parties: list[Party],
+    queued_at: list[int] | None = None,
+    mmr_method="max_gs",
+    mmr_threshold=50,
+) -> list[Lobby]:
+    """Packs a pool of waiting parties into lobbies all at once.
+
+    Parties are sorted by map, party size and mmr, then swept in that order: each
+    lobby takes the following parties until one is more than `mmr_threshold` above
+    its lowest mmr or doesn't fit in `max_players`, which starts the next lobby.
+    Partial parties merge into the lobby's partial parties where they fit.
+
+    Sorting is O(n log n) and the sweep is linear, unlike placing parties one at a
+    time in arrival order. Lobbies are created at the earliest `queued_at` of their
+    parties, 0 without it, and come back full or not in mmr order.
+    """
+
+    strategy = mmr.resolve(mmr_method)
+    mmr_fn = strategy.party_mmr
+
+    if queued_at is None:
+        queued_at = [0] * len(parties)
+    mmrs = [mmr_fn(party) for party in parties]
+    order = sorted(
+        range(len(parties)),
+        key=lambda i: (parties[i].map.value, parties[i].max_size, mmrs[i]),
+    )
+
+    lobbies: list[Lobby] = []
+    lobby = None
+    window_low = 0.0
+    for i in order:
+        party = parties[i]
+        if (
+            lobby is not None
+            and lobby.map == party.map
+            and lobby.party_size == party.max_size
+            and mmrs[i] - window_low <= mmr_threshold
+            and _pack_party(lobby, party, strategy, mmr_threshold)
+        ):
+            lobby.created_at = min(lobby.created_at, queued_at[i])
+            continue
+
+        lobby = create_lobby(party, created_at=queued_at[i])
+        window_low = mmrs[i]
+        lobbies.append(lobby)
+
+    metrics.incr("parties_packed", len(parties))
+    return lobbies
+
+
+def merge_lobbies(
+    target: Lobby,
+    source: Lobby,
+    mmr_method: str | mmr.MMRStrategy | None = None,
+    mmr_threshold=50,
+):
+    """Moves every party of source into target.
+
+    Partial parties of source join target's partial parties where they fit, the
+    rest are added as they are. Target must have room for all of source's players.
+    With `mmr_method` partial parties only merge where the merged lobby stays within
+    `mmr_threshold`, like `attempt_merge_party`.
+    """
+
+    strategy = None
+    if mmr_method is not None:
+        strategy = mmr.resolve(mmr_method)
+        if strategy.merges_within:
+            strategy = None
+        else:
+            source_low, source_high = _filled_mmr_range(source, strategy)
+
+    for party in source.parties:
+        if len(party) < target.party_size:
+            if strategy is not None:
+                # range checked by merges covers source's parties still to move
+                low, high = _filled_mmr_range(target, strategy)
+                target._mmr_ranges[strategy] = (
+                    min(low, source_low),
+                    max(high, source_high),
+                )
+            was_merged, _ = attempt_merge_party(
+                target, party, mmr_method=strategy, mmr_threshold=mmr_threshold
+            )
             if was_merged:
-                successfully_added_party = True
+                continue
+        target.parties.append(party)
+
+    source.parties.clear()
+    target._mmr_ranges.clear()
+    target._open_parties = None
+    source._mmr_ranges.clear()
+    source._open_parties = None
+    metrics.incr("lobby_merges")
+
+
+def merge_widened_lobbies(
+    lobbies: list[Lobby],
+    lobby_index: LobbyIndex,
+    mmr_schedule: ThresholdSchedule,
+    now: int,
+    lobby_deadlines: LobbyDeadlines | None = None,
+):
+    """Merges lobbies whose threshold widened with filling lobbies now in reach.
+
+    Only lobbies within a lobby's threshold are looked at, found through the index.
+    The older lobby of a pair takes the other's parties and the emptied lobby leaves
+    the index and `lobby_deadlines`. Lobbies merges fill up are marked full at now.
+    """
+
+    for lobby in lobbies:
+        if lobby not in lobby_index or lobby.status != LobbyStatus.filling:
+            continue
+
+        mmr_threshold = mmr_schedule.threshold(now - lobby.created_at)
+        for other in lobby_index.overlapping(lobby, mmr_threshold):
+            if other not in lobby_index:
+                continue
+            total_players = lobby.current_player_count() + other.current_player_count()
+            if total_players > lobby.max_players:
+                continue
+            # ranges change with every merge
+            low, high = _filled_mmr_range(lobby, lobby_index.mmr_method)
+            other_low, other_high = _filled_mmr_range(other, lobby_index.mmr_method)
+            if max(high, other_high) - min(low, other_low) > mmr_threshold:
+                continue
+
+            if other.created_at < lobby.created_at:
+                target, source = other, lobby
+            else:
+                target, source = lobby, other
+            merge_lobbies(
+                target,
+                source,
+                mmr_method=lobby_index.mmr_method,
+                mmr_threshold=mmr_threshold,
+            )
+
+            lobby_index.remove(source)
+            lobby_index.update(target)
+            if lobby_deadlines is not None:
+                lobby_deadlines.remove(source)
+                if is_lobby_full(target):
+                    lobby_deadlines.mark_full(target, now)
+
+            if source is lobby or target not in lobby_index:
                 break
-        # No matchable lobbies: create new lobby
-        if not successfully_added_party:
-            new_lobby = Lobby(parties=[party], map=party.map, party_size=party.max_size)
-            filling_lobbies.append(new_lobby)
 
-    return filling_lobbies
+
+def full_party_player_count(lobby: Lobby) -> int:
+    "Players in parties that have reached the lobby's party size"
+    return sum(len(p) for p in lobby.parties if len(p) == lobby.party_size)
+
+
+def is_lobby_full(lobby: Lobby) -> bool:
+    "Lobby is full once its full parties add up to the lobby's max players"
+    return full_party_player_count(lobby) == lobby.max_players
 
 
 def maybe_start_lobby(
@@ -133,28 +1129,32 @@ def maybe_start_lobby(
     """
 
     # only full if sum of full parties is max lobby player count
-    num_players_in_full_parties = sum(
-        len(p) for p in lobby.parties if len(p) == lobby.party_size
-    )
+    num_players_in_full_parties = full_party_player_count(lobby)
 
     is_full = num_players_in_full_parties == lobby.max_players
     past_max_wait_time = lobby.queue_time >= max_queue_time_secs
 
     dropped_parties = []
     if is_full or past_max_wait_time:
-
-
+        full_parties = []
         for party in lobby.parties:
             if len(party) < lobby.party_size:
-                lobby.parties.remove(party)
                 dropped_parties.append(party)
+            else:
+                full_parties.append(party)
+        lobby.parties[:] = full_parties
+        lobby._mmr_ranges.clear()
+        lobby._open_parties = None
 
         # no full parties, cancel lobby
         # since we removed non-full parties lobby will be empty
         if num_players_in_full_parties == 0:
             lobby.status = LobbyStatus.canceled
+            metrics.incr("lobbies_canceled")
         else:
             lobby.status = LobbyStatus.started
+            metrics.incr("lobbies_started")
+        metrics.incr("parties_dropped", len(dropped_parties))
 
     return lobby, dropped_parties
 
@@ -168,11 +1168,42 @@ def maybe_cancel_matchmaking(
     past_max_wait_time = lobby.queue_time >= max_queue_time_secs
     if past_max_wait_time and lobby.status == LobbyStatus.filling:
         lobby.status = LobbyStatus.canceled
+        metrics.incr("lobbies_canceled")
+        metrics.incr("parties_dropped", len(lobby.parties))
         return lobby, lobby.parties
     else:
         return lobby, []
 
 
+def partition_lobbies(
+    lobbies: list[Lobby], max_queue_time_secs=120
+) -> Tuple[list[Lobby], list[Lobby], list[Lobby], list[Party]]:
+    """Starts or cancels lobbies in a single pass.
+
+    Returns filling, started, and canceled lobbies, plus the parties sent back to menu
+    in lobby order.
+    """
+
+    filling: list[Lobby] = []
+    started: list[Lobby] = []
+    canceled: list[Lobby] = []
+    dropped_parties: list[Party] = []
+    for lobby in lobbies:
+        _, dropped = maybe_start_lobby(lobby, max_queue_time_secs)
+        dropped_parties.extend(dropped)
+        _, dropped = maybe_cancel_matchmaking(lobby, max_queue_time_secs)
+        dropped_parties.extend(dropped)
+
+        if lobby.status == LobbyStatus.filling:
+            filling.append(lobby)
+        elif lobby.status == LobbyStatus.started:
+            started.append(lobby)
+        else:
+            canceled.append(lobby)
+
+    return filling, started, canceled, dropped_parties
+
+
 def regroup_lobbies(
     lobbies: list[Lobby],
 ) -> Tuple[list[Lobby], list[Lobby], list[Lobby]]:
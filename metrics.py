@@ -0,0 +1,159 @@
+"""Counters and phase timers for the matchmaking hot path.
+
+`matchmaking` and `simulation` report through the module level functions, which go
+to whatever `Metrics` hook is active. The default hook ignores everything, so
+instrumentation costs a function call when nobody is listening.
+
+Counters:
+    parties_placed: parties handed to `place_party`
+    placement_attempts: lobbies a party tried before it was placed
+    mmr_checks: `can_add_party_to_lobby` calls
+    merges: partial parties merged into another party
+    parties_pooled: partial parties waiting in a `PartyPool` for teammates
+    lobby_merges: filling lobbies absorbed by an older lobby after widening
+    lobbies_created, lobbies_started, lobbies_canceled
+    parties_dropped: parties sent back to menu when a lobby started or canceled
+    parties_packed: parties handed to `pack_lobbies`
+
+Timers, in seconds: process_queued_parties, update_lobbies, pack_lobbies
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    "Context manager adding the time spent inside it to a metrics timer"
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    "Metrics hook that ignores everything"
+
+    def incr(self, name: str, value: int = 1):
+        pass
+
+    def observe(self, name: str, secs: float):
+        pass
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self, name)
+
+    def flush(self):
+        pass
+
+
+class InMemoryMetrics(Metrics):
+    "Keeps counters and timer totals in dicts"
+
+    def __init__(self):
+        self.counters: dict[str, int] = {}
+        # {name: [total secs, calls]}
+        self.timers: dict[str, list[float]] = {}
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, secs: float):
+        timer = self.timers.setdefault(name, [0.0, 0])
+        timer[0] += secs
+        timer[1] += 1
+
+    def snapshot(self) -> dict:
+        "Counters and timers as plain numbers"
+        return {
+            "counters": dict(self.counters),
+            "timers": {
+                name: {"total_secs": total, "calls": calls}
+                for name, (total, calls) in self.timers.items()
+            },
+        }
+
+
+class PeriodicMetrics(InMemoryMetrics):
+    "Flushes at most every `interval_secs` of wall time, checked when a timer ends"
+
+    def __init__(self, interval_secs: float = 10.0):
+        super().__init__()
+        self.interval_secs = interval_secs
+        self.last_flush = time.monotonic()
+
+    def observe(self, name: str, secs: float):
+        super().observe(name, secs)
+        now = time.monotonic()
+        if now - self.last_flush >= self.interval_secs:
+            self.last_flush = now
+            self.flush()
+
+
+class LogMetrics(PeriodicMetrics):
+    "Logs every counter and timer on one line"
+
+    def flush(self):
+        counters = " ".join(f"{k}={v}" for k, v in sorted(self.counters.items()))
+        timers = " ".join(
+            f"{k}={total:.3f}s/{calls}"
+            for k, (total, calls) in sorted(self.timers.items())
+        )
+        logger.info("matchmaking metrics %s %s", counters, timers)
+
+
+class PrometheusFileMetrics(PeriodicMetrics):
+    "Rewrites a file in Prometheus text format, e.g. for a node exporter textfile"
+
+    def __init__(self, path: str, interval_secs: float = 10.0):
+        super().__init__(interval_secs)
+        self.path = path
+
+    def flush(self):
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE matchmaking_{name}_total counter")
+            lines.append(f"matchmaking_{name}_total {value}")
+
+        lines.append("# TYPE matchmaking_phase_seconds_total counter")
+        for name, (total, _) in sorted(self.timers.items()):
+            lines.append(f'matchmaking_phase_seconds_total{{phase="{name}"}} {total}')
+        lines.append("# TYPE matchmaking_phase_calls_total counter")
+        for name, (_, calls) in sorted(self.timers.items()):
+            lines.append(f'matchmaking_phase_calls_total{{phase="{name}"}} {calls}')
+
+        with open(self.path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+_active: Metrics = Metrics()
+
+
+def set_metrics(hook: Metrics) -> Metrics:
+    "Makes hook receive all metrics, returning the previously active hook"
+    global _active
+    previous = _active
+    _active = hook
+    return previous
+
+
+def get_metrics() -> Metrics:
+    return _active
+
+
+def incr(name: str, value: int = 1):
+    _active.incr(name, value)
+
+
+def timer(name: str) -> Timer:
+    return _active.timer(name)
@@ -0,0 +1,208 @@
+"""MMR strategies matchmaking rates parties with.
+
+A strategy rates one party with `party_mmr` and many parties at once with
+`batch_mmr`, which reads flat arrays of every player's gear score, level and job
+instead of walking party objects. Strategies are registered by name and resolved
+once when a matchmaker is configured, so the hot path calls the function directly
+instead of looking it up on every check.
+"""
+
+import math
+from array import array
+from dataclasses import dataclass
+from functools import partial
+from itertools import accumulate
+from typing import Callable, Sequence
+
+from core import Party
+from schema import Job
+
+JOBS = list(Job)
+JOB_CODES = {job: code for code, job in enumerate(JOBS)}
+
+
+@dataclass(frozen=True)
+class PlayerArrays:
+    """Players of many parties in flat arrays.
+
+    Party i's players are at indexes `offsets[i]` up to `offsets[i + 1]`, jobs are
+    indexes into `JOBS`."""
+
+    gear_scores: array
+    levels: array
+    jobs: array
+    offsets: array
+
+    @classmethod
+    def from_parties(cls, parties: Sequence[Party]) -> "PlayerArrays":
+        players = [player for party in parties for player in party.players]
+        return cls(
+            gear_scores=array("i", [player.gear_score for player in players]),
+            levels=array("i", [player.level for player in players]),
+            jobs=array("B", [JOB_CODES[player.job] for player in players]),
+            offsets=array("I", [0, *accumulate(map(len, parties))]),
+        )
+
+    def spans(self):
+        "(start, stop) of every party's players"
+        return zip(self.offsets, self.offsets[1:])
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class MMRStrategy:
+    """Named way of rating parties.
+
+    Strategies compare and hash by identity, as lobbies cache mmr ranges per
+    strategy object, so strategies sharing a name never share ranges. A registered
+    strategy pickles as its name, so lobbies sent between processes come back
+    keyed by the strategy registered there. Strategies `merges_within` rate a merged
+    party between the parties merged, so merges can't widen a lobby's range."""
+
+    name: str
+    party_mmr: Callable[[Party], float]
+    batch_mmr: Callable[[PlayerArrays], list[float]]
+    merges_within: bool = False
+
+    def party_mmrs(self, parties: Sequence[Party]) -> list[float]:
+        "MMR of every party, computed in one batch"
+        return self.batch_mmr(PlayerArrays.from_parties(parties))
+
+    def __reduce__(self):
+        if STRATEGIES.get(self.name) is self:
+            return resolve, (self.name,)
+        return MMRStrategy, (
+            self.name,
+            self.party_mmr,
+            self.batch_mmr,
+            self.merges_within,
+        )
+
+
+# {name: strategy}
+STRATEGIES: dict[str, MMRStrategy] = {}
+# {name: party_mmr}, for code that only needs the scalar functions
+MMR_FUNCTIONS: dict[str, Callable[[Party], float]] = {}
+
+
+def register(strategy: MMRStrategy) -> MMRStrategy:
+    "Makes a strategy available under its name, replacing any with the same name"
+    STRATEGIES[strategy.name] = strategy
+    MMR_FUNCTIONS[strategy.name] = strategy.party_mmr
+    return strategy
+
+
+def resolve(mmr_method: "str | MMRStrategy") -> MMRStrategy:
+    "Strategy registered as mmr_method, or mmr_method itself if already resolved"
+    if isinstance(mmr_method, MMRStrategy):
+        return mmr_method
+    try:
+        return STRATEGIES[mmr_method]
+    except KeyError:
+        raise NotImplementedError(f"No implementation for mmr method: {mmr_method}")
+
+
+def max_gearscore_mmr(party: Party) -> float:
+    mmr = party.max_gear_score
+    return mmr
+
+
+def average_gearscore_mmr(party: Party) -> float:
+    total_mmr = party.total_gear_score
+    average_mmr = total_mmr / len(party.players)
+    return average_mmr
+
+
+def _batch_max_gs(players: PlayerArrays) -> list[float]:
+    gs = players.gear_scores
+    return [max(gs[start:stop]) for start, stop in players.spans()]
+
+
+def _batch_avg_gs(players: PlayerArrays) -> list[float]:
+    gs = players.gear_scores
+    return [sum(gs[start:stop]) / (stop - start) for start, stop in players.spans()]
+
+
+def level_weighted_mmr(party: Party) -> float:
+    "Gear score averaged with every player weighted by level"
+    total_levels = sum(p.level for p in party.players)
+    return sum(p.gear_score * p.level for p in party.players) / total_levels
+
+
+def _batch_level_gs(players: PlayerArrays) -> list[float]:
+    gs, levels = players.gear_scores, players.levels
+    return [
+        sum(map(int.__mul__, gs[start:stop], levels[start:stop]))
+        / sum(levels[start:stop])
+        for start, stop in players.spans()
+    ]
+
+
+def _job_weighted_mmr(code_weights: list[float], party: Party) -> float:
+    return sum(
+        p.gear_score * code_weights[JOB_CODES[p.job]] for p in party.players
+    ) / len(party.players)
+
+
+def _batch_job_weighted(
+    code_weights: list[float], players: PlayerArrays
+) -> list[float]:
+    gs, jobs = players.gear_scores, players.jobs
+    weighted = [g * code_weights[j] for g, j in zip(gs, jobs)]
+    return [
+        sum(weighted[start:stop]) / (stop - start) for start, stop in players.spans()
+    ]
+
+
+def job_weighted(weights: dict[Job, float], name="job_gs") -> MMRStrategy:
+    "Strategy averaging gear score with every player weighted by job"
+    # module level functions, so the strategy pickles with lobbies caching it
+    code_weights = [weights.get(job, 1.0) for job in JOBS]
+    return MMRStrategy(
+        name,
+        partial(_job_weighted_mmr, code_weights),
+        partial(_batch_job_weighted, code_weights),
+        merges_within=True,
+    )
+
+
+def _percentile(values: list[int], fraction: float) -> float:
+    "Linearly interpolated percentile of sorted values"
+    rank = fraction * (len(values) - 1)
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _percentile_mmr(fraction: float, party: Party) -> float:
+    return _percentile(sorted(p.gear_score for p in party.players), fraction)
+
+
+def _batch_percentile(fraction: float, players: PlayerArrays) -> list[float]:
+    gs = players.gear_scores
+    return [
+        _percentile(sorted(gs[start:stop]), fraction) for start, stop in players.spans()
+    ]
+
+
+def percentile_gs(pct: float, name: str | None = None) -> MMRStrategy:
+    "Strategy rating a party by the pct percentile of its gear scores"
+    fraction = pct / 100
+    return MMRStrategy(
+        name or f"p{pct:g}_gs",
+        partial(_percentile_mmr, fraction),
+        partial(_batch_percentile, fraction),
+    )
+
+
+# even until tuned from match outcomes
+JOB_WEIGHTS: dict[Job, float] = {job: 1.0 for job in Job}
+
+register(MMRStrategy("max_gs", max_gearscore_mmr, _batch_max_gs, merges_within=True))
+register(
+    MMRStrategy("avg_gs", average_gearscore_mmr, _batch_avg_gs, merges_within=True)
+)
+register(
+    MMRStrategy("level_gs", level_weighted_mmr, _batch_level_gs, merges_within=True)
+)
+register(job_weighted(JOB_WEIGHTS))
+register(percentile_gs(75))
@@ -0,0 +1,159 @@
+"""Profiling of matchmaking runs.
+
+`profile` runs a block under cProfile, writes the stats for snakeviz and a
+collapsed stack file for flamegraph tools, and prints a summary of where the time
+went: matchmaking, pydantic validation, random generation or anything else.
+
+cProfile only records caller/callee pairs, so collapsed stacks split the time of a
+function between its callers in proportion to the time each call edge took.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+from contextlib import contextmanager
+from typing import TextIO
+
+# modules whose functions count as matchmaking
+MATCHMAKING_MODULES = ("matchmaking.py", "mmr.py", "core.py")
+# (module, function) of the generators drawing random players and parties
+RANDOM_FUNCTIONS = {
+    ("simulation.py", "generate_player"),
+    ("simulation.py", "generate_party"),
+    ("simulation.py", "party_queuing_generator"),
+    ("workload.py", "poisson"),
+    ("workload.py", "gear_scores"),
+    ("workload.py", "generate_batch"),
+}
+
+# stacks deeper than this are cut off, recursion is cut at its first repeat
+MAX_DEPTH = 64
+
+# (file, line, function) as pstats keys them
+Func = tuple[str, int, str]
+# {func: (primitive calls, calls, own secs, cumulative secs, {caller: edge stats})}
+StatsDict = dict[Func, tuple[int, int, float, float, dict[Func, tuple]]]
+
+
+def _entries(stats: pstats.Stats) -> StatsDict:
+    "The stats pstats keeps per function, an attribute typeshed leaves out"
+    return stats.stats  # type: ignore[attr-defined]
+
+
+def category(func: Func) -> str:
+    "Which part of a run a profiled function belongs to"
+    filename, _, name = func
+    if os.path.basename(filename) in MATCHMAKING_MODULES:
+        return "matchmaking"
+    if "pydantic" in filename or "pydantic" in name:
+        return "pydantic"
+    if os.path.basename(filename) == "random.py" or "_random" in name:
+        return "random"
+    if (os.path.basename(filename), name) in RANDOM_FUNCTIONS:
+        return "random"
+    return "other"
+
+
+def category_times(stats: pstats.Stats) -> dict[str, float]:
+    "Seconds spent inside each category's own code, excluding what it called"
+    times = {"matchmaking": 0.0, "pydantic": 0.0, "random": 0.0, "other": 0.0}
+    for func, (_, _, self_time, _, _) in _entries(stats).items():
+        times[category(func)] += self_time
+    return times
+
+
+def _label(func: Func) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{name}:{line}"
+
+
+def collapsed_stacks(stats: pstats.Stats) -> dict[str, int]:
+    """Microseconds spent in every stack, as `root;...;func` keys.
+
+    Functions nothing profiled called are the roots."""
+
+    entries = _entries(stats)
+    callees: dict[Func, list[Func]] = {}
+    roots = []
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            roots.append(func)
+        for caller in callers:
+            callees.setdefault(caller, []).append(func)
+
+    stacks: dict[str, int] = {}
+
+    def walk(func: Func, share: float, path: list[str], on_path: set[Func]):
+        _, _, self_time, total_time, _ = entries[func]
+        stack = ";".join(path)
+        micros = round(self_time * share * 1e6)
+        if micros:
+            stacks[stack] = stacks.get(stack, 0) + micros
+        if len(path) >= MAX_DEPTH:
+            return
+
+        for callee in callees.get(func, []):
+            if callee in on_path:
+                continue
+            callee_total = entries[callee][3]
+            edge_total = entries[callee][4][func][3]
+            if not callee_total or not edge_total:
+                continue
+            on_path.add(callee)
+            path.append(_label(callee))
+            walk(callee, share * edge_total / callee_total, path, on_path)
+            path.pop()
+            on_path.discard(callee)
+
+    for root in roots:
+        walk(root, 1.0, [_label(root)], {root})
+    return stacks
+
+
+def write_collapsed(path: str, stats: pstats.Stats):
+    "Writes stacks in the collapsed format flamegraph.pl and speedscope read"
+    with open(path, "w") as f:
+        for stack, micros in sorted(collapsed_stacks(stats).items()):
+            f.write(f"{stack} {micros}\n")
+
+
+def format_summary(stats: pstats.Stats, top=20) -> str:
+    "Time per category, then the top functions by their own time"
+    times = category_times(stats)
+    total = sum(times.values()) or 1.0
+    lines = [f"{'category':<12} {'secs':>9} {'share':>7}"]
+    for name, secs in times.items():
+        lines.append(f"{name:<12} {secs:>9.3f} {secs / total:>7.1%}")
+
+    lines.append("")
+    lines.append(f"{'own secs':>9} {'cum secs':>9} {'calls':>9}  function")
+    ranked = sorted(_entries(stats).items(), key=lambda item: item[1][2], reverse=True)
+    for func, (_, calls, self_time, total_time, _) in ranked[:top]:
+        lines.append(
+            f"{self_time:>9.3f} {total_time:>9.3f} {calls:>9}  "
+            f"{_label(func)} [{category(func)}]"
+        )
+    return "\n".join(lines)
+
+
+@contextmanager
+def profile(path: str | None = None, top=20, stream: TextIO | None = None):
+    """Profiles the block, yielding the running `cProfile.Profile`.
+
+    With a path the stats are written to `{path}.prof`, for snakeviz, and the
+    stacks to `{path}.collapsed`. The summary goes to stream, stdout by default."""
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        if path is not None:
+            stats.dump_stats(f"{path}.prof")
+            write_collapsed(f"{path}.collapsed", stats)
+        print(format_summary(stats, top=top), file=stream or sys.stdout)
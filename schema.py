@@ -1,7 +1,10 @@
 from enum import Enum
-from typing import Annotated
+from typing import TYPE_CHECKING, Annotated
 
-from pydantic import AfterValidator, BaseModel, Field, computed_field
+from pydantic import AfterValidator, BaseModel, Field, PrivateAttr, computed_field
+
+if TYPE_CHECKING:
+    from mmr import MMRStrategy
 
 
 class Job(str, Enum):
@@ -39,9 +42,41 @@ class Party(BaseModel):
     # mmr: int
     max_size: int
 
+    # gear score aggregates the mmr functions read, kept in sync with players
+    _max_gear_score: int = PrivateAttr(0)
+    _total_gear_score: int = PrivateAttr(0)
+
+    def model_post_init(self, __context) -> None:
+        self._refresh_gear_score()
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "players":
+            self._refresh_gear_score()
+
     def __len__(self) -> int:
         return len(self.players)
 
+    @property
+    def max_gear_score(self) -> int:
+        return self._max_gear_score
+
+    @property
+    def total_gear_score(self) -> int:
+        return self._total_gear_score
+
+    def add_players(self, players: list[Player]):
+        "Adds players to the party, updating gear score aggregates in place"
+        super().__setattr__("players", self.players + players)
+        self._max_gear_score = max(
+            self._max_gear_score, max(p.gear_score for p in players)
+        )
+        self._total_gear_score += sum(p.gear_score for p in players)
+
+    def _refresh_gear_score(self):
+        self._max_gear_score = max((p.gear_score for p in self.players), default=0)
+        self._total_gear_score = sum(p.gear_score for p in self.players)
+
 
 class LobbyStatus(str, Enum):
     filling = "filling"
@@ -49,29 +84,49 @@ class LobbyStatus(str, Enum):
     canceled = "canceled"
 
 
+def max_lobby_players(party_size: int) -> int:
+    "Most players a lobby for solo/duo/trio parties can hold"
+    match party_size:
+        case 1:
+            return 10
+        case 2:
+            return 14
+        case 3:
+            return 15
+        # put this here to make mypy happen despite the party_size constraints
+        case _:
+            return 10
+
+
 class Lobby(BaseModel):
     parties: list[Party]
     map: Map
 
     queue_time: int = 0
+    # simulated second the lobby was created in
+    created_at: int = 0
     status: LobbyStatus = LobbyStatus.filling
 
     # solo/duo/trio
     party_size: Annotated[int, Field(ge=1, le=3)]
 
+    # {mmr strategy: (min, max)} of party mmrs, maintained by matchmaking
+    _mmr_ranges: dict["MMRStrategy", tuple[float, float]] = PrivateAttr(
+        default_factory=dict
+    )
+    # {free slots: [partial parties]}, built by matchmaking on the first merge
+    _open_parties: dict[int, list[Party]] | None = PrivateAttr(None)
+
     @computed_field  # type: ignore[misc]
     @property
     def max_players(self) -> int:
-        match self.party_size:
-            case 1:
-                return 10
-            case 2:
-                return 14
-            case 3:
-                return 15
-            # put this here to make mypy happen despite the party_size constraints
-            case _:
-                return 10
+        return max_lobby_players(self.party_size)
 
     def current_player_count(self) -> int:
         return sum(len(p) for p in self.parties)
+
+    def __eq__(self, other) -> bool:
+        "Compares fields only, like core.Lobby, leaving out the matchmaking caches"
+        if not isinstance(other, BaseModel):
+            return NotImplemented
+        return type(self) is type(other) and self.__dict__ == other.__dict__
@@ -0,0 +1,245 @@
+import asyncio
+import gc
+import inspect
+import logging
+import time
+from typing import Callable
+
+import checkpoint
+import core
+import matchmaking as matchmaking
+import metrics
+import mmr
+import simulation as simulation
+from core import Lobby, Party
+from schema import Map
+
+logger = logging.getLogger(__name__)
+
+
+class MatchmakingService:
+    """Long running matchmaker fed by an in-process queue.
+
+    Connections enqueue parties at any time, which only puts them on an asyncio
+    queue. A background loop ticks every `tick_secs`, placing everything queued
+    since the last tick as one batch, then starting full lobbies and starting or
+    canceling lobbies past `max_queue_time_secs`.
+
+    Errors raised by `on_lobby_started` or `on_party_canceled` are logged, and the
+    remaining callbacks of the tick still run.
+
+    The queue holds at most `max_pending` parties: `enqueue` waits for room and
+    `try_enqueue` refuses the party instead, so callers feel backpressure when
+    ticks can't keep up.
+    """
+
+    def __init__(
+        self,
+        tick_secs=1.0,
+        max_queue_time_secs=300,
+        mmr_method="max_gs",
+        mmr_threshold=50,
+        max_pending=10_000,
+        on_lobby_started: Callable | None = None,
+        on_party_canceled: Callable | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.tick_secs = tick_secs
+        self.max_queue_time_secs = max_queue_time_secs
+        self.mmr_method = mmr.resolve(mmr_method)
+        self.mmr_threshold = mmr_threshold
+        self.on_lobby_started = on_lobby_started
+        self.on_party_canceled = on_party_canceled
+        self.clock = clock
+
+        self.pending: asyncio.Queue[Party] = asyncio.Queue(maxsize=max_pending)
+        self.lobby_index = matchmaking.LobbyIndex(mmr_method=mmr_method)
+        self.lobby_deadlines = matchmaking.LobbyDeadlines(max_queue_time_secs)
+        self.started_at = clock()
+        self._task: asyncio.Task | None = None
+        # held while a tick or checkpoint reads or changes the lobbies
+        self._lock = asyncio.Lock()
+        # done once the last checkpoint taken is written, later ones wait on it so
+        # files land in the order they were taken
+        self._last_write: asyncio.Future | None = None
+
+    @property
+    def filling_lobbies(self) -> dict[int, list[Lobby]]:
+        "{solo/duo/trio: [lobbies]} still filling, oldest first"
+        return self.lobby_deadlines.filling_lobbies()
+
+    async def enqueue(self, party: Party):
+        "Queues a party for the next tick, waiting while the queue is full"
+        await self.pending.put(party)
+
+    def try_enqueue(self, party: Party) -> bool:
+        "Queues a party for the next tick, False if the queue is full"
+        try:
+            self.pending.put_nowait(party)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def now(self) -> int:
+        "Whole seconds since the service started, the unit lobbies keep time in"
+        return int(self.clock() - self.started_at)
+
+    async def tick(self):
+        "Places queued parties and starts or cancels lobbies"
+        async with self._lock:
+            now = self.now()
+
+            queued_parties = []
+            while not self.pending.empty():
+                queued_parties.append(self.pending.get_nowait())
+
+            with metrics.timer("process_queued_parties"):
+                matchmaking.put_parties_in_lobbies(
+                    {1: [], 2: [], 3: []},
+                    queued_parties,
+                    lobby_index=self.lobby_index,
+                    created_at=now,
+                    lobby_deadlines=self.lobby_deadlines,
+                    mmr_method=self.mmr_method,
+                    mmr_threshold=self.mmr_threshold,
+                )
+
+            with metrics.timer("update_lobbies"):
+                due_lobbies = self.lobby_deadlines.pop_due(now)
+                started_lobbies, _, canceled_parties = self.lobby_deadlines.check(
+                    due_lobbies, now
+                )
+
+        for lobby in started_lobbies:
+            await _call(self.on_lobby_started, lobby)
+        for party in canceled_parties:
+            await _call(self.on_party_canceled, party)
+
+    async def checkpoint(self, path: str) -> int:
+        """Writes filling lobbies, queued parties and counters to path.
+
+        Ticks only wait while the state is encoded, the file is written after, and
+        both happen on a worker thread so connections can keep queuing. A checkpoint
+        taken while an earlier one is still being written waits for it, without
+        holding up ticks. Returns the checkpoint's size in bytes."""
+
+        async with self._lock:
+            pending = []
+            while not self.pending.empty():
+                pending.append(self.pending.get_nowait())
+            for party in pending:
+                self.pending.put_nowait(party)
+
+            snapshot = checkpoint.Checkpoint(
+                now=self.now(),
+                lobbies=list(self.lobby_deadlines.lobbies.values()),
+                pending=pending,
+                counters=checkpoint.current_counters(),
+            )
+            data = await asyncio.to_thread(checkpoint.encode_checkpoint, snapshot)
+            previous = self._last_write
+            written = self._last_write = asyncio.get_running_loop().create_future()
+
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            return await asyncio.to_thread(
+                checkpoint.write_checkpoint_bytes, path, data
+            )
+        finally:
+            if previous is None or previous.done():
+                written.set_result(None)
+            else:
+                # cancelled while waiting, the next write still waits on previous
+                previous.add_done_callback(lambda _: written.set_result(None))
+
+    def restore(self, path: str, freeze_gc=False):
+        """Carries on from a checkpoint, before the service starts.
+
+        Lobbies keep their deadlines, the service clock resumes at the second the
+        checkpoint was taken and its queued parties are queued again.
+
+        With `freeze_gc` everything alive after restoring, the restored lobbies
+        included, is moved out of the garbage collector's reach with `gc.freeze`,
+        so full collections stop walking them. It freezes the whole process, so
+        only use it once at startup."""
+
+        snapshot = checkpoint.read_checkpoint(path)
+        self.lobby_index, self.lobby_deadlines = checkpoint.restore_matchmaking(
+            snapshot,
+            mmr_method=self.mmr_method,
+            max_queue_time_secs=self.max_queue_time_secs,
+        )
+        for party in snapshot.pending:
+            self.pending.put_nowait(party)
+        self.started_at = self.clock() - snapshot.now
+        if freeze_gc:
+            gc.freeze()
+
+    async def run(self):
+        "Ticks every `tick_secs` until cancelled"
+        loop = asyncio.get_running_loop()
+        while True:
+            tick_start = loop.time()
+            await self.tick()
+            await asyncio.sleep(max(self.tick_secs - (loop.time() - tick_start), 0))
+
+    def start(self) -> asyncio.Task:
+        "Runs the tick loop in the background"
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        "Stops the tick loop, parties still queued stay queued"
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+
+async def _call(callback: Callable | None, *args):
+    "Calls a sync or async callback, logging what it raises so ticks carry on"
+    if callback is None:
+        return
+    try:
+        result = callback(*args)
+        if inspect.isawaitable(result):
+            await result
+    except Exception:
+        logger.exception("matchmaking callback %r failed", callback)
+
+
+class LocalClient:
+    "Stand-in for game clients, queuing random parties into a service"
+
+    def __init__(self, service: MatchmakingService, current_map=Map.goblin_caves):
+        self.service = service
+        self.current_map = current_map
+        self.enqueue_latencies: list[float] = []
+
+    async def queue_party(self, party: core.Party | None = None) -> core.Party:
+        "Queues party, or a random one, recording how long enqueueing took"
+        if party is None:
+            party = simulation.generate_party(map=self.current_map)
+        start = time.perf_counter()
+        await self.service.enqueue(party)
+        self.enqueue_latencies.append(time.perf_counter() - start)
+        return party
+
+    async def run(self, parties_per_sec: float, duration_secs: float):
+        "Queues random parties at a steady rate for `duration_secs`"
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration_secs
+        while loop.time() < end:
+            await self.queue_party()
+            await asyncio.sleep(1 / parties_per_sec)
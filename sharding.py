@@ -0,0 +1,275 @@
+import multiprocessing
+import queue
+import random
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+
+import matchmaking as matchmaking
+import mmr
+import simulation as simulation
+from core import Lobby, Party
+from schema import Map
+
+# parties only ever match within the same map and party size
+ShardKey = tuple[Map, int]
+
+ALL_SHARDS: list[ShardKey] = [
+    (current_map, party_size) for current_map in Map for party_size in (1, 2, 3)
+]
+
+
+class ShardState:
+    "Filling lobbies of one (map, party_size) bracket"
+
+    def __init__(
+        self,
+        shard: ShardKey,
+        max_queue_time_secs=300,
+        mmr_method="max_gs",
+        mmr_threshold=50,
+    ):
+        self.shard = shard
+        self.max_queue_time_secs = max_queue_time_secs
+        self.mmr_method = mmr.resolve(mmr_method)
+        self.mmr_threshold = mmr_threshold
+
+        self.lobby_index = matchmaking.LobbyIndex(mmr_method=mmr_method)
+        self.lobby_deadlines = matchmaking.LobbyDeadlines(max_queue_time_secs)
+
+    @property
+    def filling_lobbies(self) -> dict[int, list[Lobby]]:
+        _, party_size = self.shard
+        return {party_size: self.lobby_deadlines.filling_lobbies()[party_size]}
+
+    def tick(self, now: int, parties: list[Party]) -> tuple[list[Lobby], list[Party]]:
+        "Places parties queued at `now`, returning started lobbies and canceled parties"
+        _, party_size = self.shard
+        matchmaking.put_parties_in_lobbies(
+            {party_size: []},
+            parties,
+            lobby_index=self.lobby_index,
+            created_at=now,
+            lobby_deadlines=self.lobby_deadlines,
+            mmr_method=self.mmr_method,
+            mmr_threshold=self.mmr_threshold,
+        )
+
+        due_lobbies = self.lobby_deadlines.pop_due(now)
+        started, _, canceled_parties = self.lobby_deadlines.check(due_lobbies, now)
+        return started, canceled_parties
+
+
+def _run_shard(shard: ShardKey, inbox: Queue, outbox: Queue, config: dict):
+    "Worker process loop, owning one shard until it receives None"
+    state = ShardState(shard, **config)
+    while (message := inbox.get()) is not None:
+        now, parties = message
+        started, canceled_parties = state.tick(now, parties)
+        if started or canceled_parties:
+            outbox.put((shard, now, started, canceled_parties))
+
+    _, party_size = shard
+    outbox.put((shard, None, state.filling_lobbies[party_size], []))
+
+
+class ShardedMatchmaker:
+    """Runs every (map, party_size) bracket in its own worker process.
+
+    `submit` routes the parties queued in a second to the process owning their
+    bracket and ticks every shard. Shards send back started lobbies and canceled
+    parties on one shared queue, read with `collect`. `stop` returns the lobbies
+    still filling.
+
+    Waiting on shards raises `RuntimeError` once a worker died without sending its
+    stop reply, instead of waiting on it forever.
+    """
+
+    # seconds a blocking collect waits on the queue between checks on the workers
+    POLL_SECS = 0.5
+
+    def __init__(
+        self,
+        shards: list[ShardKey] | None = None,
+        max_queue_time_secs=300,
+        mmr_method="max_gs",
+        mmr_threshold=50,
+    ):
+        self.shards = shards or ALL_SHARDS
+        self.config = {
+            "max_queue_time_secs": max_queue_time_secs,
+            "mmr_method": mmr_method,
+            "mmr_threshold": mmr_threshold,
+        }
+        self.inboxes: dict[ShardKey, Queue] = {}
+        self.outbox: Queue | None = None
+        self.processes: list[BaseProcess] = []
+        # shards that sent back their filling lobbies after stopping
+        self._stopped: dict[ShardKey, list[Lobby]] = {}
+
+    def start(self):
+        self.outbox = multiprocessing.Queue()
+        for shard in self.shards:
+            inbox: Queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_run_shard,
+                args=(shard, inbox, self.outbox, self.config),
+                daemon=True,
+            )
+            process.start()
+            self.inboxes[shard] = inbox
+            self.processes.append(process)
+
+    def submit(self, now: int, parties: list[Party]):
+        "Sends the parties queued at `now` to their shards and ticks every shard"
+        routed: dict[ShardKey, list[Party]] = {shard: [] for shard in self.shards}
+        for party in parties:
+            routed[(party.map, party.max_size)].append(party)
+
+        for shard, inbox in self.inboxes.items():
+            inbox.put((now, routed[shard]))
+
+    def collect(
+        self, block=False
+    ) -> list[tuple[ShardKey, int, list[Lobby], list[Party]]]:
+        """Started lobbies and canceled parties shards sent back so far.
+
+        Every message is (shard, now, started lobbies, canceled parties). With
+        `block` waits until a shard sends anything, which may be its stop reply, and
+        raises `RuntimeError` if a worker died first, stopping every other one."""
+
+        assert self.outbox is not None, "start() the matchmaker first"
+        messages = []
+        received = False
+        # shards whose worker was dead at the last timeout
+        dead: set[ShardKey] = set()
+        while True:
+            try:
+                message = self.outbox.get(
+                    block=block and not received, timeout=self.POLL_SECS
+                )
+            except queue.Empty:
+                if not block or received:
+                    break
+                # workers flush what they sent before exiting, so a worker only
+                # counts as dead when another wait brought nothing from it either
+                dead_again = dead & self._dead_shards()
+                if dead_again:
+                    self._terminate()
+                    raise RuntimeError(
+                        f"Shard worker for {min(dead_again)} died before stopping"
+                    )
+                dead = self._dead_shards()
+                continue
+
+            received = True
+            shard, now, lobbies, canceled_parties = message
+            if now is None:
+                self._stopped[shard] = lobbies
+            else:
+                messages.append(message)
+
+        return messages
+
+    def _dead_shards(self) -> set[ShardKey]:
+        "Shards whose worker exited without sending back its filling lobbies"
+        return {
+            shard
+            for shard, process in zip(self.shards, self.processes)
+            if shard not in self._stopped and not process.is_alive()
+        }
+
+    def _terminate(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.inboxes = {}
+        self.processes = []
+        self._stopped = {}
+
+    def stop(
+        self,
+    ) -> tuple[
+        list[tuple[ShardKey, int, list[Lobby], list[Party]]],
+        dict[ShardKey, list[Lobby]],
+    ]:
+        """Stops every shard once it processed everything submitted.
+
+        Returns the messages not collected yet and each shard's filling lobbies."""
+
+        for inbox in self.inboxes.values():
+            inbox.put(None)
+
+        messages = []
+        while len(self._stopped) < len(self.shards):
+            messages.extend(self.collect(block=True))
+        for process in self.processes:
+            process.join()
+
+        filling = self._stopped
+        self.inboxes = {}
+        self.processes = []
+        self._stopped = {}
+        return messages, filling
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.processes:
+            self.stop()
+
+
+def sharded_simulator(
+    simulated_secs=600,
+    max_queue_time_secs=300,
+    mmr_method="max_gs",
+    mmr_threshold=50,
+    seed: int | None = None,
+    current_map: Map | None = None,
+) -> dict:
+    """Simulates matchmaking with every bracket in its own process.
+
+    Parties queue on `current_map`, or a random map each when None. Results have the
+    same shape as `simulation.simulator`, ordered by second and then bracket.
+    """
+
+    if seed is not None:
+        random.seed(seed)
+
+    party_gen = simulation.party_queuing_generator(current_map=current_map)
+    shards = [(m, s) for m, s in ALL_SHARDS if current_map in (None, m)]
+
+    messages = []
+    with ShardedMatchmaker(
+        shards=shards,
+        max_queue_time_secs=max_queue_time_secs,
+        mmr_method=mmr_method,
+        mmr_threshold=mmr_threshold,
+    ) as matchmaker:
+        for t in range(simulated_secs):
+            matchmaker.submit(t, next(party_gen))
+            messages.extend(matchmaker.collect())
+        remaining, filling = matchmaker.stop()
+        messages.extend(remaining)
+
+    messages.sort(key=lambda message: (message[1], shards.index(message[0])))
+
+    all_started_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
+    all_canceled_parties: list[Party] = []
+    for (_, party_size), _, started, canceled_parties in messages:
+        all_started_lobbies[party_size].extend(started)
+        all_canceled_parties.extend(canceled_parties)
+
+    all_filling_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
+    for shard in shards:
+        _, party_size = shard
+        for lobby in filling[shard]:
+            lobby.queue_time = simulated_secs - lobby.created_at
+            all_filling_lobbies[party_size].append(lobby)
+
+    return {
+        "started": all_started_lobbies,
+        "filling": all_filling_lobbies,
+        "canceled_parties": all_canceled_parties,
+    }
@@ -1,17 +1,34 @@
 import argparse
+import contextlib
+import heapq
+import itertools
 import json
+import logging
 import random
+from typing import Any, Callable, Iterable, Iterator
 
 from pydantic import BaseModel
 
+import analytics
+import checkpoint
+import core
 import matchmaking as matchmaking
-from schema import Job, Lobby, Map, Party, Player
+import metrics
+import mmr
+import profiling
+import workload
+from core import Lobby, Party, Player
+from schema import Job, LobbyStatus, Map
+from writers import WRITERS, LobbyArchive, MultiWriter, ResultsWriter
 
 
 class PydanticEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, BaseModel):
             return o.model_dump()
+        elif isinstance(o, (core.Player, core.Party, core.Lobby)):
+            # validated on the way out so results match the schema models
+            return o.to_model().model_dump()
         else:
             return super().default(o)
 
@@ -58,94 +75,462 @@ def process_queued_parties(
     queued_parties: list[Party],
     all_filling_lobbies: dict[int, list[Lobby]],
     max_queue_time_secs: int,
-    mmr_method: str,
+    mmr_method: str | mmr.MMRStrategy,
     mmr_threshold: int,
+    lobby_index: matchmaking.LobbyIndex | None = None,
+    now: int = 0,
+    lobby_deadlines: matchmaking.LobbyDeadlines | None = None,
+    mmr_schedule: matchmaking.ThresholdSchedule | None = None,
+    party_pool: matchmaking.PartyPool | None = None,
 ):
     """Processes the queued parties by placing them in lobbies."""
-    for party in queued_parties:
-        l_party_size = party.max_size
-        lobby_group = all_filling_lobbies[l_party_size]
-        lobby_group = matchmaking.put_party_in_lobby(
-            lobby_group,
-            party,
-            max_queue_time=max_queue_time_secs,
+    with metrics.timer("process_queued_parties"):
+        matchmaking.put_parties_in_lobbies(
+            all_filling_lobbies,
+            queued_parties,
+            lobby_index=lobby_index,
+            created_at=now,
+            lobby_deadlines=lobby_deadlines,
+            mmr_schedule=mmr_schedule,
+            party_pool=party_pool,
             mmr_method=mmr_method,
             mmr_threshold=mmr_threshold,
         )
-        all_filling_lobbies[l_party_size] = lobby_group
 
 
 def update_lobbies(
-    all_filling_lobbies: dict[int, list[Lobby]],
+    lobby_deadlines: matchmaking.LobbyDeadlines,
+    now: int,
     all_started_lobbies: dict[int, list[Lobby]],
     all_canceled_parties: list[Party],
-    max_queue_time_secs: int,
+    writer: ResultsWriter | None = None,
+    retain: bool = True,
+    lobby_index: matchmaking.LobbyIndex | None = None,
 ):
-    """Starts or cancels lobbies and updates their status."""
-    for l_party_size, lobbies in all_filling_lobbies.items():
-        canceled_parties = start_or_cancel_lobbies(lobbies, max_queue_time_secs)
+    """Starts or cancels the lobbies that filled up or reached their deadline.
+
+    When `lobby_deadlines` has an mmr schedule, lobbies whose threshold widened are
+    first merged with lobbies in reach through `lobby_index`.
+
+    Started lobbies and canceled parties go to `writer` as they happen and are only
+    kept in `all_started_lobbies` and `all_canceled_parties` when retained."""
+    with metrics.timer("update_lobbies"):
+        due_lobbies = lobby_deadlines.pop_due(now)
+        if lobby_index is not None and lobby_deadlines.mmr_schedule is not None:
+            matchmaking.merge_widened_lobbies(
+                due_lobbies,
+                lobby_index,
+                lobby_deadlines.mmr_schedule,
+                now,
+                lobby_deadlines=lobby_deadlines,
+            )
+            # merged away lobbies are gone, lobbies merges filled up are due now
+            due_lobbies = [lob for lob in due_lobbies if lob in lobby_deadlines]
+            seen = {id(lob) for lob in due_lobbies}
+            due_lobbies.extend(
+                lob for lob in lobby_deadlines.pop_due(now) if id(lob) not in seen
+            )
+
+        for l_party_size, started_lobbies in all_started_lobbies.items():
+            lobbies = [lob for lob in due_lobbies if lob.party_size == l_party_size]
+            started, _, canceled_parties = lobby_deadlines.check(lobbies, now)
+
+            record_finished(
+                canceled_parties,
+                started,
+                started_lobbies,
+                all_canceled_parties,
+                writer=writer,
+                retain=retain,
+            )
+
+
+def record_finished(
+    canceled_parties: list[Party],
+    started_lobbies: list[Lobby],
+    all_started_lobbies: list[Lobby],
+    all_canceled_parties: list[Party],
+    writer: ResultsWriter | None = None,
+    retain: bool = True,
+):
+    """Hands parties and lobbies that left matchmaking to the writer and results."""
+    if writer is not None:
+        for party in canceled_parties:
+            writer.write_canceled_party(party)
+        for lobby in started_lobbies:
+            writer.write_lobby(lobby)
+
+    if retain:
         all_canceled_parties.extend(canceled_parties)
+        all_started_lobbies.extend(started_lobbies)
 
-        filling_lobbies, started_lobbies, _ = matchmaking.regroup_lobbies(lobbies)
 
-        all_filling_lobbies[l_party_size] = filling_lobbies
-        all_started_lobbies[l_party_size].extend(started_lobbies)
+def write_filling(
+    all_filling_lobbies: dict[int, list[Lobby]], writer: ResultsWriter | None = None
+):
+    """Hands lobbies still filling at the end of a run to the writer."""
+    if writer is not None:
+        for lobbies in all_filling_lobbies.values():
+            for lobby in lobbies:
+                writer.write_lobby(lobby)
 
 
 def start_or_cancel_lobbies(
     lobbies: list[Lobby], max_queue_time_secs: int
 ) -> list[Party]:
     """Attempts to start or cancel lobbies based on queue time."""
-    canceled_parties = []
-    for lobby in lobbies:
-        _, dropped_parties = matchmaking.maybe_start_lobby(lobby, max_queue_time_secs)
-        canceled_parties.extend(dropped_parties)
-
-    for lobby in lobbies:
-        _, dropped_parties = matchmaking.maybe_cancel_matchmaking(
-            lobby, max_queue_time_secs
-        )
-        canceled_parties.extend(dropped_parties)
-
+    _, _, _, canceled_parties = matchmaking.partition_lobbies(
+        lobbies, max_queue_time_secs
+    )
     return canceled_parties
 
 
-def increment_queue_time(all_filling_lobbies: dict[int, list[Lobby]]):
-    """Increments the queue time for all lobbies."""
-    for lobby_group in all_filling_lobbies.values():
-        for lobby in lobby_group:
-            lobby.queue_time += 1
-
-
 def simulator(
-    simulated_secs=600, max_queue_time_secs=300, mmr_method="max_gs", mmr_threshold=50
+    simulated_secs=600,
+    max_queue_time_secs=300,
+    mmr_method="max_gs",
+    mmr_threshold=50,
+    seed: int | None = None,
+    writer: ResultsWriter | None = None,
+    retain: bool = True,
+    arrivals: Iterable[list[Party]] | None = None,
+    mmr_schedule: list[tuple[int, float]] | None = None,
+    resume: checkpoint.Checkpoint | None = None,
+    checkpoint_path: str | None = None,
+    party_pool: bool = False,
 ) -> dict:
-    """Simulates parties queuing and being matched into a game."""
+    """Simulates parties queuing and being matched into a game.
+
+    Parties queuing each second come from `arrivals`, e.g. a `workload`, or from
+    `party_queuing_generator` by default.
+
+    A run can `resume` from a checkpoint, carrying on from its lobbies at the second
+    it was taken, with `arrivals` starting at that second. With `checkpoint_path`
+    the state at `simulated_secs` is written there to resume from later.
+
+    `mmr_schedule` widens the mmr threshold of lobbies as they wait, as
+    (queue_time_secs, mmr_threshold) steps, merging lobbies that come within reach.
+
+    With `party_pool` partial parties wait in a `matchmaking.PartyPool` until they
+    make up full parties, instead of in lobbies. Parties still pooled at the end are
+    returned under "pooled", and checkpointed as queued parties.
+
+    Every started lobby, canceled party and lobby still filling at the end is handed
+    to `writer`. Without `retain` started lobbies and canceled parties are not kept
+    in the returned results, so memory does not grow with the simulated time."""
+
+    if seed is not None:
+        random.seed(seed)
+    # resolved once, placement calls the strategy directly
+    mmr_method = mmr.resolve(mmr_method)
 
-    # {solo/duo/trio: [lobbies]}
-    all_filling_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
     all_started_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
     # parties sent back to menu because no game could be found
     all_canceled_parties: list[Party] = []
-
-    party_gen = party_queuing_generator()
-
-    for t in range(simulated_secs):
-        queued_parties = next(party_gen)
+    # filling lobbies sorted by mmr, started/canceled lobbies drop out lazily
+    lobby_index = matchmaking.LobbyIndex(mmr_method=mmr_method)
+    schedule = None
+    if mmr_schedule:
+        schedule = matchmaking.ThresholdSchedule(mmr_threshold, tuple(mmr_schedule))
+    # filling lobbies by when they need to start, cancel or widen
+    lobby_deadlines = matchmaking.LobbyDeadlines(max_queue_time_secs, schedule)
+    start_secs = 0
+    if resume is not None:
+        lobby_index, lobby_deadlines = checkpoint.restore_matchmaking(
+            resume, mmr_method, max_queue_time_secs, schedule
+        )
+        start_secs = resume.now
+    pool = None
+    if party_pool:
+        pool = matchmaking.PartyPool(mmr_method, max_queue_time_secs)
+
+    party_gen = iter(arrivals) if arrivals is not None else party_queuing_generator()
+    if resume is not None and resume.pending:
+        # parties waiting when the checkpoint was taken queue again first
+        party_gen = itertools.chain([resume.pending + next(party_gen, [])], party_gen)
+
+    for t in range(start_secs, simulated_secs):
+        queued_parties: list[Party] = next(party_gen, [])
+        # lobbies are found through the index, the lists only collect new lobbies
+        new_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
         process_queued_parties(
             queued_parties,
-            all_filling_lobbies,
+            new_lobbies,
             max_queue_time_secs,
             mmr_method,
             mmr_threshold,
+            lobby_index=lobby_index,
+            now=t,
+            lobby_deadlines=lobby_deadlines,
+            mmr_schedule=schedule,
+            party_pool=pool,
         )
         update_lobbies(
-            all_filling_lobbies,
+            lobby_deadlines,
+            t,
             all_started_lobbies,
             all_canceled_parties,
-            max_queue_time_secs,
+            writer=writer,
+            retain=retain,
+            lobby_index=lobby_index,
         )
-        increment_queue_time(all_filling_lobbies)
+        if pool is not None:
+            record_finished(
+                pool.pop_expired(t),
+                [],
+                [],
+                all_canceled_parties,
+                writer=writer,
+                retain=retain,
+            )
+
+    if checkpoint_path is not None:
+        checkpoint.write_checkpoint(
+            checkpoint_path,
+            checkpoint.Checkpoint(
+                now=simulated_secs,
+                lobbies=list(lobby_deadlines.lobbies.values()),
+                pending=list(pool.parties.values()) if pool is not None else [],
+                counters=checkpoint.current_counters(),
+            ),
+        )
+
+    # {solo/duo/trio: [lobbies]}
+    all_filling_lobbies = lobby_deadlines.filling_lobbies()
+    for lobbies in all_filling_lobbies.values():
+        for lobby in lobbies:
+            lobby.queue_time = simulated_secs - lobby.created_at
+    write_filling(all_filling_lobbies, writer=writer)
+
+    results = {
+        "started": all_started_lobbies,
+        "filling": all_filling_lobbies,
+        "canceled_parties": all_canceled_parties,
+    }
+    if pool is not None:
+        results["pooled"] = list(pool.parties.values())
+    return results
+
+
+def arrival_events(
+    party_gen: Iterator[list[Party]], simulated_secs: int
+) -> Iterator[tuple[int, list[Party]]]:
+    "Seconds in which at least one party queued, with the parties that queued"
+    for t in range(simulated_secs):
+        queued_parties: list[Party] = next(party_gen, [])
+        if queued_parties:
+            yield t, queued_parties
+
+
+# event phases, parties queued in a second are placed before lobbies are checked
+ARRIVAL = 0
+LOBBY_CHECK = 1
+
+
+def event_simulator(
+    simulated_secs=600,
+    max_queue_time_secs=300,
+    mmr_method="max_gs",
+    mmr_threshold=50,
+    seed: int | None = None,
+    writer: ResultsWriter | None = None,
+    retain: bool = True,
+    arrivals: Iterable[list[Party]] | None = None,
+) -> dict:
+    """Simulates the same matchmaking as `simulator` driven by a queue of events.
+
+    Lobbies are only looked at when parties queue, when a lobby fills up and when a
+    lobby reaches `max_queue_time_secs`, instead of every lobby every second.
+    Lobbies keep their creation time and get their queue time when they leave
+    matchmaking, so results match `simulator` for the same queued parties.
+    """
+
+    if seed is not None:
+        random.seed(seed)
+    mmr_method = mmr.resolve(mmr_method)
+
+    # {seq: lobby} in creation order
+    filling_lobbies: dict[int, Lobby] = {}
+    # {id(lobby): seq} for filling lobbies
+    lobby_seqs: dict[int, int] = {}
+    next_seq = itertools.count()
+    all_started_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
+    all_canceled_parties: list[Party] = []
+    lobby_index = matchmaking.LobbyIndex(mmr_method=mmr_method)
+
+    # (time, phase, lobby seq, queued parties)
+    events: list[tuple[int, int, int, list[Party]]] = []
+    party_gen = iter(arrivals) if arrivals is not None else party_queuing_generator()
+    queued = arrival_events(party_gen, simulated_secs)
+
+    def push_next_arrival():
+        arrival = next(queued, None)
+        if arrival is not None:
+            arrival_t, queued_parties = arrival
+            heapq.heappush(events, (arrival_t, ARRIVAL, -1, queued_parties))
+
+    push_next_arrival()
+    while events:
+        t, phase, seq, queued_parties = heapq.heappop(events)
+        if t >= simulated_secs:
+            break
+
+        if phase == ARRIVAL:
+            with metrics.timer("process_queued_parties"):
+                for party in queued_parties:
+                    new_lobbies: list[Lobby] = []
+                    placed = matchmaking.place_party(
+                        new_lobbies,
+                        party,
+                        lobby_index=lobby_index,
+                        created_at=t,
+                        mmr_method=mmr_method,
+                        mmr_threshold=mmr_threshold,
+                    )
+                    if new_lobbies:
+                        lobby_seq = next(next_seq)
+                        lobby_seqs[id(placed)] = lobby_seq
+                        filling_lobbies[lobby_seq] = placed
+                        deadline = t + max_queue_time_secs
+                        heapq.heappush(events, (deadline, LOBBY_CHECK, lobby_seq, []))
+                    elif matchmaking.is_lobby_full(placed):
+                        heapq.heappush(
+                            events, (t, LOBBY_CHECK, lobby_seqs[id(placed)], [])
+                        )
+
+            push_next_arrival()
+            continue
+
+        lobby = filling_lobbies.get(seq)
+        # already started by an earlier event
+        if lobby is None:
+            continue
+
+        with metrics.timer("update_lobbies"):
+            lobby.queue_time = t - lobby.created_at
+            canceled_parties = start_or_cancel_lobbies([lobby], max_queue_time_secs)
+
+            if lobby.status != LobbyStatus.filling:
+                del filling_lobbies[seq]
+                del lobby_seqs[id(lobby)]
+                lobby_index.remove(lobby)
+
+            started_lobbies = [lobby] if lobby.status == LobbyStatus.started else []
+            record_finished(
+                canceled_parties,
+                started_lobbies,
+                all_started_lobbies[lobby.party_size],
+                all_canceled_parties,
+                writer=writer,
+                retain=retain,
+            )
+
+    all_filling_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
+    for lobby in filling_lobbies.values():
+        lobby.queue_time = simulated_secs - lobby.created_at
+        all_filling_lobbies[lobby.party_size].append(lobby)
+
+    write_filling(all_filling_lobbies, writer=writer)
+
+    return {
+        "started": all_started_lobbies,
+        "filling": all_filling_lobbies,
+        "canceled_parties": all_canceled_parties,
+    }
+
+
+def batch_simulator(
+    simulated_secs=600,
+    max_queue_time_secs=300,
+    mmr_method="max_gs",
+    mmr_threshold=50,
+    seed: int | None = None,
+    writer: ResultsWriter | None = None,
+    retain: bool = True,
+    arrivals: Iterable[list[Party]] | None = None,
+    batch_secs=10,
+) -> dict:
+    """Simulates matchmaking that assigns the whole waiting pool every `batch_secs`.
+
+    Queued parties wait in a pool instead of being placed on arrival. Every batch
+    `matchmaking.pack_lobbies` packs the pool into lobbies, full lobbies start and
+    lobbies whose oldest party waited `max_queue_time_secs` start or cancel like in
+    `simulator`. Parties of the other lobbies go back to the pool for the next
+    batch, as do partial parties dropped before they waited `max_queue_time_secs`
+    themselves. Results have the same shape as `simulator`.
+    """
+
+    if seed is not None:
+        random.seed(seed)
+    mmr_method = mmr.resolve(mmr_method)
+
+    all_started_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
+    all_canceled_parties: list[Party] = []
+    # waiting parties and the second each queued in
+    pool: list[Party] = []
+    queued_at: list[int] = []
+
+    party_gen = iter(arrivals) if arrivals is not None else party_queuing_generator()
+
+    for t in range(simulated_secs):
+        queued_parties: list[Party] = next(party_gen, [])
+        pool.extend(queued_parties)
+        queued_at.extend([t] * len(queued_parties))
+        if (t + 1) % batch_secs:
+            continue
+
+        # players keep their queue time when their party merges with another
+        player_since = {
+            id(player): since
+            for party, since in zip(pool, queued_at)
+            for player in party.players
+        }
+
+        def waiting_since(party: Party) -> int:
+            return min(player_since[id(player)] for player in party.players)
+
+        with metrics.timer("pack_lobbies"):
+            lobbies = matchmaking.pack_lobbies(
+                pool, queued_at, mmr_method=mmr_method, mmr_threshold=mmr_threshold
+            )
+
+        with metrics.timer("update_lobbies"):
+            for lobby in lobbies:
+                lobby.queue_time = t - lobby.created_at
+            filling, started, _, dropped_parties = matchmaking.partition_lobbies(
+                lobbies, max_queue_time_secs
+            )
+
+            # partial parties dropped from a lobby started for its oldest parties
+            # keep waiting until they reach max_queue_time_secs themselves
+            waiting = [p for lobby in filling for p in lobby.parties]
+            canceled_parties = []
+            for party in dropped_parties:
+                if t - waiting_since(party) < max_queue_time_secs:
+                    waiting.append(party)
+                else:
+                    canceled_parties.append(party)
+            pool = waiting
+            queued_at = [waiting_since(party) for party in waiting]
+
+            for l_party_size, started_lobbies in all_started_lobbies.items():
+                record_finished(
+                    [p for p in canceled_parties if p.max_size == l_party_size],
+                    [lob for lob in started if lob.party_size == l_party_size],
+                    started_lobbies,
+                    all_canceled_parties,
+                    writer=writer,
+                    retain=retain,
+                )
+
+    all_filling_lobbies: dict[int, list[Lobby]] = {1: [], 2: [], 3: []}
+    for lobby in matchmaking.pack_lobbies(
+        pool, queued_at, mmr_method=mmr_method, mmr_threshold=mmr_threshold
+    ):
+        lobby.queue_time = simulated_secs - lobby.created_at
+        all_filling_lobbies[lobby.party_size].append(lobby)
+
+    write_filling(all_filling_lobbies, writer=writer)
 
     return {
         "started": all_started_lobbies,
@@ -154,6 +539,13 @@ def simulator(
     }
 
 
+ENGINES: dict[str, Callable[..., dict]] = {
+    "tick": simulator,
+    "event": event_simulator,
+    "batch": batch_simulator,
+}
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -176,7 +568,8 @@ if __name__ == "__main__":
         "--mmr_method",
         type=str,
         default="max_gs",
-        help="MMR calculation method: Currently 'max_gs' and 'avg_gs'.",
+        choices=mmr.STRATEGIES.keys(),
+        help="MMR calculation method, one of the strategies registered in mmr.",
     )
     parser.add_argument(
         "--mmr_threshold",
@@ -185,14 +578,203 @@ if __name__ == "__main__":
         help="Maximum MMR difference for two parties to be matchable.",
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--mmr_schedule",
+        type=str,
+        nargs="+",
+        default=None,
+        metavar="SECS:THRESHOLD",
+        help="Widen the mmr threshold of waiting lobbies, e.g. 60:75 120:100. "
+        "Only with the tick engine.",
+    )
 
-    results = simulator(
-        simulated_secs=args.simulated_secs,
-        max_queue_time_secs=args.max_queue_time,
-        mmr_method=args.mmr_method,
-        mmr_threshold=args.mmr_threshold,
+    parser.add_argument(
+        "--party_pool",
+        action="store_true",
+        help="Pool partial parties until they make up full parties before placing "
+        "them in lobbies. Only with the tick engine.",
+    )
+
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="tick",
+        choices=ENGINES.keys(),
+        help="'tick' steps every second, 'event' skips seconds where nothing happens, "
+        "'batch' assigns all waiting parties every --batch_secs.",
+    )
+    parser.add_argument(
+        "--batch_secs",
+        type=int,
+        default=10,
+        help="How often the batch engine assigns the waiting parties.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="results.json",
+        help="File to write results to.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed to make a run reproducible.",
+    )
+    parser.add_argument(
+        "--workload",
+        type=str,
+        default=None,
+        help="Workload file to replay instead of generating parties.",
+    )
+
+    parser.add_argument(
+        "--map_rate",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("MAP", "RATE"),
+        help="Generate parties queuing on MAP at RATE parties per second, in a "
+        "stream of its own, repeatable. Instead of --workload.",
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="File to write the matchmaking state to at the end, tick engine only.",
     )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        help="Checkpoint to carry on from up to --simulated_secs, tick engine only.",
+    )
+
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="json",
+        choices=["json", *WRITERS.keys()],
+        help="'json' dumps everything at the end, others stream lobbies as they start.",
+    )
+    parser.add_argument(
+        "--no_retain",
+        action="store_true",
+        help="Don't keep started lobbies in memory, only with a streaming format.",
+    )
+
+    parser.add_argument(
+        "--analytics",
+        type=str,
+        default=None,
+        help="File to write a summary of wait, fill, gear score spread and cancels "
+        "per bracket to, built as the run goes. Merge runs with analytics.py.",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default="none",
+        choices=["none", "log", "prometheus"],
+        help="Report matchmaking counters and phase timings as log lines or a file.",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        default="metrics.prom",
+        help="File rewritten with Prometheus style metrics.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="PREFIX",
+        help="Profile the run, writing PREFIX.prof for snakeviz and "
+        "PREFIX.collapsed for flamegraphs, and print where the time went.",
+    )
+    parser.add_argument(
+        "--profile_top",
+        type=int,
+        default=20,
+        help="How many functions the profile summary lists.",
+    )
+
+    args = parser.parse_args()
+    if args.mmr_schedule and args.engine != "tick":
+        parser.error("--mmr_schedule needs --engine=tick")
+    if (args.checkpoint or args.resume) and args.engine != "tick":
+        parser.error("--checkpoint and --resume need --engine=tick")
+    if args.map_rate and args.workload:
+        parser.error("--map_rate generates parties, it can't replay --workload")
+    if args.party_pool and args.engine != "tick":
+        parser.error("--party_pool needs --engine=tick")
+
+    if args.metrics == "log":
+        logging.basicConfig(level=logging.INFO)
+        metrics.set_metrics(metrics.LogMetrics())
+    elif args.metrics == "prometheus":
+        metrics.set_metrics(metrics.PrometheusFileMetrics(args.metrics_file))
+
+    if args.output_format == "json":
+        writer = ResultsWriter()
+        retain = True
+    elif args.output_format == "archive":
+        # archived mmr ranges are taken with the mmr method lobbies were made with
+        writer = LobbyArchive(args.output, mmr_method=args.mmr_method)
+        retain = not args.no_retain
+    else:
+        writer = WRITERS[args.output_format](args.output)
+        retain = not args.no_retain
+    if args.analytics:
+        writer = MultiWriter(writer, analytics.RunAnalytics(args.analytics))
+
+    engine_kwargs: dict[str, Any] = {}
+    if args.mmr_schedule:
+        schedule = matchmaking.ThresholdSchedule.parse(
+            args.mmr_threshold, args.mmr_schedule
+        )
+        engine_kwargs["mmr_schedule"] = list(schedule.steps)
+    if args.party_pool:
+        engine_kwargs["party_pool"] = True
+    if args.engine == "batch":
+        engine_kwargs["batch_secs"] = args.batch_secs
+
+    arrivals = workload.read_workload(args.workload) if args.workload else None
+    if args.map_rate:
+        configs = workload.map_configs(workload.WorkloadConfig(), args.map_rate)
+        arrivals = workload.generate_map_workloads(
+            configs, args.simulated_secs, seed=args.seed or 0
+        )
+    if args.checkpoint:
+        engine_kwargs["checkpoint_path"] = args.checkpoint
+    if args.resume:
+        resume = checkpoint.read_checkpoint(args.resume)
+        engine_kwargs["resume"] = resume
+        if arrivals is not None:
+            arrivals = itertools.islice(arrivals, resume.now, None)
+
+    profiled: contextlib.AbstractContextManager = contextlib.nullcontext()
+    if args.profile:
+        profiled = profiling.profile(args.profile, top=args.profile_top)
+
+    with profiled:
+        results = ENGINES[args.engine](
+            simulated_secs=args.simulated_secs,
+            max_queue_time_secs=args.max_queue_time,
+            mmr_method=args.mmr_method,
+            mmr_threshold=args.mmr_threshold,
+            seed=args.seed,
+            writer=writer,
+            retain=retain,
+            arrivals=arrivals,
+            **engine_kwargs,
+        )
+        # egress is part of the run, json output validates every lobby
+        writer.close()
+        metrics.get_metrics().flush()
 
-    with open("results.json", "w") as f:
-        json.dump(results, f, cls=PydanticEncoder, sort_keys=True, indent=2)
+        if args.output_format == "json":
+            with open(args.output, "w") as f:
+                json.dump(results, f, cls=PydanticEncoder, sort_keys=True, indent=2)
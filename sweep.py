@@ -0,0 +1,223 @@
+import argparse
+import itertools
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import mmr
+import simulation as simulation
+import workload as workload
+from schema import Map
+
+METRICS = [
+    "fill_rate",
+    "mean_wait_secs",
+    "p95_wait_secs",
+    "mean_mmr_spread",
+    "canceled_parties",
+]
+
+
+def config_grid(
+    mmr_thresholds: list[float],
+    mmr_methods: list[str],
+    max_queue_time_secs: list[int],
+) -> list[dict]:
+    "Every combination of the given simulator parameters"
+    return [
+        {
+            "mmr_threshold": mmr_threshold,
+            "mmr_method": mmr_method,
+            "max_queue_time_secs": max_queue_time,
+        }
+        for mmr_threshold, mmr_method, max_queue_time in itertools.product(
+            mmr_thresholds, mmr_methods, max_queue_time_secs
+        )
+    ]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    "Nearest-rank percentile, 0 for no values"
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return float(ordered[rank - 1])
+
+
+def summarize_results(results: dict, mmr_method="max_gs") -> dict:
+    """Reduces simulator results to a handful of metrics.
+
+    Fill rate, wait time and mmr spread are over started lobbies, wait time being
+    how long the lobby was filling.
+    """
+
+    mmr_fn = mmr.resolve(mmr_method).party_mmr
+    started = [lobby for lobbies in results["started"].values() for lobby in lobbies]
+
+    fill_rates = [lobby.current_player_count() / lobby.max_players for lobby in started]
+    waits = [lobby.queue_time for lobby in started]
+    spreads = []
+    for lobby in started:
+        mmrs = [mmr_fn(party) for party in lobby.parties]
+        spreads.append(max(mmrs) - min(mmrs))
+
+    return {
+        "started_lobbies": len(started),
+        "fill_rate": sum(fill_rates) / len(started) if started else 0.0,
+        "mean_wait_secs": sum(waits) / len(started) if started else 0.0,
+        "p95_wait_secs": percentile(waits, 95),
+        "mean_mmr_spread": sum(spreads) / len(started) if started else 0.0,
+        "canceled_parties": len(results["canceled_parties"]),
+    }
+
+
+def summarize_brackets(results: dict, mmr_method="max_gs") -> dict[str, dict]:
+    "`summarize_results` of every (map, party_size) bracket, keyed `map/party_size`"
+    brackets: dict[tuple[str, int], dict] = {}
+
+    def bracket(map_: Map, party_size: int) -> dict:
+        return brackets.setdefault(
+            (map_.value, party_size),
+            {"started": {party_size: []}, "canceled_parties": []},
+        )
+
+    for party_size, lobbies in results["started"].items():
+        for lobby in lobbies:
+            bracket(lobby.map, party_size)["started"][party_size].append(lobby)
+    for party in results["canceled_parties"]:
+        bracket(party.map, party.max_size)["canceled_parties"].append(party)
+
+    return {
+        f"{map_value}/{party_size}": summarize_results(bracket_results, mmr_method)
+        for (map_value, party_size), bracket_results in sorted(brackets.items())
+    }
+
+
+def run_config(
+    config: dict,
+    seed: int,
+    simulated_secs=600,
+    engine="event",
+    workload_path: str | None = None,
+) -> tuple[dict, int, dict]:
+    """Runs the simulator once for a configuration and seed, returning its metrics.
+
+    With a `workload_path` every run replays the same parties from that file."""
+
+    arrivals = workload.read_workload(workload_path) if workload_path else None
+    results = simulation.ENGINES[engine](
+        simulated_secs=simulated_secs, seed=seed, arrivals=arrivals, **config
+    )
+    return config, seed, summarize_results(results, mmr_method=config["mmr_method"])
+
+
+def sweep(
+    configs: list[dict],
+    seeds: list[int],
+    simulated_secs=600,
+    engine="event",
+    max_workers: int | None = None,
+    workload_path: str | None = None,
+) -> list[dict]:
+    """Runs every configuration with every seed across processes.
+
+    Each run is seeded so the same configs and seeds always give the same metrics.
+    Metrics are averaged over seeds per configuration, in the order of `configs`.
+    With a `workload_path` every run replays the same traffic from that file.
+    """
+
+    runs = [(config, seed) for config in configs for seed in seeds]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        summaries = list(
+            executor.map(
+                run_config,
+                [config for config, _ in runs],
+                [seed for _, seed in runs],
+                itertools.repeat(simulated_secs),
+                itertools.repeat(engine),
+                itertools.repeat(workload_path),
+            )
+        )
+
+    aggregated = []
+    for i, config in enumerate(configs):
+        config_runs = summaries[i * len(seeds) : (i + 1) * len(seeds)]  # noqa: E203
+        config_summaries = [summary for _, _, summary in config_runs]
+        metrics = {
+            metric: sum(s[metric] for s in config_summaries) / len(config_summaries)
+            for metric in METRICS
+        }
+        aggregated.append({**config, "seeds": list(seeds), **metrics})
+
+    return aggregated
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Runs the matchmaking simulator over a grid of parameters."
+    )
+
+    parser.add_argument(
+        "--mmr_threshold", type=float, nargs="+", default=[50], help="MMR thresholds."
+    )
+    parser.add_argument(
+        "--mmr_method",
+        type=str,
+        nargs="+",
+        default=["max_gs"],
+        choices=mmr.STRATEGIES.keys(),
+        help="MMR methods.",
+    )
+    parser.add_argument(
+        "--max_queue_time", type=int, nargs="+", default=[300], help="Max queue times."
+    )
+    parser.add_argument(
+        "--seeds", type=int, nargs="+", default=[0], help="Seeds to run every config."
+    )
+    parser.add_argument(
+        "--simulated_secs",
+        type=int,
+        default=600,
+        help="How long to simulate matchmaking system running per run.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="event",
+        choices=simulation.ENGINES.keys(),
+        help="Simulation engine for every run.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Processes, defaults to all cores."
+    )
+    parser.add_argument(
+        "--workload",
+        type=str,
+        default=None,
+        help="Workload file every run replays, instead of traffic from its seed.",
+    )
+    parser.add_argument(
+        "--output", type=str, default="sweep.json", help="File to write metrics to."
+    )
+
+    args = parser.parse_args()
+
+    configs = config_grid(args.mmr_threshold, args.mmr_method, args.max_queue_time)
+    start = time.perf_counter()
+    aggregated = sweep(
+        configs,
+        args.seeds,
+        simulated_secs=args.simulated_secs,
+        engine=args.engine,
+        max_workers=args.workers,
+        workload_path=args.workload,
+    )
+    print(
+        f"{len(configs) * len(args.seeds)} runs in {time.perf_counter() - start:.1f}s"
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(aggregated, f, indent=2)
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+import analytics
+import simulation
+import sweep
+import workload
+from schema import Map
+
+
+def test_quantile_sketch_is_within_relative_accuracy():
+    rng = random.Random(0)
+    values = [rng.lognormvariate(4, 1) for _ in range(10000)] + [0] * 100
+    sketch = analytics.QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    values.sort()
+    for q in (0.01, 0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.011)
+    assert sketch.quantile(0) == 0
+    assert sketch.quantile(1) == values[-1]
+    assert sketch.mean == pytest.approx(sum(values) / len(values))
+
+
+def test_merged_sketches_match_one_sketch():
+    rng = random.Random(1)
+    values = [rng.uniform(0, 300) for _ in range(1000)]
+    whole, first, second = (analytics.QuantileSketch() for _ in range(3))
+    for i, value in enumerate(values):
+        whole.add(value)
+        (first if i % 2 else second).add(value)
+
+    first.merge(analytics.QuantileSketch.from_dict(second.to_dict()))
+    assert first.buckets == whole.buckets
+    assert first.quantile(0.9) == whole.quantile(0.9)
+
+    with pytest.raises(ValueError):
+        first.merge(analytics.QuantileSketch(relative_accuracy=0.05))
+
+
+def _run(seed, writer=None):
+    configs = {m: workload.WorkloadConfig() for m in (Map.goblin_caves, Map.ice_cavern)}
+    return simulation.simulator(
+        simulated_secs=900,
+        max_queue_time_secs=120,
+        arrivals=workload.generate_map_workloads(configs, 900, seed=seed),
+        writer=writer,
+    )
+
+
+def test_run_analytics_matches_results():
+    run_analytics = analytics.RunAnalytics()
+    results = _run(0, writer=run_analytics)
+    report = run_analytics.summary.report()
+
+    for key, expected in sweep.summarize_brackets(results).items():
+        assert report[key]["started_lobbies"] == expected["started_lobbies"]
+        assert report[key]["canceled_parties"] == expected["canceled_parties"]
+        assert report[key]["fill_rate"] == pytest.approx(expected["fill_rate"])
+        assert report[key]["mean_wait_secs"] == pytest.approx(
+            expected["mean_wait_secs"]
+        )
+    assert report["all"]["filling_lobbies"] == sum(
+        map(len, results["filling"].values())
+    )
+
+    started = [lobby for lobbies in results["started"].values() for lobby in lobbies]
+    players = sum(lobby.current_player_count() for lobby in started)
+    canceled = sum(len(party) for party in results["canceled_parties"])
+    assert report["all"]["cancel_rate"] == pytest.approx(
+        canceled / (players + canceled)
+    )
+    assert report["all"]["p99_wait_secs"] <= 120
+
+
+def test_summaries_merge_across_runs(tmp_path):
+    paths = []
+    combined = analytics.RunAnalytics()
+    for seed in (0, 1):
+        paths.append(tmp_path / f"run{seed}.json")
+        with analytics.RunAnalytics(paths[-1]) as run_analytics:
+            _run(seed, writer=run_analytics)
+        _run(seed, writer=combined)
+
+    merged = analytics.merge_summaries(paths)
+
+    assert merged.runs == 2
+    expected = combined.summary.report()
+    for key, metrics in merged.report().items():
+        assert metrics == pytest.approx(expected[key])
+    assert paths[0].stat().st_size < 16 * 1024
@@ -0,0 +1,64 @@
+import benchmark
+
+
+def test_run_benchmarks_reports_every_bracket():
+    report = benchmark.run_benchmarks([60], memory=True, repeats=2, min_secs=0)
+
+    for bracket in ["solo", "duo", "trio"]:
+        placement = report[f"place_party/{bracket}_60"]
+        assert placement["parties_per_sec"] > 0
+        assert placement["p50_us"] <= placement["p99_us"]
+        assert placement["peak_mib"] > 0
+    assert report["simulator_event/60"]["parties_per_sec"] > 0
+    for mmr_method in ["max_gs", "level_gs", "p75_gs"]:
+        assert report[f"mmr_{mmr_method}/60"]["batch_parties_per_sec"] > 0
+
+
+def test_synthetic_queue_is_reproducible():
+    first = benchmark.synthetic_queue(50, 3, seed=4)
+    second = benchmark.synthetic_queue(50, 3, seed=4)
+    assert first == second
+    assert all(party.max_size == 3 for party in first)
+
+
+def test_compare_to_baseline():
+    baseline = {
+        "place_party/solo_10000": {"parties_per_sec": 1000, "p99_us": 10},
+        "simulator_event/10000": {"parties_per_sec": 1000},
+        "place_party/solo_1000": {"parties_per_sec": 1000},
+    }
+    report = {
+        "place_party/solo_10000": {"parties_per_sec": 600, "p99_us": 50},
+        "simulator_event/10000": {"parties_per_sec": 800},
+        "place_party/solo_100000": {"parties_per_sec": 1},
+        # too small to gate on
+        "place_party/solo_1000": {"parties_per_sec": 1},
+    }
+
+    regressions = benchmark.compare_to_baseline(report, baseline, tolerance=0.3)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("place_party/solo_10000 parties_per_sec")
+    assert len(benchmark.compare_to_baseline(report, baseline, gate_size=0)) == 2
+
+
+def test_measure_keeps_best_of_repeats():
+    results = iter(
+        [
+            {"parties_per_sec": 10, "p99_us": 5},
+            {"parties_per_sec": 30, "p99_us": 9},
+            {"parties_per_sec": 20, "p99_us": 2},
+        ]
+    )
+
+    best = benchmark.measure(lambda: next(results), memory=False, repeats=3, min_secs=0)
+
+    assert best == {"parties_per_sec": 30, "p99_us": 2}
+
+
+def test_compare_batch_reports_both_paths():
+    report = benchmark.compare_batch(simulated_secs=300, batch_secs=[5])
+
+    assert list(report) == ["greedy", "batch_5s"]
+    for result in report.values():
+        assert 0 < result["fill_rate"] <= 1
+        assert result["compute_secs"] > 0
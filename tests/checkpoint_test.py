@@ -0,0 +1,200 @@
+import asyncio
+import gc
+import itertools
+import threading
+
+import checkpoint
+import core
+import matchmaking
+import metrics
+import simulation
+import workload
+from schema import Map
+from service import MatchmakingService
+from tests.helpers import FakeClock, solo
+
+
+def _arrivals(simulated_secs):
+    config = workload.WorkloadConfig(
+        arrival_rate=2, map_weights={Map.goblin_caves: 1, Map.ice_cavern: 1}
+    )
+    return workload.generate_workload(config, simulated_secs, seed=3)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    parties = list(itertools.chain.from_iterable(_arrivals(200)))
+    lobbies = matchmaking.pack_lobbies(parties[:-5], list(range(len(parties) - 5)))
+    for lobby in lobbies:
+        lobby.queue_time = 7
+    snapshot = checkpoint.Checkpoint(
+        now=200, lobbies=lobbies, pending=parties[-5:], counters={"merges": 3}
+    )
+
+    path = tmp_path / "state.ckpt"
+    size = checkpoint.write_checkpoint(path, snapshot)
+    restored = checkpoint.read_checkpoint(path)
+
+    assert size == path.stat().st_size
+    assert restored == snapshot
+    for party in restored.pending + restored.lobbies[0].parties:
+        assert party.max_gear_score == max(p.gear_score for p in party.players)
+        assert party.total_gear_score == sum(p.gear_score for p in party.players)
+
+
+def test_restore_rebuilds_index_and_deadlines():
+    lobbies = [
+        matchmaking.create_lobby(core.Party.from_model(party.to_model()), created_at=t)
+        for t, party in enumerate(itertools.chain.from_iterable(_arrivals(60)))
+    ]
+    snapshot = checkpoint.Checkpoint(now=60, lobbies=lobbies)
+
+    hook = metrics.InMemoryMetrics()
+    previous = metrics.set_metrics(hook)
+    try:
+        snapshot.counters = {"lobbies_created": 4}
+        lobby_index, lobby_deadlines = checkpoint.restore_matchmaking(
+            snapshot, max_queue_time_secs=30
+        )
+    finally:
+        metrics.set_metrics(previous)
+
+    assert hook.counters == {"lobbies_created": 4}
+    expected = matchmaking.LobbyIndex(lobbies=[])
+    for lobby in lobbies:
+        expected.add(lobby)
+    assert lobby_index._entries == expected._entries
+    assert lobby_index._seqs == expected._seqs
+    assert list(lobby_deadlines.lobbies.values()) == lobbies
+    assert lobby_deadlines.pop_due(30) == [
+        lob for lob in lobbies if lob.created_at == 0
+    ]
+
+
+def test_simulator_resumes_where_it_stopped(tmp_path):
+    path = tmp_path / "state.ckpt"
+    full = simulation.simulator(
+        simulated_secs=600, max_queue_time_secs=120, arrivals=_arrivals(600)
+    )
+
+    arrivals = _arrivals(600)
+    first = simulation.simulator(
+        simulated_secs=300,
+        max_queue_time_secs=120,
+        arrivals=arrivals,
+        checkpoint_path=path,
+    )
+    second = simulation.simulator(
+        simulated_secs=600,
+        max_queue_time_secs=120,
+        arrivals=arrivals,
+        resume=checkpoint.read_checkpoint(path),
+    )
+
+    for party_size, started in full["started"].items():
+        assert started == first["started"][party_size] + second["started"][party_size]
+    assert full["filling"] == second["filling"]
+    assert (
+        full["canceled_parties"]
+        == first["canceled_parties"] + second["canceled_parties"]
+    )
+
+
+def test_service_restarts_from_checkpoint(tmp_path):
+    path = tmp_path / "service.ckpt"
+    clock = FakeClock()
+    started = []
+
+    async def before_restart():
+        service = MatchmakingService(max_queue_time_secs=60, clock=clock)
+        service.try_enqueue(solo(100))
+        clock.time = 10
+        await service.tick()
+        service.try_enqueue(solo(400))
+        clock.time = 20
+        await service.checkpoint(path)
+        return service
+
+    async def after_restart():
+        service = MatchmakingService(
+            max_queue_time_secs=60,
+            on_lobby_started=started.append,
+            clock=clock,
+        )
+        service.restore(path)
+        assert service.now() == 20
+        assert service.pending.qsize() == 1
+        await service.tick()
+        assert [len(lobbies) for lobbies in service.filling_lobbies.values()] == [
+            2,
+            0,
+            0,
+        ]
+
+        clock.time += 49
+        await service.tick()
+        assert started == []
+        clock.time += 1
+        await service.tick()
+        return service
+
+    asyncio.run(before_restart())
+    clock.time = 1000
+    service = asyncio.run(after_restart())
+
+    assert [lobby.parties[0].max_gear_score for lobby in started] == [100]
+    assert started[0].queue_time == 60
+    assert len(service.lobby_deadlines) == 1
+
+
+def test_service_ticks_while_checkpoint_is_written(tmp_path, monkeypatch):
+    path = tmp_path / "service.ckpt"
+    clock = FakeClock()
+    written = threading.Event()
+    write_checkpoint_bytes = checkpoint.write_checkpoint_bytes
+
+    def slow_write(path, data):
+        written.wait(timeout=5)
+        return write_checkpoint_bytes(path, data)
+
+    monkeypatch.setattr(checkpoint, "write_checkpoint_bytes", slow_write)
+
+    async def run():
+        service = MatchmakingService(max_queue_time_secs=60, clock=clock)
+        service.try_enqueue(solo(100))
+        first = asyncio.create_task(service.checkpoint(path))
+        await asyncio.sleep(0.05)
+        await asyncio.wait_for(service.tick(), timeout=1)
+        # taken while the first one is still being written
+        second = asyncio.create_task(service.checkpoint(path))
+        await asyncio.sleep(0.05)
+        service.try_enqueue(solo(400))
+        await asyncio.wait_for(service.tick(), timeout=1)
+        assert not first.done() and not second.done()
+        written.set()
+        await asyncio.gather(first, second)
+        return service
+
+    service = asyncio.run(run())
+
+    assert len(service.lobby_deadlines) == 2
+    # the second checkpoint was written last
+    restored = checkpoint.read_checkpoint(path)
+    assert [lobby.parties[0].max_gear_score for lobby in restored.lobbies] == [100]
+    assert restored.pending == []
+
+
+def test_restoring_only_freezes_gc_when_asked(tmp_path):
+    path = tmp_path / "service.ckpt"
+    lobby = matchmaking.create_lobby(solo(100))
+    checkpoint.write_checkpoint(path, checkpoint.Checkpoint(now=5, lobbies=[lobby]))
+    frozen = gc.get_freeze_count()
+
+    checkpoint.restore_matchmaking(checkpoint.read_checkpoint(path))
+    MatchmakingService().restore(path)
+    assert gc.get_freeze_count() == frozen
+
+    try:
+        MatchmakingService().restore(path, freeze_gc=True)
+        assert gc.get_freeze_count() > frozen
+    finally:
+        gc.unfreeze()
@@ -0,0 +1,78 @@
+import copy
+import random
+
+import core
+import matchmaking
+import simulation
+from schema import Lobby, LobbyStatus, Map, Party, Player
+
+
+def test_round_trip_conversion():
+    lobby = Lobby(
+        parties=[
+            Party(
+                players=[
+                    Player(job="fighter", level=10, gear_score=100),
+                    Player(job="wizard", level=20, gear_score=150),
+                ],
+                map="goblin_caves",
+                max_size=2,
+            )
+        ],
+        map="goblin_caves",
+        queue_time=12,
+        status=LobbyStatus.started,
+        party_size=2,
+    )
+
+    core_lobby = core.Lobby.from_model(lobby)
+    assert core_lobby.max_players == lobby.max_players
+    assert core_lobby.current_player_count() == lobby.current_player_count()
+    assert core_lobby.to_model() == lobby
+    assert core_lobby.to_model().model_dump() == lobby.model_dump()
+
+
+def test_party_aggregates_match_schema():
+    party = Party(
+        players=[
+            Player(job="fighter", level=10, gear_score=100),
+            Player(job="wizard", level=20, gear_score=150),
+        ],
+        map="goblin_caves",
+        max_size=3,
+    )
+    core_party = core.Party.from_model(party)
+
+    for mmr_fn in matchmaking.MMR_FUNCTIONS.values():
+        assert mmr_fn(core_party) == mmr_fn(party)
+
+    new_player = Player(job="rogue", level=30, gear_score=200)
+    party.add_players([new_player])
+    core_party.add_players([core.Player.from_model(new_player)])
+    for mmr_fn in matchmaking.MMR_FUNCTIONS.values():
+        assert mmr_fn(core_party) == mmr_fn(party)
+
+
+def test_matchmaking_matches_schema_models():
+    random.seed(3)
+    parties = [simulation.generate_party(map=Map.goblin_caves) for _ in range(300)]
+
+    def place(parties):
+        filling = {1: [], 2: [], 3: []}
+        for party in parties:
+            matchmaking.put_party_in_lobby(
+                filling[party.max_size], party, mmr_method="avg_gs", mmr_threshold=40
+            )
+        for lobbies in filling.values():
+            for lobby in lobbies:
+                lobby.queue_time = 300
+                matchmaking.maybe_start_lobby(lobby, max_queue_time_secs=120)
+        return filling
+
+    core_lobbies = place(copy.deepcopy(parties))
+    schema_lobbies = place([p.to_model() for p in parties])
+
+    for party_size in core_lobbies:
+        assert [lob.to_model().model_dump() for lob in core_lobbies[party_size]] == [
+            lob.model_dump() for lob in schema_lobbies[party_size]
+        ]
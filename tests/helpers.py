@@ -0,0 +1,18 @@
+import core
+from schema import Map
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def solo(gear_score: int) -> core.Party:
+    return core.Party(
+        players=[core.Player(job="fighter", level=10, gear_score=gear_score)],
+        map=Map.goblin_caves,
+        max_size=1,
+    )
@@ -2,7 +2,21 @@ import pytest
 from pydantic import ValidationError
 
 import matchmaking
-from schema import Lobby, Party, Player
+from schema import Lobby, LobbyStatus, Party, Player
+
+
+def _party(size, max_size=3, gear_score=100, map="goblin_caves"):
+    return Party(
+        players=[
+            Player(job="fighter", level=10, gear_score=gear_score) for _ in range(size)
+        ],
+        map=map,
+        max_size=max_size,
+    )
+
+
+def _solo(gear_score, map="goblin_caves", max_size=1):
+    return _party(1, max_size=max_size, gear_score=gear_score, map=map)
 
 
 def test_max_gearscore_mmr():
@@ -145,3 +159,459 @@ def test_fail_attempt_add_party_to_lobby():
 
     was_matched, _ = matchmaking.attempt_merge_party(lobby_a, party_c)
     assert not was_matched
+
+
+def test_lobby_index_oldest():
+    low = Lobby(parties=[_solo(100), _solo(120)], map="goblin_caves", party_size=1)
+    high = Lobby(parties=[_solo(300)], map="goblin_caves", party_size=1)
+    other_map = Lobby(
+        parties=[_solo(110, "ice_cavern")], map="ice_cavern", party_size=1
+    )
+    index = matchmaking.LobbyIndex(lobbies=[low, high, other_map])
+
+    assert index.oldest(_solo(140), mmr_threshold=50) is low
+    assert index.oldest(_solo(160), mmr_threshold=50) is None
+    assert index.oldest(_solo(110, "ice_cavern"), mmr_threshold=50) is other_map
+
+    high.status = LobbyStatus.started
+    assert index.oldest(_solo(290), mmr_threshold=50) is None
+    assert high not in index
+
+
+def test_lobby_index_oldest_stops_at_first_accepted():
+    lobbies = [
+        Lobby(parties=[_solo(gear_score)], map="goblin_caves", party_size=1)
+        for gear_score in (130, 80, 120, 110, 100)
+    ]
+    index = matchmaking.LobbyIndex(lobbies=lobbies)
+
+    tried = []
+
+    def accept(lobby):
+        tried.append(lobby)
+        return lobby is not lobbies[2]
+
+    # 80 is out of reach of 140, the rest are offered oldest first
+    assert index.oldest(_solo(140), accept=accept) is lobbies[0]
+    assert tried == [lobbies[0]]
+
+    tried.clear()
+    index.remove(lobbies[0])
+    assert index.oldest(_solo(140), accept=accept) is lobbies[3]
+    assert tried == [lobbies[2], lobbies[3]]
+
+    # lobbies passed over are found again by the next search
+    assert index.oldest(_solo(140)) is lobbies[2]
+    assert len(index) == 4
+
+
+def test_place_party_rejects_other_mmr_method_than_index():
+    party = Party(
+        players=[Player(job="fighter", level=10, gear_score=100)],
+        map="goblin_caves",
+        max_size=1,
+    )
+    index = matchmaking.LobbyIndex(mmr_method="avg_gs")
+
+    with pytest.raises(ValueError):
+        matchmaking.place_party([], party, lobby_index=index, mmr_method="max_gs")
+    assert len(index) == 0
+
+    lobby = matchmaking.place_party([], party, lobby_index=index)
+    assert lobby in index
+
+
+def test_put_party_in_lobby_with_index_updates_bounds():
+    filling: list[Lobby] = []
+    index = matchmaking.LobbyIndex()
+    for gear_score in [100, 140, 180, 60]:
+        matchmaking.put_party_in_lobby(
+            filling, _solo(gear_score), lobby_index=index, mmr_threshold=50
+        )
+
+    assert [[p.players[0].gear_score for p in lob.parties] for lob in filling] == [
+        [100, 140],
+        [180],
+        [60],
+    ]
+    assert len(index) == 3
+
+
+def test_party_gear_score_aggregates():
+    party = Party(
+        players=[Player(job="fighter", level=10, gear_score=100)],
+        map="goblin_caves",
+        max_size=3,
+    )
+    party.add_players([Player(job="wizard", level=20, gear_score=150)])
+    assert party.max_gear_score == 150
+    assert matchmaking.average_gearscore_mmr(party) == 125
+
+    party.players = [Player(job="rogue", level=30, gear_score=90)]
+    assert party.max_gear_score == 90
+    assert party.total_gear_score == 90
+
+
+def test_lobby_mmr_range_follows_merges():
+    duo = Party(
+        players=[Player(job="fighter", level=10, gear_score=100)],
+        map="goblin_caves",
+        max_size=2,
+    )
+    lobby = Lobby(parties=[duo], map="goblin_caves", party_size=2)
+    assert matchmaking.lobby_mmr_range(lobby) == (100, 100)
+
+    teammate = Party(
+        players=[Player(job="cleric", level=10, gear_score=140)],
+        map="goblin_caves",
+        max_size=2,
+    )
+    was_added, _ = matchmaking.attempt_add_party_to_lobby(lobby, teammate)
+    assert was_added
+    assert matchmaking.lobby_mmr_range(lobby) == (140, 140)
+    assert matchmaking.lobby_mmr_range(lobby, "avg_gs") == (120, 120)
+
+
+def test_merge_prefers_party_it_fills_up_most():
+    first_solo = _solo(100, max_size=3)
+    duo = Party(
+        players=[
+            Player(job="fighter", level=10, gear_score=110),
+            Player(job="cleric", level=10, gear_score=120),
+        ],
+        map="goblin_caves",
+        max_size=3,
+    )
+    lobby = Lobby(parties=[first_solo, duo], map="goblin_caves", party_size=3)
+
+    was_merged, _ = matchmaking.attempt_merge_party(lobby, _solo(130, max_size=3))
+    assert was_merged
+    assert len(duo) == 3
+    assert len(first_solo) == 1
+
+    was_merged, _ = matchmaking.attempt_merge_party(lobby, _solo(140, max_size=3))
+    assert was_merged
+    assert len(first_solo) == 2
+    assert matchmaking.open_parties(lobby)[1] == [first_solo]
+    assert not matchmaking.open_parties(lobby)[2]
+
+    duo_party = Party(
+        players=[
+            Player(job="bard", level=10, gear_score=150),
+            Player(job="wizard", level=10, gear_score=160),
+        ],
+        map="goblin_caves",
+        max_size=3,
+    )
+    was_merged, _ = matchmaking.attempt_merge_party(lobby, duo_party)
+    assert not was_merged
+
+
+def test_merge_keeps_lobby_within_threshold_of_merged_party_mmr():
+    def duo(low, high):
+        return Party(
+            players=[
+                Player(job="fighter", level=10, gear_score=low),
+                Player(job="cleric", level=10, gear_score=high),
+            ],
+            map="goblin_caves",
+            max_size=3,
+        )
+
+    wide, narrow = duo(100, 200), duo(170, 180)
+    lobby = Lobby(parties=[wide, narrow], map="goblin_caves", party_size=3)
+    # p75 of wide is 175, merged with the solo it would be 190
+    assert matchmaking.can_add_party_to_lobby(
+        lobby, _party(1, gear_score=180), mmr_method="p75_gs", mmr_threshold=10
+    )
+
+    was_merged, _ = matchmaking.attempt_add_party_to_lobby(
+        lobby, _party(1, gear_score=180), mmr_method="p75_gs", mmr_threshold=10
+    )
+    assert was_merged
+    assert len(wide) == 2
+    assert len(narrow) == 3
+
+    was_merged, _ = matchmaking.attempt_add_party_to_lobby(
+        lobby, _party(1, gear_score=180), mmr_method="p75_gs", mmr_threshold=10
+    )
+    assert not was_merged
+    assert len(wide) == 2
+
+
+def test_lobbies_compare_equal_whatever_matchmaking_cached():
+    def lobby():
+        return Lobby(parties=[_party(1), _party(2)], map="goblin_caves", party_size=3)
+
+    cached, fresh = lobby(), lobby()
+    assert matchmaking.can_add_party_to_lobby(cached, _party(1))
+    matchmaking.attempt_merge_party(cached, _party(1, gear_score=90))
+    fresh.parties[1].add_players(_party(1, gear_score=90).players)
+
+    assert cached == fresh
+    assert cached != lobby()
+
+
+def test_maybe_start_lobby_drops_every_partial_party():
+    full = _party(3)
+    partials = [_party(1), _party(2), _party(1)]
+    lobby = Lobby(
+        parties=[partials[0], partials[1], full, partials[2]],
+        map="goblin_caves",
+        party_size=3,
+        queue_time=120,
+    )
+
+    _, dropped = matchmaking.maybe_start_lobby(lobby, max_queue_time_secs=120)
+
+    assert lobby.status == LobbyStatus.started
+    assert lobby.parties == [full]
+    assert dropped == partials
+
+
+def test_partition_lobbies():
+    full_lobby = Lobby(
+        parties=[_party(1, max_size=1) for _ in range(10)],
+        map="goblin_caves",
+        party_size=1,
+    )
+    waiting_lobby = Lobby(
+        parties=[_party(1, max_size=1)], map="goblin_caves", party_size=1
+    )
+    partial = _party(1, max_size=2)
+    expired_lobby = Lobby(
+        parties=[partial], map="goblin_caves", party_size=2, queue_time=300
+    )
+
+    filling, started, canceled, dropped = matchmaking.partition_lobbies(
+        [full_lobby, waiting_lobby, expired_lobby], max_queue_time_secs=300
+    )
+
+    assert filling == [waiting_lobby]
+    assert started == [full_lobby]
+    assert canceled == [expired_lobby]
+    assert dropped == [partial]
+    assert expired_lobby.parties == []
+
+
+def test_lobby_deadlines_pop_full_and_expired_lobbies():
+    deadlines = matchmaking.LobbyDeadlines(max_queue_time_secs=30)
+    filling_lobbies = []
+    old_lobby = matchmaking.place_party(
+        filling_lobbies, _party(1, max_size=1), created_at=0, lobby_deadlines=deadlines
+    )
+    new_lobby = matchmaking.place_party(
+        filling_lobbies,
+        _party(1, max_size=1, gear_score=300),
+        created_at=10,
+        lobby_deadlines=deadlines,
+    )
+    assert deadlines.pop_due(20) == []
+
+    for _ in range(9):
+        matchmaking.place_party(
+            filling_lobbies,
+            _party(1, max_size=1, gear_score=300),
+            created_at=20,
+            lobby_deadlines=deadlines,
+        )
+    due = deadlines.pop_due(20)
+    assert due == [new_lobby]
+    started, _, _ = deadlines.check(due, 20)
+    assert started == [new_lobby]
+    assert new_lobby.queue_time == 10
+
+    assert deadlines.pop_due(29) == []
+    due = deadlines.pop_due(30)
+    assert due == [old_lobby]
+    started, _, _ = deadlines.check(due, 30)
+    assert started == [old_lobby]
+    assert len(deadlines) == 0
+    assert deadlines.pop_due(40) == []
+
+
+def test_threshold_schedule():
+    schedule = matchmaking.ThresholdSchedule.parse(50, ["120:100", "60:75"])
+
+    assert schedule.steps == ((60, 75), (120, 100))
+    assert schedule.threshold(0) == 50
+    assert schedule.threshold(59) == 50
+    assert schedule.threshold(60) == 75
+    assert schedule.threshold(300) == 100
+    assert schedule.max_threshold == 100
+
+
+def test_place_party_widens_with_lobby_queue_time():
+    schedule = matchmaking.ThresholdSchedule(50, ((60, 100),))
+    lobbies = []
+    old_lobby = matchmaking.place_party(lobbies, _party(1, max_size=1), created_at=0)
+
+    far_party = _party(1, max_size=1, gear_score=180)
+    lobby = matchmaking.place_party(
+        lobbies, far_party, created_at=30, mmr_schedule=schedule
+    )
+    assert lobby is not old_lobby
+
+    lobby = matchmaking.place_party(
+        lobbies,
+        _party(1, max_size=1, gear_score=190),
+        created_at=60,
+        mmr_schedule=schedule,
+    )
+    assert lobby is old_lobby
+
+
+def test_merge_widened_lobbies():
+    schedule = matchmaking.ThresholdSchedule(10, ((60, 100),))
+    deadlines = matchmaking.LobbyDeadlines(300, schedule)
+    lobby_index = matchmaking.LobbyIndex()
+    lobbies = []
+    for created_at, gear_score in [(0, 100), (5, 150), (10, 400)]:
+        matchmaking.place_party(
+            lobbies,
+            _party(2, gear_score=gear_score),
+            lobby_index=lobby_index,
+            created_at=created_at,
+            lobby_deadlines=deadlines,
+            mmr_schedule=schedule,
+        )
+    duo, far_duo, out_of_reach = lobbies
+    assert deadlines.pop_due(59) == []
+
+    widened = deadlines.pop_due(60)
+    assert widened == [duo]
+    matchmaking.merge_widened_lobbies(widened, lobby_index, schedule, 60, deadlines)
+
+    assert [len(party) for party in duo.parties] == [2, 2]
+    assert far_duo.parties == []
+    assert far_duo not in lobby_index
+    assert far_duo not in deadlines
+    assert out_of_reach.parties and out_of_reach in deadlines
+    assert matchmaking.lobby_mmr_range(duo) == (100, 150)
+
+
+def test_pack_lobbies_sweeps_mmr_windows():
+    parties = [
+        *(_party(3, gear_score=gs) for gs in [140, 100, 120, 110]),
+        _party(1, gear_score=130),
+        _party(2, gear_score=135),
+        _party(3, gear_score=300),
+        _party(1, max_size=1, gear_score=105),
+    ]
+    queued_at = [5, 0, 2, 3, 4, 6, 1, 7]
+
+    lobbies = matchmaking.pack_lobbies(parties, queued_at, mmr_threshold=50)
+    solo, trios, far_trio = lobbies
+
+    assert [p.max_gear_score for p in trios.parties] == [100, 110, 120, 135, 140]
+    assert matchmaking.is_lobby_full(trios)
+    assert trios.created_at == 0
+    assert [p.max_gear_score for p in far_trio.parties] == [300]
+    assert far_trio.created_at == 1
+    assert (solo.party_size, solo.created_at) == (1, 7)
+
+
+def test_pack_lobbies_fills_lobbies():
+    parties = [_party(3, gear_score=100 + i) for i in range(9)]
+    parties += [_party(1, gear_score=110), _party(2, gear_score=110)]
+
+    full, rest = matchmaking.pack_lobbies(parties, mmr_threshold=50)
+
+    assert [p.max_gear_score for p in full.parties] == [100, 101, 102, 103, 104]
+    # the solo and duo merged into one trio
+    assert [len(p) for p in rest.parties] == [3, 3, 3, 3, 3]
+    assert matchmaking.is_lobby_full(full) and matchmaking.is_lobby_full(rest)
+
+
+def test_party_pool_assembles_full_parties():
+    pool = matchmaking.PartyPool()
+    solo, far_solo, trio = (
+        _party(1, gear_score=100),
+        _party(1, gear_score=300),
+        _party(3),
+    )
+
+    assert pool.assemble([solo, trio, far_solo], queued_at=0) == [trio]
+    assert len(pool) == 2
+
+    # joins the solo in reach, the duo they make waits for one more
+    assert pool.assemble([_party(1, gear_score=120)], queued_at=5) == []
+    assert len(solo) == 2
+    assert len(pool) == 2
+
+    assert pool.assemble([_party(2, gear_score=280)], queued_at=10) == [far_solo]
+    assert len(far_solo) == 3
+    assert list(pool.parties.values()) == [solo]
+
+
+def test_party_pool_prefers_party_it_fills_up():
+    pool = matchmaking.PartyPool()
+    waiting_solo, waiting_duo = _party(1, gear_score=100), _party(2, gear_score=200)
+    pool.add(waiting_solo)
+    pool.add(waiting_duo)
+
+    assert pool.add(_party(1, gear_score=150)) is waiting_duo
+    assert list(pool.parties.values()) == [waiting_solo]
+
+
+def test_party_pool_joins_longest_pooled_party_within_threshold():
+    pool = matchmaking.PartyPool()
+    too_far, in_reach, newer = (
+        _party(2, gear_score=151),
+        _party(2, gear_score=150),
+        _party(2, gear_score=60),
+    )
+    for party in (too_far, in_reach, newer):
+        pool.add(party)
+
+    assert pool.add(_party(1, gear_score=100), mmr_threshold=50) is in_reach
+    assert list(pool.parties.values()) == [too_far, newer]
+
+
+def test_party_pool_expires_waiting_parties():
+    pool = matchmaking.PartyPool(max_queue_time_secs=60)
+    first, second = _party(1, gear_score=100), _party(1, gear_score=500)
+    pool.add(first, queued_at=0)
+    pool.add(second, queued_at=30)
+    pool.add(_party(1, gear_score=110), queued_at=40)
+
+    assert pool.pop_expired(59) == []
+    assert pool.pop_expired(60) == [first]
+    assert len(first) == 2
+    assert pool.pop_expired(90) == [second]
+    assert len(pool) == 0
+    # expired parties can't be joined anymore
+    assert pool.add(_party(2, gear_score=500), queued_at=100) is None
+
+
+def test_place_party_keeps_maps_apart():
+    goblin_party, ice_party = _party(1, max_size=1), _party(1, max_size=1)
+    ice_party.map = "ice_cavern"
+    filling_lobbies = matchmaking.put_party_in_lobby([], goblin_party)
+
+    lobby = matchmaking.place_party(filling_lobbies, ice_party)
+
+    assert lobby.map == "ice_cavern"
+    assert [lobby.parties for lobby in filling_lobbies] == [
+        [goblin_party],
+        [ice_party],
+    ]
+
+
+def test_put_parties_in_lobbies_keeps_maps_apart():
+    goblin_lobby = matchmaking.create_lobby(_party(3))
+    all_filling_lobbies = {1: [], 2: [], 3: [goblin_lobby]}
+    ice_party, goblin_party = _party(3), _party(3)
+    ice_party.map = "ice_cavern"
+
+    matchmaking.put_parties_in_lobbies(
+        all_filling_lobbies, [ice_party, goblin_party, _party(3)]
+    )
+
+    ice_lobby = all_filling_lobbies[3][1]
+    assert [lobby.map for lobby in all_filling_lobbies[3]] == [
+        "goblin_caves",
+        "ice_cavern",
+    ]
+    assert ice_lobby.parties == [ice_party]
+    assert len(goblin_lobby.parties) == 3
@@ -0,0 +1,51 @@
+import pytest
+
+import metrics
+import simulation
+
+
+@pytest.fixture
+def in_memory_metrics():
+    hook = metrics.InMemoryMetrics()
+    previous = metrics.set_metrics(hook)
+    yield hook
+    metrics.set_metrics(previous)
+
+
+@pytest.mark.parametrize("engine", ["tick", "event"])
+def test_simulator_counters(in_memory_metrics, engine):
+    results = simulation.ENGINES[engine](
+        simulated_secs=600, max_queue_time_secs=120, seed=8
+    )
+    counters = in_memory_metrics.counters
+
+    num_started = sum(map(len, results["started"].values()))
+    assert counters["lobbies_started"] == num_started
+    assert counters["parties_dropped"] == len(results["canceled_parties"])
+    assert counters["parties_placed"] > 0
+    assert counters["mmr_checks"] >= counters["placement_attempts"] > 0
+    assert counters["lobbies_created"] >= num_started + counters["lobbies_canceled"]
+
+    timers = in_memory_metrics.snapshot()["timers"]
+    assert timers["process_queued_parties"]["calls"] > 0
+    assert timers["update_lobbies"]["total_secs"] > 0
+
+
+def test_prometheus_file(tmp_path):
+    path = tmp_path / "metrics.prom"
+    hook = metrics.PrometheusFileMetrics(path, interval_secs=0)
+    hook.incr("merges", 3)
+    with hook.timer("update_lobbies"):
+        pass
+
+    lines = path.read_text().splitlines()
+    assert "matchmaking_merges_total 3" in lines
+    assert 'matchmaking_phase_calls_total{phase="update_lobbies"} 1' in lines
+
+
+def test_default_hook_ignores_metrics():
+    hook = metrics.Metrics()
+    hook.incr("merges")
+    with hook.timer("update_lobbies"):
+        pass
+    hook.flush()
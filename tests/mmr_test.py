@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+import core
+import matchmaking
+import mmr
+import workload
+from schema import Job, Lobby, Party, Player
+
+
+def _party(*players, max_size=3):
+    return Party(
+        players=[
+            Player(job=job, level=level, gear_score=gear_score)
+            for job, level, gear_score in players
+        ],
+        map="goblin_caves",
+        max_size=max_size,
+    )
+
+
+def test_resolve():
+    assert mmr.resolve("max_gs").party_mmr is mmr.max_gearscore_mmr
+    strategy = mmr.resolve("avg_gs")
+    assert mmr.resolve(strategy) is strategy
+    with pytest.raises(NotImplementedError):
+        mmr.resolve("elo")
+
+
+def test_strategies():
+    party = _party(("fighter", 10, 100), ("cleric", 30, 200))
+
+    assert mmr.STRATEGIES["max_gs"].party_mmr(party) == 200
+    assert mmr.STRATEGIES["avg_gs"].party_mmr(party) == 150
+    assert mmr.STRATEGIES["level_gs"].party_mmr(party) == 175
+    assert mmr.STRATEGIES["job_gs"].party_mmr(party) == 150
+    assert mmr.STRATEGIES["p75_gs"].party_mmr(party) == 175
+
+    weighted = mmr.job_weighted({Job.cleric: 0.5})
+    assert weighted.party_mmr(party) == 100
+    assert mmr.percentile_gs(50).name == "p50_gs"
+
+
+@pytest.mark.parametrize("mmr_method", mmr.STRATEGIES)
+def test_batch_matches_scalar(mmr_method):
+    strategy = mmr.STRATEGIES[mmr_method]
+    parties = workload.generate_batch(random.Random(0), workload.WorkloadConfig(), 500)
+
+    expected = [strategy.party_mmr(party) for party in parties]
+    assert strategy.party_mmrs(parties) == pytest.approx(expected)
+    models = [party.to_model() for party in parties]
+    assert [strategy.party_mmr(party) for party in models] == pytest.approx(expected)
+
+
+def test_registered_strategy_drives_matchmaking():
+    strategy = mmr.register(mmr.percentile_gs(0, name="min_gs"))
+    try:
+        lobby = Lobby(
+            parties=[_party(("fighter", 10, 100), ("rogue", 10, 300))],
+            map="goblin_caves",
+            party_size=3,
+        )
+        party = _party(("wizard", 10, 140), ("bard", 10, 400))
+
+        assert matchmaking.is_possible_lobby(lobby, party, mmr_method="min_gs")
+        assert not matchmaking.is_possible_lobby(lobby, party, mmr_method="max_gs")
+        assert matchmaking.lobby_mmr_range(lobby, strategy) == (100, 100)
+
+        core_lobby = core.Lobby.from_model(lobby)
+        index = matchmaking.LobbyIndex(mmr_method="min_gs", lobbies=[core_lobby])
+        # the lobby's duo only has room for a solo
+        solo = core.Party.from_model(_party(("wizard", 10, 140)))
+        assert index.oldest(solo) is core_lobby
+        assert index.oldest(core.Party.from_model(party)) is None
+    finally:
+        del mmr.STRATEGIES["min_gs"]
+        del mmr.MMR_FUNCTIONS["min_gs"]
+
+
+def test_strategies_sharing_a_name_keep_their_own_ranges():
+    # same default name as the registered job_gs, weighting fighters double
+    doubled = mmr.job_weighted({Job.fighter: 2.0})
+    assert doubled.name == "job_gs"
+
+    lobby = Lobby(
+        parties=[_party(("fighter", 10, 100), max_size=1)],
+        map="goblin_caves",
+        party_size=1,
+    )
+    assert matchmaking.lobby_mmr_range(lobby, "job_gs") == (100, 100)
+    assert matchmaking.lobby_mmr_range(lobby, doubled) == (200, 200)
+
+    was_added, _ = matchmaking.attempt_add_party_to_lobby(
+        lobby, _party(("fighter", 10, 110), max_size=1), mmr_method="job_gs"
+    )
+    assert was_added
+    assert matchmaking.lobby_mmr_range(lobby, "job_gs") == (100, 110)
+    assert matchmaking.lobby_mmr_range(lobby, doubled) == (200, 220)
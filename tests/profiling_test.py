@@ -0,0 +1,93 @@
+import io
+import os
+import pstats
+import subprocess
+import sys
+
+import profiling
+import simulation
+from schema import Map, Party, Player
+
+
+def test_profile_writes_stats_and_collapsed_stacks(tmp_path):
+    summary = io.StringIO()
+    with profiling.profile(str(tmp_path / "run"), top=5, stream=summary):
+        simulation.simulator(simulated_secs=120, seed=0)
+        Party(
+            players=[Player(job="rogue", level=10, gear_score=100)],
+            map=Map.goblin_caves,
+            max_size=1,
+        )
+
+    stats = pstats.Stats(str(tmp_path / "run.prof"))
+    times = profiling.category_times(stats)
+    assert times["matchmaking"] > 0
+    assert times["random"] > 0
+    assert times["pydantic"] > 0
+
+    lines = (tmp_path / "run.collapsed").read_text().splitlines()
+    stacks = dict(line.rsplit(" ", 1) for line in lines)
+    assert any(
+        stack.startswith("simulation.py:simulator:") and "place_party" in stack
+        for stack in stacks
+    )
+    assert all(int(micros) > 0 for micros in stacks.values())
+
+    text = summary.getvalue()
+    assert "matchmaking" in text and "pydantic" in text
+    assert len(text.split("function\n")[1].splitlines()) == 5
+
+
+def test_generators_count_as_random_generation():
+    for fn in [simulation.generate_player, simulation.generate_party]:
+        code = fn.__code__
+        func = (code.co_filename, code.co_firstlineno, code.co_name)
+        assert profiling.category(func) == "random"
+
+
+def test_cli_profile_covers_json_egress(tmp_path):
+    subprocess.run(
+        [
+            sys.executable,
+            "simulation.py",
+            "--simulated_secs=60",
+            "--seed=1",
+            "--output_format=json",
+            f"--output={tmp_path / 'results.json'}",
+            f"--profile={tmp_path / 'run'}",
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+        capture_output=True,
+    )
+
+    stats = pstats.Stats(str(tmp_path / "run.prof"))
+    names = {name for _, _, name in profiling._entries(stats)}
+    assert {"default", "to_model"} <= names
+
+
+def test_collapsed_stacks_split_time_between_callers():
+    def leaf():
+        return sum(range(20000))
+
+    def a():
+        return leaf()
+
+    def b():
+        return leaf() + leaf() + leaf()
+
+    def root():
+        return a() + b()
+
+    with profiling.profile(stream=io.StringIO()) as profiler:
+        root()
+
+    stats = pstats.Stats(profiler)
+    stacks = profiling.collapsed_stacks(stats)
+    via_a = sum(
+        us for stack, us in stacks.items() if ":a:" in stack and ":leaf:" in stack
+    )
+    via_b = sum(
+        us for stack, us in stacks.items() if ":b:" in stack and ":leaf:" in stack
+    )
+    assert via_b > via_a > 0
@@ -0,0 +1,136 @@
+import asyncio
+
+import core
+from schema import LobbyStatus, Map
+from service import LocalClient, MatchmakingService
+from tests.helpers import FakeClock, solo
+
+
+def test_tick_starts_full_lobbies():
+    started = []
+
+    async def on_lobby_started(lobby):
+        started.append(lobby)
+
+    async def main():
+        service = MatchmakingService(on_lobby_started=on_lobby_started)
+        for i in range(12):
+            await service.enqueue(solo(100 + i))
+        await service.tick()
+        return service
+
+    service = asyncio.run(main())
+
+    assert len(started) == 1
+    assert started[0].status == LobbyStatus.started
+    assert started[0].current_player_count() == 10
+    assert [len(lobbies) for lobbies in service.filling_lobbies.values()] == [1, 0, 0]
+
+
+def test_tick_times_out_lobbies():
+    clock = FakeClock()
+    started = []
+    canceled = []
+
+    async def main():
+        service = MatchmakingService(
+            max_queue_time_secs=60,
+            on_lobby_started=started.append,
+            on_party_canceled=canceled.append,
+            clock=clock,
+        )
+        service.try_enqueue(solo(100))
+        partial = core.Party(
+            players=[core.Player(job="cleric", level=10, gear_score=300)],
+            map=Map.goblin_caves,
+            max_size=2,
+        )
+        service.try_enqueue(partial)
+        await service.tick()
+
+        clock.time = 59
+        await service.tick()
+        assert not started and not canceled
+
+        clock.time = 60
+        await service.tick()
+        return partial
+
+    partial = asyncio.run(main())
+
+    assert len(started) == 1
+    assert started[0].queue_time == 60
+    assert canceled == [partial]
+
+
+def test_failing_callback_does_not_stop_ticks(caplog):
+    clock = FakeClock()
+    started = []
+
+    async def on_lobby_started(lobby):
+        if not started:
+            started.append(None)
+            raise RuntimeError("listener down")
+        started.append(lobby)
+
+    async def main():
+        async with MatchmakingService(
+            tick_secs=0.01,
+            max_queue_time_secs=60,
+            on_lobby_started=on_lobby_started,
+            clock=clock,
+        ) as service:
+            service.try_enqueue(solo(100))
+            service.try_enqueue(solo(300))
+            await asyncio.sleep(0.05)
+            clock.time = 60
+            await asyncio.sleep(0.05)
+            service.try_enqueue(solo(500))
+            await asyncio.sleep(0.05)
+            clock.time = 120
+            await asyncio.sleep(0.05)
+            assert not service._task.done()
+
+    asyncio.run(main())
+
+    assert len(started) == 3
+    assert [lobby.parties[0].max_gear_score for lobby in started[1:]] == [300, 500]
+    assert "listener down" in caplog.text
+
+
+def test_try_enqueue_backpressure():
+    async def main():
+        service = MatchmakingService(max_pending=2)
+        accepted = [service.try_enqueue(solo(100)) for _ in range(3)]
+        await service.tick()
+        return accepted, service.try_enqueue(solo(100))
+
+    accepted, accepted_after_tick = asyncio.run(main())
+
+    assert accepted == [True, True, False]
+    assert accepted_after_tick
+
+
+def test_background_loop_with_local_client():
+    started = []
+
+    async def main():
+        async with MatchmakingService(
+            tick_secs=0.01, on_lobby_started=started.append
+        ) as service:
+            client = LocalClient(service)
+            await client.run(parties_per_sec=500, duration_secs=0.3)
+            await asyncio.sleep(0.05)
+        return service, client
+
+    service, client = asyncio.run(main())
+
+    assert service.pending.empty()
+    assert len(client.enqueue_latencies) > 10
+    assert sum(client.enqueue_latencies) / len(client.enqueue_latencies) < 0.001
+    placed = sum(
+        lobby.current_player_count()
+        for lobbies in service.filling_lobbies.values()
+        for lobby in lobbies
+    ) + sum(lobby.current_player_count() for lobby in started)
+    assert placed > 0
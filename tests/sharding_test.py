@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+import matchmaking
+import sharding
+import simulation
+from schema import Map
+
+
+def test_sharded_simulator_matches_simulator():
+    sharded_results = sharding.sharded_simulator(
+        simulated_secs=600,
+        max_queue_time_secs=120,
+        seed=9,
+        current_map=Map.goblin_caves,
+    )
+    results = simulation.simulator(simulated_secs=600, max_queue_time_secs=120, seed=9)
+
+    assert sharded_results == results
+
+
+@pytest.mark.parametrize("mmr_method", ["job_gs", "p75_gs"])
+def test_sharded_simulator_sends_back_lobbies_rated_by_any_strategy(mmr_method):
+    sharded_results = sharding.sharded_simulator(
+        simulated_secs=300,
+        max_queue_time_secs=120,
+        mmr_method=mmr_method,
+        seed=9,
+        current_map=Map.goblin_caves,
+    )
+    results = simulation.simulator(
+        simulated_secs=300, max_queue_time_secs=120, mmr_method=mmr_method, seed=9
+    )
+
+    assert sharded_results == results
+
+
+def test_sharded_simulator_keeps_brackets_apart():
+    results = sharding.sharded_simulator(
+        simulated_secs=600, max_queue_time_secs=120, seed=10
+    )
+
+    maps = set()
+    for party_size, lobbies in results["started"].items():
+        for lobby in lobbies:
+            maps.add(lobby.map)
+            mmrs = [matchmaking.max_gearscore_mmr(party) for party in lobby.parties]
+            assert max(mmrs) - min(mmrs) <= 50
+            assert all(party.map == lobby.map for party in lobby.parties)
+            assert all(len(party) == party_size for party in lobby.parties)
+    assert maps == set(Map)
+
+
+def test_shard_state_places_and_starts():
+    random.seed(11)
+    state = sharding.ShardState((Map.ice_cavern, 1), max_queue_time_secs=30)
+    parties = [
+        simulation.generate_party(map=Map.ice_cavern, max_size=1) for _ in range(50)
+    ]
+
+    started, canceled = state.tick(0, parties)
+    assert all(lobby.current_player_count() == 10 for lobby in started)
+
+    started_later, _ = state.tick(30, [])
+    assert started_later
+    assert not state.filling_lobbies[1]
+    assert canceled == []
+
+
+def test_stop_raises_when_a_shard_worker_died():
+    shard = (Map.goblin_caves, 1)
+    matchmaker = sharding.ShardedMatchmaker(shards=[shard, (Map.goblin_caves, 2)])
+    matchmaker.start()
+    # not a (now, parties) message, the worker fails unpacking it
+    matchmaker.inboxes[shard].put("not a tick")
+
+    with pytest.raises(RuntimeError, match="died"):
+        matchmaker.stop()
+    assert matchmaker.processes == []
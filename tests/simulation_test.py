@@ -1,7 +1,15 @@
+import copy
+import os
+import random
+import subprocess
+import sys
+
 import pytest
 
 import matchmaking as matchmaking
 import simulation as simulation
+import workload
+import writers
 from schema import Job, Map
 
 
@@ -108,3 +116,209 @@ def test_mmr_threshold(
             max_mmr = max(mmr_fn(party) for party in lobby.parties)
             min_mmr = min(mmr_fn(party) for party in lobby.parties)
             assert (max_mmr - min_mmr) <= mmr_threshold
+
+
+@pytest.mark.parametrize("mmr_method", ["max_gs", "avg_gs"])
+def test_lobby_index_matches_linear_scan(mmr_method):
+    random.seed(7)
+    parties = [simulation.generate_party(map=Map.goblin_caves) for _ in range(500)]
+
+    def place(lobby_index):
+        all_filling_lobbies = {1: [], 2: [], 3: []}
+        simulation.process_queued_parties(
+            copy.deepcopy(parties),
+            all_filling_lobbies,
+            max_queue_time_secs=120,
+            mmr_method=mmr_method,
+            mmr_threshold=50,
+            lobby_index=lobby_index,
+        )
+        return all_filling_lobbies
+
+    assert place(matchmaking.LobbyIndex(mmr_method)) == place(None)
+
+
+@pytest.mark.parametrize("mmr_method", ["max_gs", "avg_gs"])
+def test_batch_placement_matches_sequential(mmr_method):
+    random.seed(11)
+    parties = [simulation.generate_party(map=Map.goblin_caves) for _ in range(500)]
+
+    sequential = {1: [], 2: [], 3: []}
+    for party in copy.deepcopy(parties):
+        matchmaking.put_party_in_lobby(
+            sequential[party.max_size], party, mmr_method=mmr_method, mmr_threshold=30
+        )
+
+    batched = matchmaking.put_parties_in_lobbies(
+        {1: [], 2: [], 3: []},
+        copy.deepcopy(parties),
+        lobby_index=matchmaking.LobbyIndex(mmr_method=mmr_method),
+        mmr_method=mmr_method,
+        mmr_threshold=30,
+    )
+
+    assert batched == sequential
+
+
+def test_indexed_batch_placement_respects_lobby_constraints():
+    random.seed(12)
+    parties = [simulation.generate_party() for _ in range(1000)]
+    num_players = sum(len(party) for party in parties)
+
+    lobby_index = matchmaking.LobbyIndex()
+    filling = matchmaking.put_parties_in_lobbies(
+        {1: [], 2: [], 3: []},
+        parties,
+        lobby_index=lobby_index,
+        mmr_threshold=50,
+    )
+
+    lobbies = [lobby for lobbies in filling.values() for lobby in lobbies]
+    assert len(lobby_index) == sum(
+        lobby.current_player_count() < lobby.max_players for lobby in lobbies
+    )
+    assert sum(lobby.current_player_count() for lobby in lobbies) == num_players
+    for lobby in lobbies:
+        mmrs = [matchmaking.max_gearscore_mmr(party) for party in lobby.parties]
+        assert max(mmrs) - min(mmrs) <= 50
+        assert lobby.current_player_count() <= lobby.max_players
+        assert all(party.map == lobby.map for party in lobby.parties)
+        assert all(len(party) <= lobby.party_size for party in lobby.parties)
+
+
+def test_event_simulator_matches_simulator(max_queue_time_secs, mmr_threshold):
+    random.seed(5)
+    tick_results = simulation.simulator(
+        simulated_secs=1000,
+        max_queue_time_secs=max_queue_time_secs,
+        mmr_threshold=mmr_threshold,
+    )
+    random.seed(5)
+    event_results = simulation.event_simulator(
+        simulated_secs=1000,
+        max_queue_time_secs=max_queue_time_secs,
+        mmr_threshold=mmr_threshold,
+    )
+
+    assert event_results == tick_results
+    for lobbies in event_results["filling"].values():
+        for lobby in lobbies:
+            assert lobby.queue_time == 1000 - lobby.created_at
+
+
+@pytest.mark.parametrize("mmr_method", ["max_gs", "p75_gs"])
+def test_mmr_schedule_keeps_lobbies_within_widest_threshold(mmr_method):
+    random.seed(12)
+    results = simulation.simulator(
+        simulated_secs=1200,
+        max_queue_time_secs=300,
+        mmr_method=mmr_method,
+        mmr_threshold=25,
+        mmr_schedule=[(60, 50), (120, 75)],
+    )
+    mmr_fn = matchmaking.MMR_FUNCTIONS[mmr_method]
+
+    assert results["started"][3]
+    for lobbies in [*results["started"].values(), *results["filling"].values()]:
+        for lobby in lobbies:
+            assert lobby.parties
+            mmrs = [mmr_fn(party) for party in lobby.parties]
+            assert max(mmrs) - min(mmrs) <= 75
+            assert lobby.current_player_count() <= lobby.max_players
+
+
+@pytest.mark.parametrize("batch_secs", [1, 15])
+def test_batch_simulator_accounts_for_every_party(batch_secs):
+    config = workload.WorkloadConfig()
+    queued = sum(
+        len(party)
+        for parties in workload.generate_workload(config, 900)
+        for party in parties
+    )
+
+    results = simulation.batch_simulator(
+        simulated_secs=900,
+        max_queue_time_secs=120,
+        arrivals=workload.generate_workload(config, 900),
+        batch_secs=batch_secs,
+    )
+
+    lobbies = [lob for lobbies in results["started"].values() for lob in lobbies]
+    lobbies += [lob for lobbies in results["filling"].values() for lob in lobbies]
+    players = sum(lobby.current_player_count() for lobby in lobbies)
+    players += sum(len(party) for party in results["canceled_parties"])
+    assert players == queued
+
+    for party_size, started in results["started"].items():
+        assert started
+        for lobby in started:
+            assert all(len(party) == party_size for party in lobby.parties)
+            mmrs = [matchmaking.max_gearscore_mmr(party) for party in lobby.parties]
+            assert max(mmrs) - min(mmrs) <= 50
+    for party in results["canceled_parties"]:
+        assert len(party) < party.max_size
+
+
+def test_party_pool_only_places_full_parties():
+    config = workload.WorkloadConfig()
+    queued = sum(
+        len(party)
+        for parties in workload.generate_workload(config, 900)
+        for party in parties
+    )
+
+    without_pool = simulation.simulator(
+        simulated_secs=900,
+        max_queue_time_secs=120,
+        arrivals=workload.generate_workload(config, 900),
+    )
+    results = simulation.simulator(
+        simulated_secs=900,
+        max_queue_time_secs=120,
+        arrivals=workload.generate_workload(config, 900),
+        party_pool=True,
+    )
+
+    lobbies = [lob for lobbies in results["started"].values() for lob in lobbies]
+    lobbies += [lob for lobbies in results["filling"].values() for lob in lobbies]
+    for lobby in lobbies:
+        assert all(len(party) == lobby.party_size for party in lobby.parties)
+    players = sum(lobby.current_player_count() for lobby in lobbies)
+    players += sum(len(party) for party in results["canceled_parties"])
+    players += sum(len(party) for party in results["pooled"])
+    assert players == queued
+
+    started_without_pool = sum(len(lobs) for lobs in without_pool["started"].values())
+    assert len(lobbies) < started_without_pool
+
+
+def test_cli_archives_mmr_with_mmr_method(tmp_path):
+    path = tmp_path / "results.archive"
+    subprocess.run(
+        [
+            sys.executable,
+            "simulation.py",
+            "--simulated_secs=120",
+            "--seed=4",
+            "--mmr_method=avg_gs",
+            "--output_format=archive",
+            f"--output={path}",
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+    )
+
+    def archived(mmr_method):
+        archive = writers.LobbyArchive(mmr_method=mmr_method)
+        simulation.simulator(
+            simulated_secs=120,
+            mmr_method=mmr_method,
+            seed=4,
+            writer=archive,
+            retain=False,
+        )
+        return list(archive.lobbies())
+
+    lobbies = list(writers.read_archive(path).lobbies())
+    assert lobbies == archived("avg_gs")
+    assert lobbies != archived("max_gs")
@@ -0,0 +1,63 @@
+import simulation
+import sweep
+import workload
+from schema import Map
+
+
+def test_config_grid():
+    configs = sweep.config_grid([25, 50], ["max_gs", "avg_gs"], [120])
+    assert len(configs) == 4
+    assert {
+        "mmr_threshold": 50,
+        "mmr_method": "avg_gs",
+        "max_queue_time_secs": 120,
+    } in configs
+
+
+def test_percentile():
+    assert sweep.percentile([], 95) == 0
+    assert sweep.percentile([5, 1, 3, 2, 4], 50) == 3
+    assert sweep.percentile(list(range(1, 101)), 95) == 95
+
+
+def test_summarize_results():
+    results = simulation.simulator(simulated_secs=300, max_queue_time_secs=60, seed=1)
+    summary = sweep.summarize_results(results)
+
+    assert summary["started_lobbies"] == sum(map(len, results["started"].values()))
+    assert 0 < summary["fill_rate"] <= 1
+    assert summary["mean_wait_secs"] <= summary["p95_wait_secs"] <= 60
+    assert 0 <= summary["mean_mmr_spread"] <= 50
+
+
+def test_sweep_is_reproducible():
+    configs = sweep.config_grid([25, 50], ["max_gs"], [60])
+
+    first = sweep.sweep(configs, [1, 2], simulated_secs=300, max_workers=2)
+    second = sweep.sweep(configs, [1, 2], simulated_secs=300, max_workers=2)
+
+    assert first == second
+    assert [run["mmr_threshold"] for run in first] == [25, 50]
+    assert all(run["seeds"] == [1, 2] for run in first)
+
+
+def test_summarize_brackets_splits_maps():
+    results = simulation.simulator(
+        simulated_secs=900,
+        max_queue_time_secs=120,
+        arrivals=workload.generate_map_workloads(
+            {m: workload.WorkloadConfig() for m in Map}, 900
+        ),
+    )
+
+    brackets = sweep.summarize_brackets(results)
+    assert list(brackets) == [f"{m.value}/{size}" for m in Map for size in (1, 2, 3)]
+    assert sum(b["started_lobbies"] for b in brackets.values()) == sum(
+        map(len, results["started"].values())
+    )
+    assert sum(b["canceled_parties"] for b in brackets.values()) == len(
+        results["canceled_parties"]
+    )
+    for lobbies in results["started"].values():
+        for lobby in lobbies:
+            assert all(party.map == lobby.map for party in lobby.parties)
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+import simulation
+import traces
+import workload
+from schema import Map
+
+
+def test_party_line_round_trip():
+    party = workload.generate_batch(random.Random(0), workload.WorkloadConfig(), 1)[0]
+    line = traces.format_party(1717200000.5, party)
+
+    assert traces.parse_party(line) == (1717200000.5, party)
+
+
+def test_read_trace_streams_in_order(tmp_path):
+    arrivals = list(workload.generate_workload(workload.WorkloadConfig(), 60, seed=1))
+    path = tmp_path / "trace.csv"
+    num_parties = traces.write_trace(path, arrivals, start_timestamp=1000)
+
+    records = list(traces.read_trace(path, chunk_bytes=256))
+    assert len(records) == num_parties
+    assert [party for _, party in records] == [p for ps in arrivals for p in ps]
+
+    seconds = list(traces.trace_seconds(records, start=1000))
+    assert seconds == [(t, parties) for t, parties in enumerate(arrivals) if parties]
+
+
+def test_read_trace_reports_bad_lines(tmp_path):
+    path = tmp_path / "trace.csv"
+    path.write_text(
+        f"{traces.TRACE_HEADER}\n0,goblin_caves,1,rogue:1:100\n1,atlantis,1,rogue:1:1\n"
+    )
+
+    with pytest.raises(ValueError, match="trace.csv:3"):
+        list(traces.read_trace(path))
+
+
+def test_trace_seconds_rejects_going_back_in_time():
+    party = workload.generate_batch(random.Random(0), workload.WorkloadConfig(), 1)[0]
+    with pytest.raises(ValueError):
+        list(traces.trace_seconds([(10, party), (12, party), (11.5, party)]))
+
+
+def test_replay_matches_simulator(tmp_path):
+    config = workload.WorkloadConfig(
+        arrival_rate=0.5, map_weights={Map.goblin_caves: 1, Map.ice_cavern: 1}
+    )
+    path = tmp_path / "trace.csv"
+    traces.write_trace(path, workload.generate_workload(config, 900, seed=2))
+
+    replayed = traces.replay_trace(
+        traces.trace_seconds(traces.read_trace(path), start=0),
+        max_queue_time_secs=120,
+        until=900,
+    )
+    simulated = simulation.simulator(
+        simulated_secs=900,
+        max_queue_time_secs=120,
+        arrivals=workload.generate_workload(config, 900, seed=2),
+    )
+
+    assert replayed == simulated
+    assert replayed["canceled_parties"]
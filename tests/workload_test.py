@@ -0,0 +1,121 @@
+import dataclasses
+import os
+import random
+
+import pytest
+
+import simulation
+import workload
+from schema import Map
+
+
+def test_generate_workload_is_reproducible():
+    config = workload.WorkloadConfig(arrival_rate=3)
+    first = list(workload.generate_workload(config, 100, seed=1))
+    second = list(workload.generate_workload(config, 100, seed=1))
+    other = list(workload.generate_workload(config, 100, seed=2))
+
+    assert first == second
+    assert first != other
+    assert 200 <= sum(map(len, first)) <= 400
+
+
+def test_rate_follows_diurnal_curve_and_surges():
+    config = workload.WorkloadConfig(
+        arrival_rate=2,
+        diurnal_amplitude=0.5,
+        diurnal_period_secs=100,
+        diurnal_peak_secs=25,
+        surges=[(60, 10, 4)],
+    )
+
+    assert config.rate(25) == pytest.approx(3)
+    assert config.rate(75) == pytest.approx(1)
+    no_surge = dataclasses.replace(config, surges=[])
+    assert config.rate(65) == pytest.approx(4 * no_surge.rate(65))
+    assert config.rate(70) == pytest.approx(no_surge.rate(70))
+
+
+@pytest.mark.parametrize("distribution", workload.GEAR_SCORE_DISTRIBUTIONS)
+def test_generate_batch_mixes(distribution):
+    config = workload.WorkloadConfig(
+        gear_score_distribution=distribution,
+        party_size_weights={1: 0, 2: 1, 3: 3},
+        map_weights={Map.ice_cavern: 1, Map.goblin_caves: 1},
+    )
+    parties = workload.generate_batch(random.Random(0), config, 2000)
+
+    assert {party.max_size for party in parties} == {2, 3}
+    assert 0.7 < sum(party.max_size == 3 for party in parties) / len(parties) < 0.8
+    assert {party.map for party in parties} == {Map.ice_cavern, Map.goblin_caves}
+    for party in parties:
+        assert 1 <= len(party) <= party.max_size
+        assert all(1 <= player.gear_score < 400 for player in party.players)
+
+
+def test_workload_file_round_trip(tmp_path):
+    config = workload.WorkloadConfig(party_size_weights={3: 1})
+    arrivals = list(workload.generate_workload(config, 120, seed=3))
+
+    path = tmp_path / "workload.bin"
+    num_parties = workload.write_workload(path, arrivals, 120)
+
+    assert num_parties == sum(map(len, arrivals))
+    assert list(workload.read_workload(path)) == arrivals
+
+
+def test_cached_workload_generates_once(tmp_path):
+    config = workload.WorkloadConfig()
+    path = workload.cached_workload(config, 60, seed=4, cache_dir=tmp_path)
+    modified = os.path.getmtime(path)
+
+    assert workload.cached_workload(config, 60, seed=4, cache_dir=tmp_path) == path
+    assert os.path.getmtime(path) == modified
+    assert workload.cached_workload(config, 60, seed=5, cache_dir=tmp_path) != path
+
+
+def test_engines_replay_the_same_workload(tmp_path):
+    path = workload.cached_workload(
+        workload.WorkloadConfig(), 600, seed=6, cache_dir=tmp_path
+    )
+
+    tick_results = simulation.simulator(
+        simulated_secs=600,
+        max_queue_time_secs=120,
+        arrivals=workload.read_workload(path),
+    )
+    event_results = simulation.event_simulator(
+        simulated_secs=600,
+        max_queue_time_secs=120,
+        arrivals=workload.read_workload(path),
+    )
+
+    assert tick_results == event_results
+    assert tick_results["started"][3]
+
+
+def test_map_workloads_are_independent_streams():
+    goblin = workload.WorkloadConfig(arrival_rate=2)
+    ice = workload.WorkloadConfig(arrival_rate=0.5, party_size_weights={1: 1.0})
+
+    alone = list(workload.generate_map_workloads({Map.goblin_caves: goblin}, 300))
+    both = list(
+        workload.generate_map_workloads(
+            {Map.goblin_caves: goblin, Map.ice_cavern: ice}, 300
+        )
+    )
+
+    assert len(both) == 300
+    assert [
+        [party for party in parties if party.map == Map.goblin_caves]
+        for parties in both
+    ] == alone
+    ice_parties = [party for parties in both for party in parties]
+    ice_parties = [party for party in ice_parties if party.map == Map.ice_cavern]
+    assert 100 < len(ice_parties) < 200
+    assert all(party.max_size == 1 for party in ice_parties)
+
+
+def test_merge_arrivals_runs_until_every_stream_ends():
+    merged = list(workload.merge_arrivals([[[1], [2]], [[3], [], [4]]]))
+    assert merged == [[1, 3], [2], [4]]
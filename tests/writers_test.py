@@ -0,0 +1,138 @@
+import pytest
+
+import core
+import simulation
+import writers
+from schema import LobbyStatus
+
+
+@pytest.fixture(params=["tick", "event"])
+def engine(request):
+    return simulation.ENGINES[request.param]
+
+
+def test_ndjson_writer_streams_results(tmp_path, engine):
+    path = tmp_path / "results.ndjson"
+    with writers.NDJSONWriter(path) as writer:
+        results = engine(
+            simulated_secs=600, max_queue_time_secs=120, seed=2, writer=writer
+        )
+
+    lines = list(writers.read_ndjson(path))
+    lobbies = [line["lobby"] for line in lines if line["type"] == "lobby"]
+    canceled = [line["party"] for line in lines if line["type"] == "canceled_party"]
+
+    filling = [lob for lob in lobbies if lob["status"] == LobbyStatus.filling]
+    for party_size, started in results["started"].items():
+        assert [
+            lob
+            for lob in lobbies
+            if lob["status"] == LobbyStatus.started and lob["party_size"] == party_size
+        ] == [lobby.to_model().model_dump(mode="json") for lobby in started]
+    assert len(filling) == sum(map(len, results["filling"].values()))
+    assert canceled == [
+        party.to_model().model_dump(mode="json")
+        for party in results["canceled_parties"]
+    ]
+
+
+def test_binary_writer_round_trip(tmp_path, engine):
+    path = tmp_path / "results.bin"
+    with writers.BinaryWriter(path) as writer:
+        results = engine(
+            simulated_secs=600, max_queue_time_secs=120, seed=3, writer=writer
+        )
+
+    records = list(writers.read_binary(path))
+    canceled = [party for party in records if isinstance(party, core.Party)]
+
+    for party_size, started in results["started"].items():
+        assert [
+            lobby
+            for lobby in records
+            if isinstance(lobby, core.Lobby)
+            and lobby.status == LobbyStatus.started
+            and lobby.party_size == party_size
+        ] == started
+    assert canceled == results["canceled_parties"]
+
+
+def test_no_retain_keeps_only_filling(tmp_path, engine):
+    path = tmp_path / "results.bin"
+    with writers.BinaryWriter(path) as writer:
+        results = engine(
+            simulated_secs=600,
+            max_queue_time_secs=120,
+            seed=4,
+            writer=writer,
+            retain=False,
+        )
+
+    assert all(not lobbies for lobbies in results["started"].values())
+    assert results["canceled_parties"] == []
+    assert any(
+        isinstance(record, core.Lobby) and record.status == LobbyStatus.started
+        for record in writers.read_binary(path)
+    )
+
+
+def test_lobby_archive_round_trip(tmp_path, engine):
+    path = tmp_path / "results.archive"
+    with writers.LobbyArchive(path, capacity=16) as archive:
+        results = engine(
+            simulated_secs=600, max_queue_time_secs=120, seed=5, writer=archive
+        )
+
+    for records in (
+        list(archive.lobbies()),
+        list(writers.read_archive(path).lobbies()),
+    ):
+        started = [rec for rec in records if rec.status == LobbyStatus.started]
+        lobbies = [
+            lobby for lobbies in results["started"].values() for lobby in lobbies
+        ]
+        assert sorted(started) == sorted(
+            writers.LobbyRecord(
+                lobby.map,
+                lobby.party_size,
+                lobby.status,
+                lobby.created_at,
+                lobby.queue_time,
+                lobby.current_player_count(),
+                min(party.max_gear_score for party in lobby.parties),
+                max(party.max_gear_score for party in lobby.parties),
+            )
+            for lobby in lobbies
+        )
+        assert len(records) == len(started) + sum(map(len, results["filling"].values()))
+
+    restored = writers.read_archive(path)
+    assert list(restored.canceled_parties()) == list(archive.canceled_parties())
+    assert [rec.mmr for rec in archive.canceled_parties()] == [
+        party.max_gear_score for party in results["canceled_parties"]
+    ]
+
+
+def test_lobby_archive_records_are_compact():
+    lobby = core.Lobby(
+        parties=[
+            core.Party(
+                players=[core.Player(job="rogue", level=10, gear_score=100)] * 3,
+                map="goblin_caves",
+                max_size=3,
+            )
+            for _ in range(5)
+        ],
+        map="goblin_caves",
+        party_size=3,
+        status=LobbyStatus.started,
+    )
+    archive = writers.LobbyArchive(capacity=1)
+    for _ in range(1000):
+        archive.write_lobby(lobby)
+
+    assert len(archive) == 1000
+    (record,) = set(archive.lobbies())
+    assert record.players == 15 and record.mmr_spread == 0
+    # room for 1024 records, at most 32 bytes each
+    assert archive.nbytes() <= 1024 * 32
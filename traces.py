@@ -0,0 +1,262 @@
+"""Queue traces: parties as they queued in production, replayed through matchmaking.
+
+A trace is a csv file with one queued party per line, ordered by time:
+
+    timestamp,map,max_size,players
+    1717200000.25,goblin_caves,3,fighter:120:230|cleric:88:215
+
+`timestamp` is in seconds and `players` are `job:level:gear_score` separated by
+`|`. `read_trace` streams it back in chunks, so a trace never has to fit in memory,
+and `replay_trace` feeds it to matchmaking second by second.
+"""
+
+import argparse
+import time
+from typing import Iterable, Iterator
+
+import core
+import matchmaking as matchmaking
+import mmr
+import simulation as simulation
+from schema import Job, Map
+from writers import WRITERS, ResultsWriter
+
+TRACE_HEADER = "timestamp,map,max_size,players"
+
+
+def format_party(timestamp: float, party: core.Party) -> str:
+    "Trace line for a party queued at timestamp"
+    players = "|".join(
+        f"{player.job.value}:{player.level}:{player.gear_score}"
+        for player in party.players
+    )
+    return f"{timestamp},{party.map.value},{party.max_size},{players}"
+
+
+def parse_party(line: str) -> tuple[float, core.Party]:
+    "Timestamp and party of a trace line"
+    timestamp, map_name, max_size, players = line.rstrip("\n").split(",")
+    party_players = []
+    for player in players.split("|"):
+        job, level, gear_score = player.split(":")
+        party_players.append(core.Player(Job(job), int(level), int(gear_score)))
+    return float(timestamp), core.Party(
+        players=party_players, map=Map(map_name), max_size=int(max_size)
+    )
+
+
+def write_trace(
+    path: str, arrivals: Iterable[list[core.Party]], start_timestamp: float = 0.0
+) -> int:
+    """Records parties queuing each second as a trace, returning the parties written.
+
+    Parties queued in second `t` get timestamp `start_timestamp + t`."""
+
+    num_parties = 0
+    with open(path, "w") as f:
+        f.write(TRACE_HEADER + "\n")
+        for t, parties in enumerate(arrivals):
+            for party in parties:
+                f.write(format_party(start_timestamp + t, party) + "\n")
+            num_parties += len(parties)
+    return num_parties
+
+
+def read_trace(path: str, chunk_bytes=1 << 20) -> Iterator[tuple[float, core.Party]]:
+    "Streams (timestamp, party) out of a trace, reading `chunk_bytes` at a time"
+    with open(path, buffering=chunk_bytes) as f:
+        header = f.readline().rstrip("\n")
+        if header != TRACE_HEADER:
+            raise ValueError(f"{path} is not a trace, header is {header!r}")
+
+        for line_number, line in enumerate(f, start=2):
+            if not line.strip():
+                continue
+            try:
+                yield parse_party(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: {e}") from e
+
+
+def trace_seconds(
+    records: Iterable[tuple[float, core.Party]], start: float | None = None
+) -> Iterator[tuple[int, list[core.Party]]]:
+    """Groups trace records into (second, parties queued in it).
+
+    Seconds count from `start`, by default the first record's timestamp. Seconds
+    without parties are skipped.
+    """
+
+    # second of the parties being grouped, None before the first record
+    current: int | None = None
+    parties: list[core.Party] = []
+    for timestamp, party in records:
+        if start is None:
+            start = timestamp
+        t = int(timestamp - start)
+        if current is not None and t != current:
+            if t < current:
+                raise ValueError(f"Trace goes back in time at {timestamp}")
+            yield current, parties
+            parties = []
+        current = t
+        parties.append(party)
+
+    if current is not None:
+        yield current, parties
+
+
+def replay_trace(
+    seconds: Iterable[tuple[int, list[core.Party]]],
+    max_queue_time_secs=300,
+    mmr_method="max_gs",
+    mmr_threshold=50,
+    writer: ResultsWriter | None = None,
+    retain: bool = True,
+    until: int | None = None,
+    speed: float | None = None,
+    mmr_schedule: list[tuple[int, float]] | None = None,
+) -> dict:
+    """Runs matchmaking over queued parties, returning results like the simulator.
+
+    Seconds without parties or due lobbies are skipped, so a replay runs as fast as
+    matchmaking allows while giving the same results as `simulation.simulator` with
+    the same parties. With a `speed`, replay instead waits so `speed` trace seconds
+    pass per wall clock second.
+
+    Lobbies still filling at `until`, by default the second after the last party
+    queued, are returned as filling. `mmr_schedule` widens thresholds of waiting
+    lobbies like in `simulation.simulator`.
+    """
+
+    all_started_lobbies: dict[int, list[core.Lobby]] = {1: [], 2: [], 3: []}
+    all_canceled_parties: list[core.Party] = []
+    lobby_index = matchmaking.LobbyIndex(mmr_method=mmr_method)
+    schedule = None
+    if mmr_schedule:
+        schedule = matchmaking.ThresholdSchedule(mmr_threshold, tuple(mmr_schedule))
+    lobby_deadlines = matchmaking.LobbyDeadlines(max_queue_time_secs, schedule)
+
+    def update_until(end: int):
+        "Starts or cancels lobbies due before end, at the second they are due"
+        while (due := lobby_deadlines.next_due()) is not None and due < end:
+            simulation.update_lobbies(
+                lobby_deadlines,
+                due,
+                all_started_lobbies,
+                all_canceled_parties,
+                writer=writer,
+                retain=retain,
+                lobby_index=lobby_index,
+            )
+
+    wall_start = time.monotonic()
+    last_t = -1
+    for t, queued_parties in seconds:
+        if until is not None and t >= until:
+            break
+        update_until(t)
+        if speed is not None:
+            time.sleep(max(t / speed - (time.monotonic() - wall_start), 0))
+
+        simulation.process_queued_parties(
+            queued_parties,
+            {1: [], 2: [], 3: []},
+            max_queue_time_secs,
+            mmr_method,
+            mmr_threshold,
+            lobby_index=lobby_index,
+            now=t,
+            lobby_deadlines=lobby_deadlines,
+            mmr_schedule=schedule,
+        )
+        simulation.update_lobbies(
+            lobby_deadlines,
+            t,
+            all_started_lobbies,
+            all_canceled_parties,
+            writer=writer,
+            retain=retain,
+            lobby_index=lobby_index,
+        )
+        last_t = t
+
+    if until is None:
+        until = last_t + 1
+    update_until(until)
+
+    all_filling_lobbies = lobby_deadlines.filling_lobbies()
+    for lobbies in all_filling_lobbies.values():
+        for lobby in lobbies:
+            lobby.queue_time = until - lobby.created_at
+    simulation.write_filling(all_filling_lobbies, writer=writer)
+
+    return {
+        "started": all_started_lobbies,
+        "filling": all_filling_lobbies,
+        "canceled_parties": all_canceled_parties,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replays a queue trace")
+
+    parser.add_argument("trace", type=str, help="Trace csv file to replay.")
+    parser.add_argument(
+        "--max_queue_time",
+        type=int,
+        default=300,
+        help="How long can a lobby be filling before force starting.",
+    )
+    parser.add_argument(
+        "--mmr_method",
+        type=str,
+        default="max_gs",
+        choices=mmr.STRATEGIES.keys(),
+        help="MMR calculation method.",
+    )
+    parser.add_argument(
+        "--mmr_threshold",
+        type=float,
+        default=50,
+        help="Maximum MMR difference for two parties to be matchable.",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=None,
+        help="Trace seconds per wall clock second, as fast as possible by default.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="replay.ndjson",
+        help="File to stream started lobbies and canceled parties to.",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="ndjson",
+        choices=WRITERS.keys(),
+        help="Format of the output file.",
+    )
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with WRITERS[args.output_format](args.output) as writer:
+        results = replay_trace(
+            trace_seconds(read_trace(args.trace)),
+            max_queue_time_secs=args.max_queue_time,
+            mmr_method=args.mmr_method,
+            mmr_threshold=args.mmr_threshold,
+            writer=writer,
+            retain=False,
+            speed=args.speed,
+        )
+    filling = sum(map(len, results["filling"].values()))
+    print(
+        f"Replayed in {time.perf_counter() - start:.1f}s, "
+        f"{filling} lobbies still filling, results in {args.output}"
+    )
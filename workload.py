@@ -0,0 +1,382 @@
+"""Seeded synthetic queue traffic for the simulator, benchmarks and sweeps.
+
+A `WorkloadConfig` describes how many parties queue each second and what they look
+like. `generate_workload` turns it into the per-second batches of parties the
+simulator engines take as `arrivals`, always the same ones for the same config and
+seed. `write_workload` stores them in a compact binary file that `read_workload`
+replays, and `cached_workload` only generates a file the first time a config and
+seed are asked for. `generate_map_workloads` gives every map a stream of its own.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+from dataclasses import asdict, dataclass, field, replace
+from typing import BinaryIO, Iterable, Iterator
+
+import core
+from schema import Map
+from writers import JOBS, MAPS, PARTY_HEADER, PLAYER, BinaryWriter
+
+CACHE_DIR = ".workloads"
+
+# magic, simulated seconds
+WORKLOAD_HEADER = struct.Struct("<4sI")
+WORKLOAD_MAGIC = b"MMWL"
+# second, parties
+SECOND_HEADER = struct.Struct("<IH")
+
+GEAR_SCORE_DISTRIBUTIONS = ["uniform", "normal", "lognormal"]
+
+
+@dataclass
+class WorkloadConfig:
+    """Traffic shape of a workload.
+
+    Parties queue as a Poisson process with `arrival_rate` parties per second on
+    average. A diurnal curve scales the rate by up to `diurnal_amplitude` around
+    its mean, peaking `diurnal_peak_secs` into every `diurnal_period_secs`. Surges
+    are (start secs, duration secs, rate multiplier).
+
+    Party sizes and maps are drawn by weight, with a uniform number of players up
+    to the party size like `simulation.generate_party`.
+    """
+
+    arrival_rate: float = 1.5
+    diurnal_amplitude: float = 0.0
+    diurnal_period_secs: int = 86_400
+    diurnal_peak_secs: int = 72_000
+    surges: list[tuple[int, int, float]] = field(default_factory=list)
+
+    # uniform between min and max, or normal/lognormal clipped to them
+    gear_score_distribution: str = "uniform"
+    min_gs: int = 1
+    max_gs: int = 400
+    mean_gs: float = 200
+    std_gs: float = 75
+    min_level: int = 1
+    max_level: int = 300
+
+    # {solo/duo/trio: weight}
+    party_size_weights: dict[int, float] = field(
+        default_factory=lambda: {1: 1.0, 2: 1.0, 3: 1.0}
+    )
+    map_weights: dict[Map, float] = field(
+        default_factory=lambda: {Map.goblin_caves: 1.0}
+    )
+
+    def rate(self, t: int) -> float:
+        "Mean parties queuing per second at second t"
+        rate = self.arrival_rate
+        if self.diurnal_amplitude:
+            phase = (
+                2 * math.pi * (t - self.diurnal_peak_secs) / self.diurnal_period_secs
+            )
+            rate *= 1 + self.diurnal_amplitude * math.cos(phase)
+        for start, duration, multiplier in self.surges:
+            if start <= t < start + duration:
+                rate *= multiplier
+        return max(rate, 0.0)
+
+    def key(self, seed: int, simulated_secs: int) -> str:
+        "Stable hash of the config, seed and duration, naming cached workloads"
+        config = asdict(self)
+        config["map_weights"] = {m.value: w for m, w in self.map_weights.items()}
+        blob = json.dumps([config, seed, simulated_secs], sort_keys=True)
+        return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+
+def poisson(rng: random.Random, mean: float) -> int:
+    "Poisson sample, by counting uniforms for small means and normal approximation"
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(round(rng.gauss(mean, math.sqrt(mean))), 0)
+
+    limit = math.exp(-mean)
+    count = 0
+    product = rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def gear_scores(rng: random.Random, config: WorkloadConfig, k: int) -> list[int]:
+    "k gear scores drawn from the config's distribution"
+    low, high = config.min_gs, config.max_gs
+    match config.gear_score_distribution:
+        case "uniform":
+            return [low + int(rng.random() * (high - low)) for _ in range(k)]
+        case "normal":
+            draws = [rng.gauss(config.mean_gs, config.std_gs) for _ in range(k)]
+        case "lognormal":
+            # parameters of the underlying normal for the requested mean and std
+            sigma = math.sqrt(math.log(1 + (config.std_gs / config.mean_gs) ** 2))
+            mu = math.log(config.mean_gs) - sigma**2 / 2
+            draws = [rng.lognormvariate(mu, sigma) for _ in range(k)]
+        case _:
+            raise NotImplementedError(
+                f"No gear score distribution: {config.gear_score_distribution}"
+            )
+    return [min(max(round(gs), low), high - 1) for gs in draws]
+
+
+def generate_batch(
+    rng: random.Random, config: WorkloadConfig, num_parties: int
+) -> list[core.Party]:
+    """Parties queuing together, drawing every attribute for the batch at once."""
+
+    party_sizes = list(config.party_size_weights)
+    maps = list(config.map_weights)
+    max_sizes = rng.choices(
+        party_sizes, weights=list(config.party_size_weights.values()), k=num_parties
+    )
+    party_maps = rng.choices(
+        maps, weights=list(config.map_weights.values()), k=num_parties
+    )
+    num_players = [1 + int(rng.random() * max_size) for max_size in max_sizes]
+
+    total = sum(num_players)
+    jobs = rng.choices(JOBS, k=total)
+    level_range = config.max_level - config.min_level
+    levels = [config.min_level + int(rng.random() * level_range) for _ in range(total)]
+    scores = gear_scores(rng, config, total)
+    players = [core.Player(*attrs) for attrs in zip(jobs, levels, scores)]
+
+    parties = []
+    start = 0
+    for max_size, party_map, size in zip(max_sizes, party_maps, num_players):
+        parties.append(
+            core.Party(
+                players=players[start : start + size],  # noqa: E203
+                map=party_map,
+                max_size=max_size,
+            )
+        )
+        start += size
+    return parties
+
+
+def generate_workload(
+    config: WorkloadConfig, simulated_secs: int, seed=0, chunk_secs=1024
+) -> Iterator[list[core.Party]]:
+    """Parties queuing in each second, the same ones for the same config and seed.
+
+    Parties for `chunk_secs` seconds are generated as one batch."""
+
+    rng = random.Random(seed)
+    for chunk_start in range(0, simulated_secs, chunk_secs):
+        chunk_end = min(chunk_start + chunk_secs, simulated_secs)
+        counts = [poisson(rng, config.rate(t)) for t in range(chunk_start, chunk_end)]
+        parties = generate_batch(rng, config, sum(counts))
+
+        start = 0
+        for count in counts:
+            yield parties[start : start + count]  # noqa: E203
+            start += count
+
+
+def merge_arrivals(
+    streams: Iterable[Iterable[list[core.Party]]],
+) -> Iterator[list[core.Party]]:
+    "Parties queuing in each second of any stream, in stream order, until all end"
+    iterators = [iter(stream) for stream in streams]
+    while True:
+        parties = []
+        ended = 0
+        for iterator in iterators:
+            second = next(iterator, None)
+            if second is None:
+                ended += 1
+            else:
+                parties.extend(second)
+        if ended == len(iterators):
+            return
+        yield parties
+
+
+def generate_map_workloads(
+    configs: dict[Map, WorkloadConfig], simulated_secs: int, seed=0
+) -> Iterator[list[core.Party]]:
+    """Parties queuing on several maps, every map with its own traffic config.
+
+    Each map's parties only queue on that map and are drawn from a generator seeded
+    with seed and the map, so adding a map leaves the other maps' parties as they
+    were."""
+
+    return merge_arrivals(
+        generate_workload(
+            replace(config, map_weights={map_: 1.0}),
+            simulated_secs,
+            seed=f"{seed}/{map_.value}",
+        )
+        for map_, config in configs.items()
+    )
+
+
+def map_configs(
+    config: WorkloadConfig, map_rates: list[tuple[str, str]]
+) -> dict[Map, WorkloadConfig]:
+    "Config per map from (map, parties per second) pairs, the rest taken from config"
+    return {Map(m): replace(config, arrival_rate=float(rate)) for m, rate in map_rates}
+
+
+def write_workload(
+    path: str, arrivals: Iterable[list[core.Party]], simulated_secs: int
+) -> int:
+    """Writes the first `simulated_secs` seconds of arrivals, returning the parties.
+
+    Seconds without parties are left out, parties use the `writers` binary layout.
+    """
+
+    num_parties = 0
+    with open(path, "wb") as f:
+        f.write(WORKLOAD_HEADER.pack(WORKLOAD_MAGIC, simulated_secs))
+        for t, parties in zip(range(simulated_secs), arrivals):
+            if not parties:
+                continue
+            record = [SECOND_HEADER.pack(t, len(parties))]
+            record.extend(BinaryWriter._pack_party(party) for party in parties)
+            f.write(b"".join(record))
+            num_parties += len(parties)
+    return num_parties
+
+
+def _read_second(f: BinaryIO, num_parties: int) -> list[core.Party]:
+    parties = []
+    for _ in range(num_parties):
+        map_code, max_size, num_players = PARTY_HEADER.unpack(f.read(PARTY_HEADER.size))
+        players = [
+            core.Player(JOBS[job_code], level, gear_score)
+            for job_code, level, gear_score in PLAYER.iter_unpack(
+                f.read(PLAYER.size * num_players)
+            )
+        ]
+        parties.append(
+            core.Party(players=players, map=MAPS[map_code], max_size=max_size)
+        )
+    return parties
+
+
+def read_workload(path: str) -> Iterator[list[core.Party]]:
+    """Streams a workload file back as parties queuing in each second.
+
+    Every replay builds new parties, so runs can't see each other's merges."""
+
+    with open(path, "rb", buffering=1 << 20) as f:
+        magic, simulated_secs = WORKLOAD_HEADER.unpack(f.read(WORKLOAD_HEADER.size))
+        if magic != WORKLOAD_MAGIC:
+            raise ValueError(f"{path} is not a workload file")
+
+        t = 0
+        while header := f.read(SECOND_HEADER.size):
+            second, num_parties = SECOND_HEADER.unpack(header)
+            for _ in range(second - t):
+                yield []
+            yield _read_second(f, num_parties)
+            t = second + 1
+
+        for _ in range(simulated_secs - t):
+            yield []
+
+
+def cached_workload(
+    config: WorkloadConfig, simulated_secs: int, seed=0, cache_dir=CACHE_DIR
+) -> str:
+    "Path of the workload file for config and seed, generated on first use"
+    path = os.path.join(cache_dir, f"{config.key(seed, simulated_secs)}.bin")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # written under another name so parallel runs never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        write_workload(
+            tmp_path, generate_workload(config, simulated_secs, seed), simulated_secs
+        )
+        os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Generates a matchmaking workload")
+
+    parser.add_argument(
+        "--simulated_secs", type=int, default=3600, help="Seconds of traffic."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the traffic.")
+    parser.add_argument(
+        "--arrival_rate", type=float, default=1.5, help="Mean parties per second."
+    )
+    parser.add_argument(
+        "--diurnal_amplitude",
+        type=float,
+        default=0.0,
+        help="Fraction the rate swings around its mean over a day, 0 to 1.",
+    )
+    parser.add_argument(
+        "--surge",
+        type=float,
+        nargs=3,
+        action="append",
+        default=[],
+        metavar=("START", "DURATION", "MULTIPLIER"),
+        help="Multiplies the rate for DURATION seconds from START, repeatable.",
+    )
+    parser.add_argument(
+        "--gear_score_distribution",
+        type=str,
+        default="uniform",
+        choices=GEAR_SCORE_DISTRIBUTIONS,
+        help="How gear scores are drawn.",
+    )
+    parser.add_argument(
+        "--party_size_weights",
+        type=float,
+        nargs=3,
+        default=[1.0, 1.0, 1.0],
+        metavar=("SOLO", "DUO", "TRIO"),
+        help="Relative share of solo, duo and trio queues.",
+    )
+    parser.add_argument(
+        "--maps",
+        type=Map,
+        nargs="+",
+        default=[Map.goblin_caves],
+        help="Maps parties queue on, equally likely.",
+    )
+    parser.add_argument(
+        "--map_rate",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("MAP", "RATE"),
+        help="Queue on MAP at RATE parties per second in a stream of its own, "
+        "repeatable. Replaces --arrival_rate and --maps, other options apply to all.",
+    )
+    parser.add_argument(
+        "--output", type=str, default="workload.bin", help="File to write to."
+    )
+
+    args = parser.parse_args()
+
+    config = WorkloadConfig(
+        arrival_rate=args.arrival_rate,
+        diurnal_amplitude=args.diurnal_amplitude,
+        surges=[(int(start), int(secs), mult) for start, secs, mult in args.surge],
+        gear_score_distribution=args.gear_score_distribution,
+        party_size_weights=dict(zip([1, 2, 3], args.party_size_weights)),
+        map_weights={m: 1.0 for m in args.maps},
+    )
+    if args.map_rate:
+        arrivals = generate_map_workloads(
+            map_configs(config, args.map_rate), args.simulated_secs, seed=args.seed
+        )
+    else:
+        arrivals = generate_workload(config, args.simulated_secs, seed=args.seed)
+    num_parties = write_workload(args.output, arrivals, args.simulated_secs)
+    print(f"{num_parties} parties over {args.simulated_secs}s in {args.output}")
@@ -0,0 +1,363 @@
+import json
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Iterator, NamedTuple, TextIO
+
+import core
+import mmr
+from schema import Job, LobbyStatus, Map
+
+# enum members are stored by position in the binary format
+JOBS = list(Job)
+MAPS = list(Map)
+STATUSES = list(LobbyStatus)
+
+# record kinds in the binary format
+LOBBY_RECORD = 1
+CANCELED_PARTY_RECORD = 2
+
+# kind, map, party_size, status, queue_time, created_at, parties
+LOBBY_HEADER = struct.Struct("<BBBBIIH")
+# kind
+CANCELED_PARTY_HEADER = struct.Struct("<B")
+# map, max_size, players
+PARTY_HEADER = struct.Struct("<BBB")
+# job, level, gear_score
+PLAYER = struct.Struct("<BHH")
+
+
+class ResultsWriter:
+    """Receives lobbies and parties as they leave matchmaking.
+
+    The simulator hands over every started lobby and canceled party as soon as it
+    happens and the lobbies still filling when the run ends. This base writer drops
+    everything, subclasses write it out as it arrives.
+    """
+
+    def write_lobby(self, lobby: core.Lobby):
+        pass
+
+    def write_canceled_party(self, party: core.Party):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultiWriter(ResultsWriter):
+    "Hands everything to several writers in turn"
+
+    def __init__(self, *writers: ResultsWriter):
+        self.writers = writers
+
+    def write_lobby(self, lobby: core.Lobby):
+        for writer in self.writers:
+            writer.write_lobby(lobby)
+
+    def write_canceled_party(self, party: core.Party):
+        for writer in self.writers:
+            writer.write_canceled_party(party)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def _dump_json(o) -> str:
+    "Validates a model on the way out so output matches the schema models"
+    if isinstance(o, (core.Player, core.Party, core.Lobby)):
+        o = o.to_model()
+    return o.model_dump_json()
+
+
+class NDJSONWriter(ResultsWriter):
+    """Writes one json object per line.
+
+    Lines are `{"type": "lobby", "lobby": {...}}` for started and filling lobbies and
+    `{"type": "canceled_party", "party": {...}}` for parties sent back to menu.
+    """
+
+    def __init__(self, path: str):
+        self.file: TextIO = open(path, "w")
+
+    def write_lobby(self, lobby: core.Lobby):
+        self.file.write(f'{{"type": "lobby", "lobby": {_dump_json(lobby)}}}\n')
+
+    def write_canceled_party(self, party: core.Party):
+        self.file.write(f'{{"type": "canceled_party", "party": {_dump_json(party)}}}\n')
+
+    def close(self):
+        self.file.close()
+
+
+def read_ndjson(path: str) -> Iterator[dict]:
+    "Reads back the objects an `NDJSONWriter` wrote, one line at a time"
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class BinaryWriter(ResultsWriter):
+    """Writes fixed-size little-endian records, a fraction of the size of json.
+
+    A lobby is a lobby header followed by its parties, a canceled party is a one
+    byte header followed by the party. Every party is a party header followed by
+    its players. Read back with `read_binary`.
+    """
+
+    def __init__(self, path: str):
+        self.file: BinaryIO = open(path, "wb")
+
+    def write_lobby(self, lobby: core.Lobby):
+        record = [
+            LOBBY_HEADER.pack(
+                LOBBY_RECORD,
+                MAPS.index(lobby.map),
+                lobby.party_size,
+                STATUSES.index(lobby.status),
+                lobby.queue_time,
+                lobby.created_at,
+                len(lobby.parties),
+            )
+        ]
+        for party in lobby.parties:
+            record.append(self._pack_party(party))
+        self.file.write(b"".join(record))
+
+    def write_canceled_party(self, party: core.Party):
+        self.file.write(
+            CANCELED_PARTY_HEADER.pack(CANCELED_PARTY_RECORD) + self._pack_party(party)
+        )
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def _pack_party(party: core.Party) -> bytes:
+        record = [PARTY_HEADER.pack(MAPS.index(party.map), party.max_size, len(party))]
+        for player in party.players:
+            record.append(
+                PLAYER.pack(JOBS.index(player.job), player.level, player.gear_score)
+            )
+        return b"".join(record)
+
+
+def _read_party(f: BinaryIO) -> core.Party:
+    map_code, max_size, num_players = PARTY_HEADER.unpack(f.read(PARTY_HEADER.size))
+
+    players = []
+    for job_code, level, gear_score in PLAYER.iter_unpack(
+        f.read(PLAYER.size * num_players)
+    ):
+        players.append(
+            core.Player(job=JOBS[job_code], level=level, gear_score=gear_score)
+        )
+
+    return core.Party(players=players, map=MAPS[map_code], max_size=max_size)
+
+
+def read_binary(path: str) -> Iterator[core.Lobby | core.Party]:
+    "Streams back lobbies and canceled parties a `BinaryWriter` wrote, in order"
+    with open(path, "rb") as f:
+        while kind := f.read(CANCELED_PARTY_HEADER.size):
+            if kind[0] == CANCELED_PARTY_RECORD:
+                yield _read_party(f)
+                continue
+
+            header = kind + f.read(LOBBY_HEADER.size - len(kind))
+            (
+                _,
+                map_code,
+                party_size,
+                status_code,
+                queue_time,
+                created_at,
+                num_parties,
+            ) = LOBBY_HEADER.unpack(header)
+
+            yield core.Lobby(
+                parties=[_read_party(f) for _ in range(num_parties)],
+                map=MAPS[map_code],
+                party_size=party_size,
+                queue_time=queue_time,
+                created_at=created_at,
+                status=STATUSES[status_code],
+            )
+
+
+class LobbyRecord(NamedTuple):
+    "What a `LobbyArchive` keeps of a lobby"
+
+    map: Map
+    party_size: int
+    status: LobbyStatus
+    created_at: int
+    # seconds the lobby was filling, its wait time
+    queue_time: int
+    players: int
+    mmr_min: float
+    mmr_max: float
+
+    @property
+    def started_at(self) -> int:
+        return self.created_at + self.queue_time
+
+    @property
+    def mmr_spread(self) -> float:
+        return self.mmr_max - self.mmr_min
+
+
+class CanceledRecord(NamedTuple):
+    "What a `LobbyArchive` keeps of a canceled party"
+
+    map: Map
+    max_size: int
+    players: int
+    mmr: float
+
+
+# magic, version, lobbies, canceled parties, followed by the columns in order
+ARCHIVE_HEADER = struct.Struct("<4sHII")
+ARCHIVE_MAGIC = b"MMAR"
+ARCHIVE_VERSION = 1
+# typecodes of the lobby columns, in LobbyRecord order
+LOBBY_COLUMNS = "BBBIIHff"
+# typecodes of the canceled party columns, in CanceledRecord order
+CANCELED_COLUMNS = "BBBf"
+
+
+class LobbyArchive(ResultsWriter):
+    """Keeps a fixed-size summary record of every lobby and canceled party.
+
+    A record is a couple dozen bytes in preallocated arrays, one per field, instead
+    of the lobby with all its parties and players. Run the simulator with
+    `retain=False` and an archive as writer to keep memory per finished lobby an
+    order of magnitude lower. Mmr ranges are taken with `mmr_method`.
+
+    With a path the records are written there on close, read back with
+    `read_archive`.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        mmr_method: str | mmr.MMRStrategy = "max_gs",
+        capacity=4096,
+    ):
+        self.path = path
+        self.mmr_fn = mmr.resolve(mmr_method).party_mmr
+        self.lobby_columns = [array(code, [0]) * capacity for code in LOBBY_COLUMNS]
+        self.canceled_columns = [
+            array(code, [0]) * capacity for code in CANCELED_COLUMNS
+        ]
+        self.num_lobbies = 0
+        self.num_canceled = 0
+
+    def __len__(self) -> int:
+        return self.num_lobbies
+
+    def write_lobby(self, lobby: core.Lobby):
+        mmrs = [self.mmr_fn(party) for party in lobby.parties]
+        self.num_lobbies = _append_row(
+            self.lobby_columns,
+            self.num_lobbies,
+            (
+                MAPS.index(lobby.map),
+                lobby.party_size,
+                STATUSES.index(lobby.status),
+                lobby.created_at,
+                lobby.queue_time,
+                lobby.current_player_count(),
+                min(mmrs, default=0),
+                max(mmrs, default=0),
+            ),
+        )
+
+    def write_canceled_party(self, party: core.Party):
+        self.num_canceled = _append_row(
+            self.canceled_columns,
+            self.num_canceled,
+            (MAPS.index(party.map), party.max_size, len(party), self.mmr_fn(party)),
+        )
+
+    def lobbies(self) -> Iterator[LobbyRecord]:
+        "Archived lobbies in the order they were written"
+        columns = [column[: self.num_lobbies] for column in self.lobby_columns]
+        for map_code, party_size, status_code, *rest in zip(*columns):
+            yield LobbyRecord(MAPS[map_code], party_size, STATUSES[status_code], *rest)
+
+    def canceled_parties(self) -> Iterator[CanceledRecord]:
+        "Archived canceled parties in the order they were written"
+        columns = [column[: self.num_canceled] for column in self.canceled_columns]
+        for map_code, *rest in zip(*columns):
+            yield CanceledRecord(MAPS[map_code], *rest)
+
+    def nbytes(self) -> int:
+        "Bytes the record arrays take up, preallocated room included"
+        columns = self.lobby_columns + self.canceled_columns
+        return sum(len(column) * column.itemsize for column in columns)
+
+    def close(self):
+        if self.path is None:
+            return
+        with open(self.path, "wb") as f:
+            f.write(
+                ARCHIVE_HEADER.pack(
+                    ARCHIVE_MAGIC, ARCHIVE_VERSION, self.num_lobbies, self.num_canceled
+                )
+            )
+            for columns, length in (
+                (self.lobby_columns, self.num_lobbies),
+                (self.canceled_columns, self.num_canceled),
+            ):
+                for column in columns:
+                    column = column[:length]
+                    if sys.byteorder == "big":
+                        column.byteswap()
+                    f.write(column.tobytes())
+
+
+def _append_row(columns: list[array], length: int, row: tuple) -> int:
+    "Sets row at index length, doubling every column when full, returns new length"
+    if length == len(columns[0]):
+        for column in columns:
+            column.extend(array(column.typecode, [0]) * max(length, 1))
+    for column, value in zip(columns, row):
+        column[length] = value
+    return length + 1
+
+
+def read_archive(path: str) -> LobbyArchive:
+    "Loads the records a `LobbyArchive` wrote"
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, num_lobbies, num_canceled = ARCHIVE_HEADER.unpack_from(data)
+    if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+        raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} lobby archive")
+
+    archive = LobbyArchive(capacity=0)
+    offset = ARCHIVE_HEADER.size
+    for columns, length in (
+        (archive.lobby_columns, num_lobbies),
+        (archive.canceled_columns, num_canceled),
+    ):
+        for column in columns:
+            end = offset + length * column.itemsize
+            column.frombytes(data[offset:end])
+            if sys.byteorder == "big":
+                column.byteswap()
+            offset = end
+    archive.num_lobbies = num_lobbies
+    archive.num_canceled = num_canceled
+    return archive
+
+
+WRITERS = {"ndjson": NDJSONWriter, "binary": BinaryWriter, "archive": LobbyArchive}